@@ -22,7 +22,8 @@ from .utils import (
     TargetRight,
     TargetIdx,
     matrix_focus,
-    np_check_sorted,
+    matrix_stack,
+    matrix_stack_fill,
     str_m,
 )
 
@@ -98,31 +99,29 @@ class MatrixAtsBase(Element):
     def matrix_target_to_z_single(self, tidx1, z_m, invert = False):
         raise NotImplementedError()
 
+    def matrix_target_to_z_stack(self, tidx1, z_m, invert = False):
+        """
+        Matrices from tidx1 to each of z_m, as a (z_m.shape + (2, 2)) array. This generic form evaluates
+        the points one at a time, the components override it with array operations.
+        """
+        z_m = np.asarray(z_m)
+        mats = np.empty(z_m.shape + (2, 2))
+        it = np.nditer(z_m, flags = ['multi_index'])
+        while not it.finished:
+            mats[it.multi_index] = self.matrix_target_to_z_single(tidx1, it.value, invert = invert)
+            it.iternext()
+        return mats
+
     def matrix_target_to_z(self, tidx1, z_m, fill, invert = False):
         z_m = np.asarray(z_m)
         if len(z_m.shape) > 0:
-            if len(z_m.shape) == 1 and np_check_sorted(z_m):
-                return self.matrix_target_to_z_linsorted(tidx1, z_m, fill, invert = invert)
-
-            fill_reshape = fill.reshape(2, 2, -1)
-            idx_remux = np.indices(z_m.shape)
-            idx_remux = idx_remux.reshape(len(z_m.shape), -1)
-            z_m = z_m.reshape(-1)
-            sidx = np.argsort(z_m)
-            z_m = z_m[sidx]
-            idx_remux = idx_remux[:, sidx]
-            self.matrix_target_to_z_linsorted(tidx1, z_m, fill_reshape, invert = invert)
-            fill = fill_reshape[(slice(None), slice(None)) + tuple(idx_remux[i] for i in range(idx_remux.shape[0]))]
-            return
+            return matrix_stack_fill(fill, self.matrix_target_to_z_stack(tidx1, z_m, invert = invert))
         else:
-            return self.matrix_target_to_z_single(z_m)
+            return self.matrix_target_to_z_single(tidx1, z_m, invert = invert)
 
     def matrix_target_to_z_linsorted(self, tidx1, z_m, fill, invert = False):
-        it = np.nditer(z_m, flags = ['multi_index'])
-        while not it.finished:
-            fill[(slice(None), slice(None)) + it.multi_index] = self.matrix_target_to_z_single(tidx1, it.value)
-            it.iternext()
-        return fill
+        #the stacks don't need sorted positions, kept for the callers ordering them
+        return matrix_stack_fill(fill, self.matrix_target_to_z_stack(tidx1, z_m, invert = invert))
 
     @declarative.mproperty
     def constraints(self):
@@ -170,11 +169,9 @@ class ThinBase(MatrixAtsBase, declarative.OverridableObject):
         else:
             return self.matrix_inv
 
-    def matrix_target_to_z(self, tidx1, z_m, fill, invert = False):
-        return self.matrix_target_to_z_linsorted(self, z_m, fill, invert = invert)
-
-    def matrix_target_to_z_linsorted(self, tidx1, z_m, fill, invert = False):
-        if not all(z_m == 0):
+    def matrix_target_to_z_stack(self, tidx1, z_m, invert = False):
+        z_m = np.asarray(z_m)
+        if np.any(z_m != 0):
             raise RuntimeError("Only located at 0")
 
         #invert if viewing from the right
@@ -182,10 +179,9 @@ class ThinBase(MatrixAtsBase, declarative.OverridableObject):
             invert = not invert
 
         if not invert:
-            fill[:, :, ...] = self.matrix
+            return matrix_stack(self.matrix, z_m.shape)
         else:
-            fill[:, :, ...] = self.matrix_inv
-        return
+            return matrix_stack(self.matrix_inv, z_m.shape)
 
     def target_pos(self, target):
         return 0
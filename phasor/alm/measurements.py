@@ -23,7 +23,6 @@ from .utils import (
     TargetLeft,
     TargetRight,
     TargetIdx,
-    np_check_sorted,
     unit_str,
 )
 
@@ -112,9 +111,6 @@ class Measurements(Element):
         z_m = np.asarray(z_m)
         if len(z_m.shape) == 0:
             mat = self.layout.matrix_target_to_z_single(TargetLeft, z_m)
-        elif np_check_sorted(z_m):
-            fill = np.empty((2, 2) + z_m.shape)
-            mat = self.layout.matrix_target_to_z_linsorted(TargetLeft, z_m, fill)
         else:
             mat = self.matrix_at(z_m)
         q = self.input_q.propagate_matrix(mat)
@@ -178,11 +174,9 @@ class Measurements(Element):
         z_m = np.asarray(z_m)
         if len(z_m.shape) == 0:
             mat = self.layout.matrix_target_to_z_single(tidx_beam, z_m)
-        elif np_check_sorted(z_m):
-            fill = np.empty((2, 2) + z_m.shape)
-            mat = self.layout.matrix_target_to_z_linsorted(tidx_beam, z_m, fill)
         else:
-            mat = self.matrix_at(z_m)
+            fill = np.empty((2, 2) + z_m.shape)
+            mat = self.layout.matrix_target_to_z(tidx_beam, z_m, fill)
         target_obj = self.layout.target_obj(tidx_beam)
         q_in = target_obj.beam_q
         q = q_in.propagate_matrix(mat)
@@ -193,9 +187,9 @@ class Measurements(Element):
         z_m = np.asarray(z_m)
         if len(z_m.shape) == 0:
             mat = self.layout.matrix_target_to_z_single(tidx, z_m)
-        elif np_check_sorted(z_m):
+        else:
             fill = np.empty((2, 2) + z_m.shape)
-            mat = self.layout.matrix_target_to_z_linsorted(tidx, z_m, fill)
+            mat = self.layout.matrix_target_to_z(tidx, z_m, fill)
         return mat
 
     def mat_target_between(self, tname1, tname2):
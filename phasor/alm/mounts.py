@@ -170,6 +170,34 @@ class MountBase(
             else:
                 raise NotImplementedError()
 
+    def matrix_target_to_z_stack(
+            self,
+            tidx1,
+            z_m,
+            invert = False,
+    ):
+        if tidx1 == TargetLeft:
+            return np.matmul(
+                self.subsystem.matrix_target_to_z_stack(TargetLeft, z_m, invert = invert),
+                np.asarray(self.matrix_detune_left()),
+            )
+        elif tidx1 == TargetRight:
+            return np.matmul(
+                self.subsystem.matrix_target_to_z_stack(TargetRight, z_m, invert = invert),
+                np.asarray(self.matrix_detune_right(inverse = True)),
+            )
+        else:
+            tidx1_outer = tidx1[-1]
+            if tidx1_outer != 0:
+                tidx1_inner = TargetIdx(tidx1[:-1])
+                return self.subsystem.matrix_target_to_z_stack(
+                    tidx1_inner,
+                    z_m,
+                    invert = invert,
+                )
+            else:
+                raise NotImplementedError()
+
     @declarative.mproperty
     def constraints(self):
         return self.subsystem.constraints
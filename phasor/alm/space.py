@@ -13,6 +13,7 @@ from .utils import (
     TargetLeft,
     TargetRight,
     TargetIdx,
+    matrix_stack_space,
     str_m,
 )
 
@@ -76,26 +77,20 @@ class Space(bases.MatrixAtsBase, declarative.OverridableObject):
                 [0, 1],
             ])
 
-    def matrix_target_to_z(self, tidx1, z_m, fill, invert = False):
-        return self.matrix_target_to_z_linsorted(self, z_m, fill, invert = invert)
-
-    def matrix_target_to_z_linsorted(self, tidx1, z_m, fill, invert = False):
-        if not all(z_m == 0):
-            raise RuntimeError("Only located at 0")
+    def matrix_target_to_z_stack(self, tidx1, z_m, invert = False):
+        z_m = np.asarray(z_m)
+        if np.any(z_m < 0) or np.any(z_m > self.L_m.val):
+            raise RuntimeError("Outside of size of space")
 
         #invert if viewing from the right
         if tidx1 == TargetRight:
             invert = not invert
 
-        n = self.root.env_substrate.n(self)
-        fill[0, 0, ...] = 1
-        fill[1, 1, ...] = 1
-        fill[1, 0, ...] = 0
+        n = self.substrate.n(self)
         if not invert:
-            fill[0, 1, ...] = z_m / n
+            return matrix_stack_space(z_m / n)
         else:
-            fill[0, 1, ...] = (z_m - self.L_m.val) / n
-        return
+            return matrix_stack_space((z_m - self.L_m.val) / n)
 
     def target_pos(self, tidx1):
         if tidx1 == TargetLeft:
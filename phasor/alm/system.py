@@ -19,6 +19,7 @@ from .utils import (
     TargetRight,
     TargetIdx,
     matrix_space,
+    matrix_stack_space,
 )
 
 from . import bases
@@ -377,6 +378,98 @@ class System(
                 return comp.matrix_target_to_z_single(tidx1_inner, z_m - pos_L, invert = invert)
             return mat
 
+    def matrix_target_to_z_stack(self, tidx1, z_m, invert = False):
+        """
+        Array form of matrix_target_to_z_single. The chain of component matrices is built once per
+        component, and each component propagates all of the points it holds in one call.
+        """
+        z_m = np.asarray(z_m)
+        if tidx1 == TargetLeft:
+            mats = self.matrix_at_stack(z_m)
+            if invert:
+                mats = np.linalg.inv(mats)
+            return mats
+        elif tidx1 == TargetRight:
+            #not nice numerically
+            mats = self.matrix_at_stack(z_m)
+            mat_full = np.asarray(self.matrix)
+            if not invert:
+                return np.matmul(mats, np.linalg.inv(mat_full))
+            else:
+                return np.matmul(np.linalg.inv(mats), mat_full)
+
+        tidx1_outer = tidx1[-1]
+        tidx1_inner = TargetIdx(tidx1[:-1])
+        comp = self.filled_list[tidx1_outer]
+        pos_L = self.positions_list[tidx1_outer]
+        pos_R = self.positions_list[tidx1_outer+1]
+        mats = np.empty(z_m.shape + (2, 2))
+
+        select = (z_m >= pos_L) & (z_m <= pos_R)
+        if np.any(select):
+            mats[select] = comp.matrix_target_to_z_stack(tidx1_inner, z_m[select] - pos_L, invert = invert)
+
+        select = z_m < pos_L
+        if np.any(select):
+            z_sel = z_m[select]
+            idx_z_comp = np.searchsorted(
+                self.positions_list,
+                z_sel, side = 'left',
+            ) - 1
+            mats_sel = np.empty(z_sel.shape + (2, 2))
+            #walks left, mat holds the matrix to the right edge of subcomp
+            mat = np.asarray(comp.matrix_between(tidx1_inner, TargetLeft))
+            for idx_comp in range(tidx1_outer - 1, -1, -1):
+                subcomp = self.filled_list[idx_comp]
+                sub_select = idx_z_comp == idx_comp
+                if np.any(sub_select):
+                    mats_sel[sub_select] = np.matmul(
+                        subcomp.matrix_target_to_z_stack(
+                            TargetRight,
+                            z_sel[sub_select] - self.positions_list[idx_comp],
+                        ),
+                        mat,
+                    )
+                mat = np.asarray(subcomp.matrix_inv).dot(mat)
+            sub_select = idx_z_comp < 0
+            if np.any(sub_select):
+                mats_sel[sub_select] = np.matmul(
+                    matrix_stack_space(z_sel[sub_select] - self.positions_list[0]),
+                    mat,
+                )
+            mats[select] = mats_sel
+
+        select = z_m > pos_R
+        if np.any(select):
+            z_sel = z_m[select]
+            idx_z_comp = np.searchsorted(
+                self.positions_list,
+                z_sel, side = 'right',
+            ) - 1
+            mats_sel = np.empty(z_sel.shape + (2, 2))
+            #walks right, mat holds the matrix to the left edge of subcomp
+            mat = np.asarray(comp.matrix_between(tidx1_inner, TargetRight))
+            for idx_comp in range(tidx1_outer + 1, len(self.filled_list)):
+                subcomp = self.filled_list[idx_comp]
+                sub_select = idx_z_comp == idx_comp
+                if np.any(sub_select):
+                    mats_sel[sub_select] = np.matmul(
+                        subcomp.matrix_target_to_z_stack(
+                            TargetLeft,
+                            z_sel[sub_select] - self.positions_list[idx_comp],
+                        ),
+                        mat,
+                    )
+                mat = np.asarray(subcomp.matrix).dot(mat)
+            sub_select = idx_z_comp >= len(self.filled_list)
+            if np.any(sub_select):
+                mats_sel[sub_select] = np.matmul(
+                    matrix_stack_space(z_sel[sub_select] - self.positions_list[-1]),
+                    mat,
+                )
+            mats[select] = mats_sel
+        return mats
+
     def target_obj(self, tidx1):
         tidx1_outer = tidx1[-1]
         tidx1_inner = TargetIdx(tidx1[:-1])
@@ -411,6 +504,38 @@ class System(
             mat = matrix_space(z_m - self.positions_list[-1]) * self.matrix
         return mat
 
+    def matrix_at_stack(self, z_m):
+        """
+        Array form of matrix_at_single
+        """
+        z_m = np.asarray(z_m)
+        if self.offset_m is not None:
+            z_m = z_m + self.offset_m
+
+        mat_list = self.component_matrix_list
+        idx_m = np.searchsorted(
+            self.positions_list,
+            z_m, side = 'right',
+        ) - 1
+        mats = np.empty(z_m.shape + (2, 2))
+        select = idx_m < 0
+        if np.any(select):
+            mats[select] = matrix_stack_space(z_m[select])
+        for idx_comp in np.unique(idx_m[(idx_m >= 0) & (idx_m < len(self.filled_list))]):
+            select = idx_m == idx_comp
+            comp = self.filled_list[idx_comp]
+            mats[select] = np.matmul(
+                comp.matrix_target_to_z_stack(TargetLeft, z_m[select] - self.positions_list[idx_comp]),
+                np.asarray(mat_list[idx_comp]),
+            )
+        select = idx_m >= len(self.filled_list)
+        if np.any(select):
+            mats[select] = np.matmul(
+                matrix_stack_space(z_m[select] - self.positions_list[-1]),
+                np.asarray(self.matrix),
+            )
+        return mats
+
     def system_data_targets(self, typename):
         dmap = {}
         for subidx, comp in enumerate(self.filled_list):
@@ -41,6 +41,33 @@ def matrix_space(L_m):
     ])
 
 
+def matrix_stack(mat, shape):
+    """
+    (shape + (2, 2)) array repeating the 2x2 matrix mat, as a read-only view
+    """
+    return np.broadcast_to(np.asarray(mat), tuple(shape) + (2, 2))
+
+
+def matrix_stack_space(L_m):
+    """
+    (L_m.shape + (2, 2)) array of the space propagation matrices
+    """
+    L_m = np.asarray(L_m)
+    mats = np.zeros(L_m.shape + (2, 2), dtype = np.result_type(L_m, float))
+    mats[..., 0, 0] = 1
+    mats[..., 0, 1] = L_m
+    mats[..., 1, 1] = 1
+    return mats
+
+
+def matrix_stack_fill(fill, mats):
+    """
+    Writes the (..., 2, 2) stack mats into fill, which holds the matrix indices first
+    """
+    fill[...] = np.moveaxis(mats, (-2, -1), (0, 1))
+    return fill
+
+
 def matrix_focus(f_m, dL = 0):
     if f_m is None:
         mat = np.matrix([
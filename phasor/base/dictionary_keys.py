@@ -1,31 +1,60 @@
 # -*- coding: utf-8 -*-
+"""
+Keys of the graph nodes. Both classes are interned, so that equal keys are the same object, carrying a
+small integer id. Hashing returns the id and equality is identity, which is what the seq/req/edge_map
+dictionaries spend most of their key comparisons on.
+"""
 from __future__ import division, print_function, unicode_literals
 from ..utilities.future_from_2 import str, object, repr_compat
 
 from collections import Mapping as MappingABC
+import itertools
+import weakref
 import declarative
 
 
+#(class, frozenset of items) -> key. Weak, so that keys of discarded systems don't accumulate
+_intern_table = weakref.WeakValueDictionary()
+_id_counter = itertools.count()
+
+
+def key_intern(cls, kdict, **kwargs):
+    """
+    The interned key of class cls holding the dictionary kdict. kdict must not be modified afterwards.
+    """
+    ikey = (cls, frozenset(kdict.items()))
+    key = _intern_table.get(ikey, None)
+    if key is None:
+        key = object.__new__(cls)
+        key._init(kdict, next(_id_counter))
+        _intern_table[ikey] = key
+    return key
+
+
 class DictKey(MappingABC):
-    __slots__ = ('_dict', 'prev_hash')
-    def __init__(self, *args, **kwargs):
-        self._dict = kwargs
+    __slots__ = ('_dict', 'id', '_op_cache', '__weakref__')
+    def __new__(cls, *args, **kwargs):
+        kdict = kwargs
         if args:
-            self._dict.update(args[0])
+            kdict.update(args[0])
+        return key_intern(cls, kdict)
+
+    def _init(self, kdict, id):
+        self._dict = kdict
+        self.id = id
+        self._op_cache = dict()
+
+    def __reduce__(self):
+        #reinterned on unpickling
+        return (self.__class__, (self._dict,))
 
     def copy_update(self, **kwargs):
         newdict = dict(self._dict)
         newdict.update(**kwargs)
-        return self.__class__(**newdict)
+        return key_intern(self.__class__, newdict)
 
     def __hash__(self):
-        try:
-            return self.prev_hash
-        except AttributeError:
-            pass
-        l = tuple(sorted(self._dict.items()))
-        self.prev_hash = hash(l)
-        return self.prev_hash
+        return self.id
 
     def __iter__(self):
         return iter(self._dict)
@@ -42,9 +71,11 @@ class DictKey(MappingABC):
         return len(self._dict)
 
     def __eq__(self, other):
-        if not isinstance(other, self.__class__):
-            return False
-        return self._dict == other._dict
+        #interned
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
 
     def __lt__(self, other):
         if not isinstance(other, self.__class__):
@@ -62,9 +93,16 @@ class DictKey(MappingABC):
         return ("DK{{{0}}}".format('|'.join(l2)))
 
     def __or__(self, other):
+        ckey = ('|', other.id)
+        try:
+            return self._op_cache[ckey]
+        except KeyError:
+            pass
         cp = dict(self._dict)
         cp.update(other._dict)
-        return self.__class__(cp)
+        ret = key_intern(self.__class__, cp)
+        self._op_cache[ckey] = ret
+        return ret
 
     def iteritems(self):
         return list(self._dict.items())
@@ -84,7 +122,7 @@ class DictKey(MappingABC):
         for k, v in list(smaller.items()):
             if larger.kv_contains(k, v):
                 newdict[k] = v
-        return self.__class__(**newdict)
+        return key_intern(self.__class__, newdict)
 
     def contains(self, other):
         for k, v in list(other.items()):
@@ -96,7 +134,7 @@ class DictKey(MappingABC):
         cp = dict(self._dict)
         for key in keys:
             del cp[key]
-        return self.__class__(**cp)
+        return key_intern(self.__class__, cp)
 
     def purge_keys(self, *keys):
         cp = dict(self._dict)
@@ -105,7 +143,7 @@ class DictKey(MappingABC):
                 del cp[key]
             except KeyError:
                 pass
-        return self.__class__(**cp)
+        return key_intern(self.__class__, cp)
 
     def replace_keys(self, key_dict, *more_key_dicts):
         cp = dict(self._dict)
@@ -115,7 +153,7 @@ class DictKey(MappingABC):
             for key_dict in more_key_dicts:
                 for key, val in list(key_dict.items()):
                     cp[key] = val
-        return self.__class__(**cp)
+        return key_intern(self.__class__, cp)
 
     def subkey_has(self, other):
         try:
@@ -132,7 +170,7 @@ class DictKey(MappingABC):
         for k, v in list(other._dict.items()):
             assert(cp[k] == v)
             del cp[k]
-        return self.__class__(cp)
+        return key_intern(self.__class__, cp)
 
     def __deepcopy__(self, memo):
         #by the immutibility of this object and anything it stores, it is OK to return the same thing
@@ -144,20 +182,24 @@ class DictKey(MappingABC):
 
 
 class FrequencyKey(object):
-    __slots__ = ('F_dict', 'prev_hash', 'prev_tup')
-    def __init__(self, F_dict):
+    __slots__ = ('F_dict', 'id', 'prev_tup', '_op_cache', '__weakref__')
+    def __new__(cls, F_dict):
+        return key_intern(cls, dict(F_dict))
+
+    def _init(self, F_dict, id):
         self.F_dict = F_dict
+        self.id = id
+        self._op_cache = dict()
+
+    def __reduce__(self):
+        #reinterned on unpickling
+        return (self.__class__, (self.F_dict,))
 
     def DC_is(self):
         return not self.F_dict
 
     def __hash__(self):
-        try:
-            return self.prev_hash
-        except AttributeError:
-            pass
-        self.prev_hash = hash(self.hash_tuple())
-        return self.prev_hash
+        return self.id
 
     def hash_tuple(self):
         try:
@@ -168,9 +210,11 @@ class FrequencyKey(object):
         return self.prev_tup
 
     def __eq__(self, other):
-        if not isinstance(other, self.__class__):
-            return False
-        return self.F_dict == other.F_dict
+        #interned
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
 
     def __getitem__(self, F):
         return self.F_dict[F]
@@ -200,6 +244,11 @@ class FrequencyKey(object):
         return ''.join(flist)
 
     def __add__(self, other):
+        ckey = ('+', other.id)
+        try:
+            return self._op_cache[ckey]
+        except KeyError:
+            pass
         F_dict = dict(self.F_dict)
         for F, n in list(other.F_dict.items()):
             current_idx = self.F_dict.get(F, 0)
@@ -208,9 +257,16 @@ class FrequencyKey(object):
                 del F_dict[F]
             else:
                 F_dict[F] = new_idx
-        return self.__class__(F_dict)
+        ret = key_intern(self.__class__, F_dict)
+        self._op_cache[ckey] = ret
+        return ret
 
     def __sub__(self, other):
+        ckey = ('-', other.id)
+        try:
+            return self._op_cache[ckey]
+        except KeyError:
+            pass
         F_dict = dict(self.F_dict)
         for F, n in list(other.F_dict.items()):
             current_idx = self.F_dict.get(F, 0)
@@ -219,18 +275,20 @@ class FrequencyKey(object):
                 del F_dict[F]
             else:
                 F_dict[F] = new_idx
-        return self.__class__(F_dict)
+        ret = key_intern(self.__class__, F_dict)
+        self._op_cache[ckey] = ret
+        return ret
 
     def __rmul__(self, other):
         F_dict = dict()
         for F, n in list(self.F_dict.items()):
             F_dict[F] = other * n
-        return self.__class__(F_dict)
+        return key_intern(self.__class__, F_dict)
 
     def __neg__(self):
         F_dict = dict()
         for F, n in list(self.F_dict.items()):
             current_idx = self.F_dict[F]
             F_dict[F] = -current_idx
-        return self.__class__(F_dict)
+        return key_intern(self.__class__, F_dict)
 
@@ -124,7 +124,10 @@ class ElementRefValue(SimpleUnitfulGroup, Element):
             return None
 
     @declarative.dproperty
-    def val(self):
+    def val(self, val = declarative.NOARG, val_prev = declarative.NOARG):
+        if val_prev is not declarative.NOARG:
+            #replaced after construction, as by BGSystem.element_update
+            return val
         val = self.ctree.val
         if val is not None:
             return val * self.ctree_units_scale
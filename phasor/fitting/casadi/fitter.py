@@ -22,6 +22,7 @@ from ...base.autograft import (
 
 from .base import (
     FitterBase,
+    casadi_sparsity_ravel,
 )
 
 
@@ -29,6 +30,8 @@ class FitterRoot(RootElement, FitterBase):
 
     casadi_sol_obj = None
     sequence_N = 0
+    #code-generate the compiled functions to C, loaded as shared objects (needs a C compiler)
+    function_jit = False
 
     @declarative.mproperty
     def _system_map(self, val = declarative.NOARG):
@@ -100,6 +103,7 @@ class FitterRoot(RootElement, FitterBase):
             ctree.hints.symbolic = 'casadi'
             ctree.hints.symbolic_fiducials = self.symbol_fiducials
             ctree.hints.symbolic_fiducial_substitute = self.symbol_fiducial_substitute
+            ctree.hints.symbolic_fiducial_substitute_batch = self.symbol_fiducial_substitute_batch
 
             #TODO this maybe should be in a hints section (up to subsystems)
             ctree.symbols.math = dmath
@@ -308,37 +312,123 @@ class FitterRoot(RootElement, FitterBase):
         """
         return dict(zip(self.symbol_map.sym_list, self.symbol_map.ival_list))
 
-    def symbol_fiducial_substitute(self, expr):
+    @declarative.mproperty(simple_delete = True)
+    @invalidate_auto
+    def symbol_fiducial_lists(self):
+        """
+        The fiducial symbols and their values, as the lists taken by casadi.graph_substitute
+        """
         keys = []
         vals = []
-        a = casadi.MX.sym('a')
         for k, v in self.symbol_fiducials.items():
             keys.append(k)
             vals.append(v)
+        return keys, vals
+
+    @declarative.mproperty(simple_delete = True)
+    @invalidate_auto
+    def compiled_functions(self):
+        """
+        The casadi Functions built by function_compile, by key
+        """
+        return dict()
+
+    def function_compile(self, key, expr):
+        """
+        Compiles expr (a casadi expression of the fit symbols, or a Complex of them) into a casadi Function
+        from the parameter vector to the real and imaginary parts. The result is cached by key for this
+        generation of the root. Returns a Bunch of the Function and of expr rebuilt as a call to it, so
+        that the NLP evaluates and differentiates the compiled graph.
+        """
+        cbunch = self.compiled_functions.get(key, None)
+        if cbunch is not None:
+            return cbunch
+
+        x = casadi_sparsity_ravel(self.symbol_map.sym_list)
         if isinstance(expr, Complex):
-            rval = casadi.graph_substitute(
-                expr.real,
-                keys,
-                vals,
-            )
-            rval = casadi.Function('x', [a], [rval])(0)
-            rval = np.asarray(rval).squeeze()
-            ival = casadi.graph_substitute(
-                expr.imag,
-                keys,
-                vals,
-            )
-            ival = casadi.Function('x', [a], [ival])(0)
-            ival = np.asarray(ival).squeeze()
-            return rval + 1j*ival
+            parts = [expr.real, expr.imag]
+        else:
+            parts = [expr, 0]
+        parts = [part if isinstance(part, casadi.MX) else casadi.MX(np.asarray(part)) for part in parts]
+
+        if self.function_jit:
+            opts = dict(jit = True, compiler = 'shell', jit_options = dict(flags = ['-O2']))
         else:
-            rval = casadi.graph_substitute(
-                expr,
-                keys,
-                vals,
+            opts = dict()
+        function = casadi.Function(
+            'fit_function_{0}'.format(len(self.compiled_functions)),
+            [x], parts,
+            ['x'], ['real', 'imag'],
+            opts,
+        )
+        real, imag = function.call([x])
+        cbunch = declarative.Bunch(
+            key      = key,
+            x        = x,
+            function = function,
+            jacobian = None,
+            expr     = Complex(real, imag),
+        )
+        self.compiled_functions[key] = cbunch
+        return cbunch
+
+    def function_jacobian(self, key):
+        """
+        casadi Function from the parameter vector to the Jacobians of the real and imaginary parts of a
+        compiled function, built on the first request.
+        """
+        cbunch = self.compiled_functions[key]
+        if cbunch.jacobian is None:
+            real, imag = cbunch.function.call([cbunch.x])
+            cbunch.jacobian = casadi.Function(
+                cbunch.function.name() + '_jac',
+                [cbunch.x], [casadi.jacobian(real, cbunch.x), casadi.jacobian(imag, cbunch.x)],
+                ['x'], ['real', 'imag'],
             )
-            rval = casadi.Function('x', [a], [rval])(0)
-            rval = np.asarray(rval).squeeze()
-            return rval
+        return cbunch.jacobian
 
+    def symbol_fiducial_substitute(self, expr):
+        return self.symbol_fiducial_substitute_batch([expr])[0]
 
+    def symbol_fiducial_substitute_batch(self, exprs):
+        """
+        Substitutes the fiducials into each of exprs, returning the list of numeric values. All of the
+        expressions go through a single graph substitution and a single casadi Function call.
+        """
+        keys, vals = self.symbol_fiducial_lists
+        #the symbolic parts (real and imaginary) are gathered as the outputs of one Function,
+        #layout holds for each part either its output index or its numeric value
+        parts = []
+        layout = []
+
+        def part_add(part):
+            if isinstance(part, casadi.MX):
+                parts.append(part)
+                return (True, len(parts) - 1)
+            return (False, part)
+
+        for expr in exprs:
+            if isinstance(expr, Complex):
+                layout.append((part_add(expr.real), part_add(expr.imag)))
+            else:
+                layout.append((part_add(expr), None))
+
+        if parts:
+            a = casadi.MX.sym('a')
+            parts = casadi.graph_substitute(parts, keys, vals)
+            parts = casadi.Function('x', [a], parts).call([0])
+            parts = [np.asarray(part).squeeze() for part in parts]
+
+        def part_value(part_layout):
+            is_sym, val = part_layout
+            if is_sym:
+                return parts[val]
+            return np.asarray(val).squeeze()
+
+        values = []
+        for real_layout, imag_layout in layout:
+            if imag_layout is None:
+                values.append(part_value(real_layout))
+            else:
+                values.append(part_value(real_layout) + 1j*part_value(imag_layout))
+        return values
@@ -60,6 +60,13 @@ class TransferACExpression(FitterExpression):
             return self.SNR_weights
         return np.asarray(val)
 
+    @declarative.dproperty
+    def compiled(self, val = True):
+        """
+        Evaluate the readout through a single casadi Function (see FitterRoot.function_compile)
+        """
+        return val
+
     @declarative.dproperty
     def residuals_model(self, val = 'direct'):
         assert(val in ['bias_balance', 'direct', 'subtract', 'magnitude'])
@@ -80,6 +87,11 @@ class TransferACExpression(FitterExpression):
         SNR_phase_weights[SNR_phase_weights < self.SNR_limit] = 0
 
         remapped_readout = xfer[self.ACReadout].AC_sensitivity
+        if self.compiled:
+            remapped_readout = self.root.function_compile(
+                (xfer, self.ACReadout),
+                remapped_readout,
+            ).expr
 
         if self.residuals_model == "direct":
             div = (remapped_readout / self.ACData)
@@ -45,85 +45,68 @@ def topological_sort(nodes, successor_func, single = False):
     index_counter = [1]
     lowlinks = {}
     index = {}
+    #stack holds the nodes of the SCCs still being built, iter_stack is the depth-first search path
     stack = []
     iter_stack = []
 
+    def insert_node(node):
+        stack.append(node)
+        iter_stack.append((node, iter(successor_func(node))))
+        # set the depth index for this node to the smallest unused index
+        index[node] = index_counter[0]
+        lowlinks[node] = index_counter[0]
+        index_counter[0] += 1
+        return
+
     def strongconnect(node):
         if node in lowlinks:
             return
 
-        def insert_node(node):
-            stack.append(node)
-            iter_stack.append(iter(successor_func(node)))
-            # set the depth index for this node to the smallest unused index
-            index[node] = index_counter[0]
-            lowlinks[node] = index_counter[0]
-            index_counter[0] += 1
-            return
-
         #insert the initial node
         insert_node(node)
 
-        while True:
-            node = stack[-1]
-            for successor in iter_stack[-1]:
+        while iter_stack:
+            node, successors = iter_stack[-1]
+            for successor in successors:
                 successor_ll = lowlinks.get(successor, None)
                 if successor_ll is None:
                     insert_node(successor)
                     break
                 elif successor_ll < 0:
+                    #already extracted into an SCC
                     pass
                 else:
-                    lowlinks[node] = min(lowlinks[node], successor_ll)
+                    lowlinks[node] = min(lowlinks[node], index[successor])
             #this else is against the for loop, it triggers when the iterator runs out of elements
             #and break is NOT called
             else:
-                child_node = node
-                node = stack.pop()
                 iter_stack.pop()
-                #both of these lowlinks must be positive because they are on the stack
-                lowlinks[node] = min(lowlinks[child_node],lowlinks[node])
-
-                #here is the only place that the stack could be empty
-                if not stack:
-                    assert(lowlinks[node] > 0)
-                    lowlinks[node] *= -1
-                    if single:
-                        yield node
-                    else:
-                        yield (node,)
-                    break
+                if iter_stack:
+                    parent_node = iter_stack[-1][0]
+                    lowlinks[parent_node] = min(lowlinks[parent_node], lowlinks[node])
 
                 # If `node` is a root node, pop the stack and generate an SCC
-                if lowlinks[node] < index[node]:
-                    assert(lowlinks[node] > 0)
-                    lowlinks[node] *= -1
-                    component = [node]
-                    while stack:
+                if lowlinks[node] == index[node]:
+                    component = []
+                    while True:
                         ND = stack.pop()
-                        component.append(ND)
                         assert(lowlinks[ND] > 0)
-                        lowlinks[ND] *= -1
-                        if -lowlinks[ND] == index[ND]:
+                        lowlinks[ND] = -lowlinks[ND]
+                        component.append(ND)
+                        if ND == node:
                             break
+                    if len(component) == 1:
+                        if single:
+                            yield node
+                        else:
+                            yield (node,)
                     else:
-                        #didn't hit break, so the stack is empty
                         component = tuple(component)
-                        yield component
-                        return
-                    component = tuple(component)
-                    if single:
-                        raise SCCError(component)
-                    else:
-                        yield component
-
-                elif lowlinks[node] == index[node]:
-                    assert(lowlinks[node] > 0)
-                    lowlinks[node] *= -1
-                    if single:
-                        yield node
-                    else:
-                        yield (node,)
+                        if single:
+                            raise SCCError(component)
+                        else:
+                            yield component
+        return
 
     for node in nodes:
         for component in strongconnect(node):
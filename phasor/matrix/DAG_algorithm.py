@@ -9,13 +9,13 @@ import declarative
 
 #from ..math.dispatched import abs_sq
 
-from ..utilities.priority_queue import HeapPriorityQueue, Empty
+from ..utilities.priority_queue import IndexedPriorityQueue, Empty
 from .metis_reorder import METIS_reorder
+from .edge_buffer import EdgeBuffer
 
 from .matrix_generic import (
     pre_purge_inplace,
-    purge_seqless_inplace,
-    purge_reqless_inplace,
+    purge_inplace,
     check_seq_req_balance,
 )
 
@@ -23,6 +23,10 @@ from .DAG_algorithm_impl import (
     reduceLU,
     reduceLUQ_row,
     reduceLUQ_col,
+    pivotCOL_OP,
+    pivotROW_OP,
+    householderREFL_ROW_OP,
+    LU_growth,
 )
 
 from ..base import (
@@ -30,6 +34,8 @@ from ..base import (
 )
 
 N_limit_rel = 100
+#replayed LU steps may grow (in squared magnitude) this much beyond the recording before falling back
+tape_growth_rel = N_limit_rel
 
 def abssq(arr):
     return arr.real**2 + arr.imag**2
@@ -42,6 +48,7 @@ def mgraph_simplify_inplace(
     SRABE,
     sorted_order   = False,
     order          = None,
+    tape_replay    = None,
     **kwargs
 ):
     vprint = kwargs.get('vprint', lambda x: None)
@@ -66,38 +73,27 @@ def mgraph_simplify_inplace(
 
     SRABE = (seq, req, req_alpha, seq_beta, edge_map)
 
-    if order is not None:
-        #vprint("TRIVIAL STAGE, REMAINING {0}".format(len(req)))
-        #mgraph_simplify_trivial(SRABE = SRABE, **kwargs)
-        #vprint("TRIVIAL STAGE, REMAINING {0}".format(len(req)))
-        #mgraph_simplify_trivial(SRABE = SRABE, **kwargs)
-        print("USING METIS")
+    if tape_replay is not None:
+        N_replayed = mgraph_simplify_replay(
+            SRABE       = SRABE,
+            tape_replay = tape_replay,
+            **kwargs
+        )
+        if N_replayed < len(tape_replay):
+            vprint("TAPE FALLBACK AT STEP {0} OF {1}".format(N_replayed, len(tape_replay)))
+        if req:
+            mgraph_simplify_badguys(SRABE = SRABE, **kwargs)
+        return N_replayed
+    elif order is not None:
+        vprint("ORDERED STAGE, REMAINING {0}".format(len(req)))
         mgraph_simplify_ordered(
             SRABE = SRABE,
             order = order,
             **kwargs
         )
-
-        import tempfile
-        if len(seq) > 3:
-            order = METIS_reorder(
-                SRABE = (seq, req, req_alpha, seq_beta, edge_map,),
-                METIS_fname = tempfile,
-            )
-            vprint("METIS STAGE, REMAINING {0}".format(len(req)))
-            #mgraph_simplify_badguys(SRABE = SRABE, **kwargs)
-            #TODO should check that the order exhausts the nodes to reduce
-
-            mgraph_simplify_ordered(
-                SRABE = SRABE,
-                order = order,
-                **kwargs
-            )
-            vprint("BADGUY STAGE, REMAINING {0}".format(len(req)))
-            mgraph_simplify_badguys(SRABE = SRABE, **kwargs)
-        else:
-            vprint("BADGUY STAGE, REMAINING {0}".format(len(req)))
-            mgraph_simplify_badguys(SRABE = SRABE, **kwargs)
+        #anything the ordering could not finish falls back to the pivoting heuristic
+        vprint("BADGUY STAGE, REMAINING {0}".format(len(req)))
+        mgraph_simplify_badguys(SRABE = SRABE, **kwargs)
     elif sorted_order:
         mgraph_simplify_sorted(
             SRABE = SRABE,
@@ -124,11 +120,11 @@ def mgraph_simplify_sorted(
     def generate_node_cost(node):
         return node
 
-    pqueue = HeapPriorityQueue()
+    pqueue = IndexedPriorityQueue()
 
     for node in seq.keys():
         cost = generate_node_cost(node)
-        pqueue.push((cost, node))
+        pqueue.update(node, cost)
 
     while req:
         cost, node = pqueue.pop()
@@ -148,6 +144,8 @@ def mgraph_simplify_ordered(
     seq, req, req_alpha, seq_beta, edge_map, = SRABE
 
     for node in order:
+        if node not in seq:
+            continue
         reduceLUQ_row(
             SRABE = SRABE,
             node  = node,
@@ -160,6 +158,11 @@ def mgraph_simplify_trivial(
     SRABE,
     **kwargs
 ):
+    """
+    Eliminates the nodes by increasing fill-in cost. The nodes flagged by each reduction (through
+    node_costs_invalid_in_queue) are rescored from scratch, not updated by the fill-in of the reduction,
+    so that every flag costs a pass over the row and column of the node.
+    """
     seq, req, req_alpha, seq_beta, edge_map, = SRABE
 
     def generate_node_count_tup(node):
@@ -171,7 +174,7 @@ def mgraph_simplify_trivial(
             if isinstance(edge_val, Number):
                 s_n_full += 1
             else:
-                s_n_full += len(np.asanyarray(edge_val).flatten())
+                s_n_full += np.size(edge_val)
         r_n = 0
         r_n_full = 0
         for enode in req[node]:
@@ -180,20 +183,23 @@ def mgraph_simplify_trivial(
             if isinstance(edge_val, Number):
                 r_n_full += 1
             else:
-                r_n_full += len(np.asanyarray(edge_val).flatten())
+                r_n_full += np.size(edge_val)
         return (s_n * r_n, s_n * r_n_full + r_n * s_n_full)
 
-    pqueue = HeapPriorityQueue()
+    pqueue = IndexedPriorityQueue()
     for node in seq.keys():
         cost = generate_node_count_tup(node)
-        pqueue.push((cost, node))
+        pqueue.update(node, cost)
 
     node_costs_invalid_in_queue = set()
 
     while pqueue:
+        #rescore the nodes affected by the last reduction. Dropped nodes stay out of the queue
+        while node_costs_invalid_in_queue:
+            node = node_costs_invalid_in_queue.pop()
+            if node in pqueue:
+                pqueue.update(node, generate_node_count_tup(node))
         cost, node = pqueue.pop()
-        if node in node_costs_invalid_in_queue:
-            cost = generate_node_count_tup(node)
 
         edge_cost, arr_cost = cost
 
@@ -237,6 +243,12 @@ def mgraph_simplify_badguys(
     SRABE,
     **kwargs
 ):
+    """
+    Eliminates the nodes by increasing row and column norms, pivoting where the diagonal is weak. As in
+    mgraph_simplify_trivial, the flagged nodes are rescored from scratch once per flag. The row and column
+    costs aren't updated from the fill-in of the reductions and the householder operations. The edge
+    norms are memoized, so the node at the head of the queue is rescored once more before it is taken.
+    """
     vprint = kwargs.get('vprint', lambda x: None)
     seq, req, seq_beta, req_alpha, edge_map, = SRABE
 
@@ -257,7 +269,7 @@ def mgraph_simplify_badguys(
             if isinstance(edge_val, Number):
                 s_n_full += 1
             else:
-                s_n_full += len(np.asanyarray(edge_val).flatten())
+                s_n_full += np.size(edge_val)
         r_n = 0
         r_n_full = 0
         for enode in req[node]:
@@ -266,7 +278,7 @@ def mgraph_simplify_badguys(
             if isinstance(edge_val, Number):
                 r_n_full += 1
             else:
-                r_n_full += len(np.asanyarray(edge_val).flatten())
+                r_n_full += np.size(edge_val)
         return s_n * r_n_full + r_n * s_n_full
 
     def generate_row_cost(node):
@@ -295,40 +307,40 @@ def mgraph_simplify_badguys(
         return max(rcost, ccost) + 1
     generate_node_cost = generate_max_cost
 
-    pqueue = HeapPriorityQueue()
+    pqueue = IndexedPriorityQueue()
     node_costs_invalid_in_queue = set()
     for node in seq.keys():
         cost = generate_node_cost(node)
-        pqueue.push((cost, node))
+        pqueue.update(node, cost)
     vprint("pqueue length: ", len(pqueue))
 
     try:
         while req:
+            #each node is held once, so affected nodes are rescored in place
             while node_costs_invalid_in_queue:
                 node = node_costs_invalid_in_queue.pop()
                 if node not in seq:
+                    pqueue.remove(node)
                     continue
                 cost = generate_node_cost(node)
-                pqueue.push((cost, node))
+                pqueue.update(node, cost)
             #vprint("REQ: ", req)
             #vprint("REQ_A: ", req_alpha)
             #vprint("SEQ: ", seq)
             #vprint("SEQ_B: ", seq_beta)
-            cost, node = pqueue.pop()
+            cost, node = pqueue.peek()
             if node not in seq:
+                pqueue.remove(node)
                 continue
 
-            vprint("MY NODE: ", node)
+            #edge norms may have been changed by operations not flagging the node
             new_cost = generate_node_cost(node)
-            while abs(abs(cost / new_cost) - 1) > .1:
-                cost, node = pqueue.pushpop((new_cost, node))
-                while node not in seq:
-                    cost, node = pqueue.pop()
-                new_cost = generate_node_cost(node)
+            if abs(abs(cost / new_cost) - 1) > .1:
                 vprint("NCOST: ", node, new_cost)
-
-            if node not in seq:
-                vprint("MY GOD: ", node)
+                pqueue.update(node, new_cost)
+                continue
+            pqueue.remove(node)
+            vprint("MY NODE: ", node)
 
             if node in seq[node]:
                 #node must at least have a self-loop
@@ -351,6 +363,76 @@ def mgraph_simplify_badguys(
         assert(req)
 
 
+def mgraph_simplify_replay(
+    SRABE,
+    tape_replay,
+    **kwargs
+):
+    """
+    Replays an elimination tape recorded by a solve of the same structure, skipping the pivot search.
+    Each step is checked to still fit the graph, and LU steps to not grow beyond the recorded growth
+    by more than tape_growth_rel. Returns the number of steps replayed, stopping at the first failed
+    check so that the remainder can be planned fresh.
+    """
+    seq, req, req_alpha, seq_beta, edge_map, = SRABE
+    node_costs_invalid_in_queue = set()
+
+    for idx_step, step in enumerate(tape_replay):
+        op = step[0]
+        if op == 'LU':
+            op, node, growth_rec = step
+            if node not in seq or node not in seq[node]:
+                return idx_step
+            if LU_growth(SRABE, node) > max(growth_rec, 1) * tape_growth_rel:
+                return idx_step
+            reduceLU(
+                SRABE = SRABE,
+                node  = node,
+                node_costs_invalid_in_queue = node_costs_invalid_in_queue,
+                **kwargs
+            )
+        elif op == 'pivotCOL':
+            op, node1, node2 = step
+            if node1 not in seq or node2 not in seq:
+                return idx_step
+            pivotCOL_OP(
+                SRABE = SRABE,
+                node1 = node1,
+                node2 = node2,
+                node_costs_invalid_in_queue = node_costs_invalid_in_queue,
+                **kwargs
+            )
+        elif op == 'pivotROW':
+            op, node1, node2 = step
+            if node1 not in req or node2 not in req:
+                return idx_step
+            pivotROW_OP(
+                SRABE = SRABE,
+                node1 = node1,
+                node2 = node2,
+                node_costs_invalid_in_queue = node_costs_invalid_in_queue,
+                **kwargs
+            )
+        elif op == 'householderROW':
+            op, node_into, nodes_from = step
+            req_into = req.get(node_into, ())
+            if node_into not in req_into or not nodes_from <= req_into:
+                return idx_step
+            #the reflector is built from the phase of the diagonal
+            if not np.all(abssq(edge_map[node_into, node_into]) > 0):
+                return idx_step
+            householderREFL_ROW_OP(
+                SRABE      = SRABE,
+                node_into  = node_into,
+                nodes_from = set(nodes_from),
+                node_costs_invalid_in_queue = node_costs_invalid_in_queue,
+                **kwargs
+            )
+        else:
+            return idx_step
+    return len(tape_replay)
+
+
 def wrap_input_node(node):
     return ('INPUT', node)
 
@@ -371,8 +453,21 @@ def inverse_solve_inplace(
     negative       = False,
     scattering     = False,
     METIS_fname    = None,
+    nested_dissection = False,
+    structure      = None,
+    elimination_tape = False,
+    edge_buffer    = False,
     **kwargs
 ):
+    """
+    With elimination_tape (and a structure dictionary from SolverPrepared), the elimination steps are
+    recorded on the first solve of a structure and replayed by later solves, falling back to the pivot
+    heuristics where the replay fails its stability checks.
+
+    edge_buffer holds the numeric edges in an EdgeBuffer during the elimination so that the fill-in is
+    accumulated in place rather than in fresh temporaries. It only pays off for long frequency vectors,
+    where the temporaries no longer come from numpy's allocator cache.
+    """
     if verbose:
         def vprint(*p):
             print(*p)
@@ -443,24 +538,16 @@ def inverse_solve_inplace(
         seq_beta[onode].add(wonode)
         edge_map[onode, wonode] = value
 
-    #purge_in = False
-    #purge_out = False
-    if purge_in:
-        purge_reqless_inplace(
-            seq        = seq,
-            req        = req,
-            seq_beta   = seq_beta,
-            req_alpha  = req_alpha,
-            edge_map   = edge_map,
-        )
-    if purge_out:
-        purge_seqless_inplace(
-            seq        = seq,
-            req        = req,
-            seq_beta   = seq_beta,
-            req_alpha  = req_alpha,
-            edge_map   = edge_map,
-        )
+    purge_inplace(
+        seq        = seq,
+        req        = req,
+        seq_beta   = seq_beta,
+        req_alpha  = req_alpha,
+        edge_map   = edge_map,
+        purge_in   = purge_in,
+        purge_out  = purge_out,
+        structure  = structure,
+    )
 
     if sym:
         for kf, kt in sym.edge_map:
@@ -483,22 +570,44 @@ def inverse_solve_inplace(
     #print("SPARSITY ", len(seq) - subN, len(edge_map) - subN, (len(edge_map) - subN) / (len(seq) - subN))
 
     order = None
-    if METIS_fname is not None:
-        #Use the SRABE representation and the edge map data to generate a metis file
+    if nested_dissection or METIS_fname is not None:
+        #fill-reducing order of the SRABE graph, also exported to METIS_fname if given
         order = METIS_reorder(
-            SRABE = (seq, req, req_alpha, seq_beta, edge_map,),
+            SRABE       = (seq, req, req_alpha, seq_beta, edge_map,),
             METIS_fname = METIS_fname,
+            structure   = structure,
         )
 
+    if edge_buffer and sym is None:
+        ebuf = EdgeBuffer.from_edge_map(edge_map)
+        if ebuf is not None:
+            edge_map = ebuf
+
+    tape = None
+    tape_replay = None
+    if elimination_tape and structure is not None:
+        tape = []
+        tape_replay = structure.get('elimination_tape', None)
+
     #simplify with the wrapped nodes
-    mgraph_simplify_inplace(
-        SRABE     = (seq, req, req_alpha, seq_beta, edge_map,),
-        SRABE_SYM = SRABE_SYM,
-        order     = order,
-        vprint    = vprint,
+    N_replayed = mgraph_simplify_inplace(
+        SRABE       = (seq, req, req_alpha, seq_beta, edge_map,),
+        SRABE_SYM   = SRABE_SYM,
+        order       = order,
+        vprint      = vprint,
+        tape        = tape,
+        tape_replay = tape_replay,
         **kwargs
     )
 
+    if isinstance(edge_map, EdgeBuffer):
+        edge_map = edge_map.to_dict()
+
+    if tape is not None:
+        #the replayed steps along with any fresh ones from a fallback
+        structure['elimination_tape'] = tape
+        structure['elimination_tape_replayed'] = N_replayed or 0
+
     if inputs_map is not None:
         #now unwrap the single state
         outputs_map = dict()
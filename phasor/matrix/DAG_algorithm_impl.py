@@ -2,6 +2,7 @@
 """
 """
 from __future__ import division, print_function, unicode_literals
+import functools
 import numpy as np
 from phasor.utilities.print import pprint
 
@@ -19,6 +20,37 @@ def enorm(arr):
     return np.max(abssq(arr))
 
 
+def LU_growth(SRABE, node):
+    """
+    Largest squared ratio of the column edges of node to its self edge, the growth of an LU step there.
+    """
+    seq, req, req_alpha, seq_beta, edge_map, = SRABE
+    sedge_abssq = abssq(edge_map[node, node])
+    growth = 0
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        for rnode in req[node]:
+            if rnode == node:
+                continue
+            ratio = np.max(abssq(edge_map[rnode, node]) / sedge_abssq)
+            if not ratio <= growth:
+                growth = ratio
+    if not np.isfinite(growth):
+        return float('inf')
+    return float(growth)
+
+
+def edge_map_fma(edge_map, key, val1, val2):
+    """
+    Accumulates val1 * val2 into the edge at key of a plain dictionary edge map
+    """
+    prod = val1 * val2
+    prev_edge = edge_map.get(key, None)
+    if prev_edge is not None:
+        edge_map[key] = prev_edge + prod
+    else:
+        edge_map[key] = prod
+
+
 def check_graph_at_node(SRABE, node):
     seq, req, req_alpha, seq_beta, edge_map, = SRABE
     for snode in seq[node]:
@@ -181,6 +213,7 @@ def pivotCOL_OP(
     node2,
     node_costs_invalid_in_queue,
     SRABE_SYM = None,
+    tape      = None,
     **kwargs
 ):
     """
@@ -188,6 +221,8 @@ def pivotCOL_OP(
 
     row ops affect BETA.
     """
+    if tape is not None:
+        tape.append(('pivotCOL', node1, node2))
     #print("SEQ 1: ", node1, seq[node1])
     #print("REQ 1: ", node1, req[node1])
     #print("SEQ 2: ", node2, seq[node2])
@@ -260,6 +295,7 @@ def pivotROW_OP(
     node2,
     node_costs_invalid_in_queue,
     SRABE_SYM = None,
+    tape      = None,
     **kwargs
 ):
     """
@@ -267,6 +303,8 @@ def pivotROW_OP(
 
     column ops affect ALPHA.
     """
+    if tape is not None:
+        tape.append(('pivotROW', node1, node2))
     #print("SEQ 1: ", node1, seq[node1])
     #print("REQ 1: ", node1, req[node1])
     #print("SEQ 2: ", node2, seq[node2])
@@ -336,6 +374,7 @@ def householderREFL_ROW_OP(
     nodes_from,
     node_costs_invalid_in_queue,
     SRABE_SYM = None,
+    tape      = None,
     **kwargs
 ):
     """
@@ -343,6 +382,8 @@ def householderREFL_ROW_OP(
 
     row ops affect BETA.
     """
+    if tape is not None:
+        tape.append(('householderROW', node_into, frozenset(nodes_from)))
     if SRABE_SYM is not None:
         householderREFL_ROW_OP_SYM(
             SRABE      = SRABE,
@@ -403,12 +444,14 @@ def householderREFL_ROW_OP(
         if np.any(gen_edge != 0):
             fnode_edges[fnode] = gen_edge
 
+    fma = getattr(edge_map, 'fma', None)
+    if fma is None:
+        fma = functools.partial(edge_map_fma, edge_map)
     for fnode, fedge in fnode_edges.items():
+        fedge = -2 * fedge
         for k, edge in u_vec.items():
-            if fnode in seq[k]:
-                edge_map[k, fnode] = edge_map[k, fnode] - 2 * edge * fedge
-            else:
-                edge_map[k, fnode] = - 2 * edge * fedge
+            fma((k, fnode), edge, fedge)
+            if fnode not in seq[k]:
                 seq[k].add(fnode)
                 req[fnode].add(k)
 
@@ -593,8 +636,12 @@ def reduceLU(
     node,
     SRABE_SYM                   = None,
     node_costs_invalid_in_queue = None,
+    tape                        = None,
     **kwargs
 ):
+    if tape is not None:
+        #the growth is kept to check replays of the tape against
+        tape.append(('LU', node, LU_growth(SRABE, node)))
     if SRABE_SYM is not None:
         reduceLU_sym(
             SRABE                       = SRABE,
@@ -604,6 +651,11 @@ def reduceLU(
     seq, req, req_alpha, seq_beta, edge_map, = SRABE
     #print("NODE:", node)
 
+    #an EdgeBuffer accumulates the fill-in in place
+    fma = getattr(edge_map, 'fma', None)
+    if fma is None:
+        fma = functools.partial(edge_map_fma, edge_map)
+
     self_edge = edge_map[node, node]
 
     CLG = -1 / self_edge
@@ -618,28 +670,12 @@ def reduceLU(
         prod_L = sedge * CLG
 
         for rnode in req[node]:
-            redge = edge_map[rnode, node]
-            prod = prod_L * redge
-
-            prev_edge = edge_map.get((rnode, snode), None)
-            if prev_edge is not None:
-                edge_map[(rnode, snode)] = prev_edge + prod
-            else:
-                edge_map[(rnode, snode)] = prod
-
+            fma((rnode, snode), prod_L, edge_map[rnode, node])
             seq.setdefault(rnode, set()).add(snode)
             req.setdefault(snode, set()).add(rnode)
 
         for rnode in req_alpha[node]:
-            redge = edge_map[rnode, node]
-            prod = prod_L * redge
-
-            prev_edge = edge_map.get((rnode, snode), None)
-            if prev_edge is not None:
-                edge_map[(rnode, snode)] = prev_edge + prod
-            else:
-                edge_map[(rnode, snode)] = prod
-
+            fma((rnode, snode), prod_L, edge_map[rnode, node])
             req_alpha.setdefault(snode, set()).add(rnode)
 
     for snode in seq_beta[node]:
@@ -647,32 +683,16 @@ def reduceLU(
         prod_L = sedge * CLG
 
         for rnode in req[node]:
-            redge = edge_map[rnode, node]
-            prod = prod_L * redge
-
-            prev_edge = edge_map.get((rnode, snode), None)
-            if prev_edge is not None:
-                edge_map[(rnode, snode)] = prev_edge + prod
-            else:
-                edge_map[(rnode, snode)] = prod
-
+            fma((rnode, snode), prod_L, edge_map[rnode, node])
             seq_beta.setdefault(rnode, set()).add(snode)
 
         for rnode in req_alpha[node]:
-            redge = edge_map[rnode, node]
-            prod = prod_L * redge
-
-            prev_edge = edge_map.get((rnode, snode), None)
-            if prev_edge is not None:
-                edge_map[(rnode, snode)] = prev_edge + prod
-            else:
-                edge_map[(rnode, snode)] = prod
-
+            fma((rnode, snode), prod_L, edge_map[rnode, node])
             seq_beta.setdefault(rnode, set()).add(snode)
             req_alpha.setdefault(snode, set()).add(rnode)
 
     for snode in seq[node]:
-        if node_costs_invalid_in_queue:
+        if node_costs_invalid_in_queue is not None:
             node_costs_invalid_in_queue.add(snode)
         del edge_map[node, snode]
         req[snode].remove(node)
@@ -683,7 +703,7 @@ def reduceLU(
     del seq_beta[node]
 
     for rnode in req[node]:
-        if node_costs_invalid_in_queue:
+        if node_costs_invalid_in_queue is not None:
             node_costs_invalid_in_queue.add(rnode)
         del edge_map[rnode, node]
         seq[rnode].remove(node)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Solver front end splitting the coupling graph into its strongly connected components. Optical systems are
+mostly cavities joined by one-way links (isolators, circulators, feed-forward electronics), so the components
+are small. Each one is solved on its own by a block solver (the DAG solver by default), and the transfer
+functions are propagated through the DAG of blocks by forward substitution.
+
+Given a structure dictionary (from SolverPrepared), the block inverses and the propagated transfer functions
+are kept between solves. A block is re-solved only when its internal edges change, and re-propagated only when
+it or its inputs (cross edges, sources or upstream blocks) change.
+"""
+from __future__ import division, print_function, unicode_literals
+from collections import defaultdict
+import numpy as np
+import declarative
+
+from ..math.key_matrix.keymatrix_reduce_tarjan import topological_sort
+
+#key of the source-vector channel in the propagated transfer functions
+VACUUM_CHANNEL = ('VACUUM',)
+
+
+def edge_equal(edge1, edge2):
+    if edge1 is edge2:
+        return True
+    try:
+        return bool(np.array_equal(edge1, edge2))
+    except Exception:
+        return False
+
+
+def edges_equal(emap1, emap2):
+    if emap1 is None or len(emap1) != len(emap2):
+        return False
+    for key, edge in emap2.items():
+        edge_prev = emap1.get(key, None)
+        if edge_prev is None or not edge_equal(edge_prev, edge):
+            return False
+    return True
+
+
+def SCC_decompose(seq, nodes):
+    """
+    Returns the blocks (tuples of nodes) in topological order, upstream first, and the block index of
+    each node.
+    """
+    #Tarjan emits a component only after everything downstream of it
+    blocks = list(topological_sort(nodes, lambda node: seq.get(node, ())))
+    blocks.reverse()
+    node_block = dict()
+    for idx_block, block in enumerate(blocks):
+        for node in block:
+            node_block[node] = idx_block
+    return blocks, node_block
+
+
+def block_inverse(
+    block_solver,
+    block,
+    edges,
+    inputs_set,
+    outputs_set,
+):
+    """
+    Transfer functions of a block, from its local inputs to its local outputs
+    """
+    if len(block) == 1:
+        #single node, with at most a self edge
+        node, = block
+        self_edge = edges.get((node, node), None)
+        if self_edge is None:
+            return {(node, node) : 1}
+        return {(node, node) : 1 / (1 - self_edge)}
+
+    seq = defaultdict(set)
+    req = defaultdict(set)
+    for nfrom, nto in edges.keys():
+        seq[nfrom].add(nto)
+        req[nto].add(nfrom)
+    ibunch = block_solver(
+        seq         = seq,
+        req         = req,
+        edge_map    = dict(edges),
+        inputs_set  = inputs_set,
+        outputs_set = outputs_set,
+        purge_in    = True,
+        purge_out   = True,
+        scattering  = True,
+    )
+    return ibunch.edge_map
+
+
+def inverse_solve_inplace(
+    seq, req,
+    edge_map,
+    outputs_set,
+    inputs_set   = frozenset(),
+    inputs_map   = None,
+    purge_in     = True,
+    purge_out    = True,
+    scattering   = False,
+    structure    = None,
+    block_solver = None,
+    **kwargs
+):
+    """
+    Same signature as the other solvers, the blocks are solved by block_solver (the DAG solver by
+    default). Graphs that aren't scattering matrices, or hold symbolic edges, are passed to the block
+    solver whole.
+    """
+    if block_solver is None:
+        from . import DAG_algorithm
+        block_solver = DAG_algorithm.inverse_solve_inplace
+
+    if not scattering or kwargs.get('edge_map_sym', None) or kwargs.get('inputs_map_sym', None):
+        return block_solver(
+            seq         = seq,
+            req         = req,
+            edge_map    = edge_map,
+            outputs_set = outputs_set,
+            inputs_set  = inputs_set,
+            inputs_map  = inputs_map,
+            purge_in    = purge_in,
+            purge_out   = purge_out,
+            scattering  = scattering,
+            structure   = structure,
+            **kwargs
+        )
+
+    if inputs_map is None:
+        sources_map = dict()
+    else:
+        #may be a KeyVector, which iterates over items
+        sources_map = dict(inputs_map.items())
+    if structure is None:
+        structure = dict()
+
+    decomposition = structure.get('SCC', None)
+    if decomposition is None:
+        nodes = set(seq.keys()) | set(req.keys()) | set(inputs_set) | set(outputs_set) | set(sources_map.keys())
+        for seq_set in seq.values():
+            nodes.update(seq_set)
+        blocks, node_block = SCC_decompose(seq, nodes)
+        #the cross edges into each block, and the internal edges of each
+        cross_in = [[] for block in blocks]
+        internal = [[] for block in blocks]
+        for nfrom, seq_set in seq.items():
+            idx_from = node_block[nfrom]
+            for nto in seq_set:
+                if (nfrom, nto) not in edge_map:
+                    continue
+                idx_to = node_block[nto]
+                if idx_from == idx_to:
+                    internal[idx_to].append((nfrom, nto))
+                else:
+                    cross_in[idx_to].append((nfrom, nto))
+
+        #only blocks both reachable from the sources and reaching the outputs contribute
+        source_blocks = set(node_block[node] for node in inputs_set)
+        source_blocks.update(node_block[node] for node in sources_map.keys())
+        forward = set()
+        for idx_block in range(len(blocks)):
+            if idx_block in source_blocks or any(node_block[nfrom] in forward for nfrom, nto in cross_in[idx_block]):
+                forward.add(idx_block)
+        active = set()
+        for idx_block in range(len(blocks) - 1, -1, -1):
+            if idx_block not in forward:
+                continue
+            if any(node in outputs_set for node in blocks[idx_block]):
+                active.add(idx_block)
+                continue
+            for node in blocks[idx_block]:
+                if any(node_block[snode] in active for snode in seq.get(node, ()) if node_block[snode] != idx_block):
+                    active.add(idx_block)
+                    break
+
+        block_local = dict()
+        for idx_block in sorted(active):
+            block = blocks[idx_block]
+            cross = [(nfrom, nto) for nfrom, nto in cross_in[idx_block] if node_block[nfrom] in active]
+            local_in = set(node for node in block if node in inputs_set or node in sources_map)
+            local_in.update(nto for nfrom, nto in cross)
+            local_out = set(node for node in block if node in outputs_set)
+            for node in block:
+                for snode in seq.get(node, ()):
+                    idx_to = node_block[snode]
+                    if idx_to != idx_block and idx_to in active:
+                        local_out.add(node)
+            block_local[idx_block] = declarative.Bunch(
+                cross     = cross,
+                internal  = internal[idx_block],
+                local_in  = local_in,
+                local_out = local_out,
+            )
+        decomposition = declarative.Bunch(
+            blocks      = blocks,
+            node_block  = node_block,
+            active      = sorted(active),
+            block_local = block_local,
+        )
+        structure['SCC'] = decomposition
+        structure['SCC_cache'] = dict()
+    cache = structure['SCC_cache']
+    node_block = decomposition.node_block
+
+    #forward substitution through the blocks. xfer maps each local output node to its transfer
+    #functions, by channel (the input node, or VACUUM_CHANNEL for the source vector)
+    xfer = dict()
+    dirty = set()
+    N_solved = 0
+    N_propagated = 0
+    for idx_block in decomposition.active:
+        blocal = decomposition.block_local[idx_block]
+        block_cache = cache.setdefault(idx_block, declarative.Bunch(
+            edges     = None,
+            inverse   = None,
+            inputs    = None,
+            xfer      = None,
+        ))
+
+        edges = dict((key, edge_map[key]) for key in blocal.internal)
+        if not edges_equal(block_cache.edges, edges):
+            block_cache.inverse = block_inverse(
+                block_solver = block_solver,
+                block        = decomposition.blocks[idx_block],
+                edges        = edges,
+                inputs_set   = blocal.local_in,
+                outputs_set  = blocal.local_out,
+            )
+            block_cache.edges = edges
+            dirty.add(idx_block)
+            N_solved += 1
+
+        #the values feeding the block, compared to decide if it must be propagated again
+        inputs = dict((key, edge_map[key]) for key in blocal.cross)
+        for node in blocal.local_in:
+            source = sources_map.get(node, None)
+            if source is not None:
+                inputs[VACUUM_CHANNEL, node] = source
+        upstream_dirty = any(node_block[nfrom] in dirty for nfrom, nto in blocal.cross)
+        if (
+            idx_block not in dirty
+            and not upstream_dirty
+            and edges_equal(block_cache.inputs, inputs)
+            and block_cache.xfer is not None
+        ):
+            xfer.update(block_cache.xfer)
+            continue
+        dirty.add(idx_block)
+        N_propagated += 1
+
+        #the injections into the local inputs, by channel
+        inject = defaultdict(dict)
+        for node in blocal.local_in:
+            if node in inputs_set:
+                inject[node][node] = 1
+            source = sources_map.get(node, None)
+            if source is not None:
+                inject[node][VACUUM_CHANNEL] = source
+        for nfrom, nto in blocal.cross:
+            edge = edge_map[nfrom, nto]
+            inj = inject[nto]
+            for channel, val in xfer[nfrom].items():
+                prev = inj.get(channel, None)
+                if prev is None:
+                    inj[channel] = val * edge
+                else:
+                    inj[channel] = prev + val * edge
+
+        inverse = block_cache.inverse
+        block_xfer = dict()
+        for nto in blocal.local_out:
+            out = dict()
+            for nfrom, inj in inject.items():
+                g = inverse.get((nfrom, nto), None)
+                if g is None:
+                    continue
+                for channel, val in inj.items():
+                    prev = out.get(channel, None)
+                    if prev is None:
+                        out[channel] = val * g
+                    else:
+                        out[channel] = prev + val * g
+            block_xfer[nto] = out
+        block_cache.inputs = inputs
+        block_cache.xfer = block_xfer
+        xfer.update(block_xfer)
+    structure['SCC_N_solved'] = N_solved
+    structure['SCC_N_propagated'] = N_propagated
+
+    if inputs_map is not None:
+        outputs_map = dict()
+        for onode in outputs_set:
+            val = xfer.get(onode, {}).get(VACUUM_CHANNEL, None)
+            if val is not None:
+                outputs_map[onode] = val
+    else:
+        outputs_map = None
+
+    unwrapped_edge_map = dict()
+    unwrapped_seq_map = defaultdict(set)
+    unwrapped_req_map = defaultdict(set)
+    for onode in outputs_set:
+        for inode, val in xfer.get(onode, {}).items():
+            if inode is VACUUM_CHANNEL:
+                continue
+            unwrapped_edge_map[inode, onode] = val
+            unwrapped_seq_map[inode].add(onode)
+            unwrapped_req_map[onode].add(inode)
+
+    return declarative.Bunch(
+        outputs_map = outputs_map,
+        edge_map    = unwrapped_edge_map,
+        seq         = unwrapped_seq_map,
+        req         = unwrapped_req_map,
+    )
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Edge map backed by a single array buffer.
+
+The elimination in the DAG solver keeps one entry per edge, each holding an array over the frequency axis.
+Every fill-in update then allocates fresh temporaries. EdgeBuffer stores the edges as rows of one growable
+(capacity, N_points) buffer, indexed by a slot dictionary, so that the reductions can accumulate into
+the rows in place. It otherwise behaves as the dictionary it replaces.
+"""
+from __future__ import division, print_function, unicode_literals
+from ..utilities.future_from_2 import object
+
+import numpy as np
+
+from ..math import dispatched as dmath
+
+
+def edges_shape_dtype(edge_map):
+    """
+    The broadcast shape and common dtype of the edge values, or (None, None) if they are not all numeric
+    """
+    shape = ()
+    dtype = np.float64
+    for val in edge_map.values():
+        if dmath.check_symbolic_type(val):
+            return None, None
+        vshape = np.shape(val)
+        if vshape != shape:
+            try:
+                shape = np.broadcast(np.empty(shape, dtype = bool), np.empty(vshape, dtype = bool)).shape
+            except ValueError:
+                return None, None
+        vtype = np.result_type(val)
+        if vtype.kind not in 'biufc':
+            return None, None
+        dtype = np.promote_types(dtype, vtype)
+    return shape, dtype
+
+
+class EdgeBuffer(object):
+    """
+    Dictionary-like map from edge keys to rows of a shared buffer. Values read through indexing are
+    flat views of the buffer, valid until the edge is next modified or deleted, so callers must not hold
+    them across updates. Values removed through pop are copies.
+    """
+    def __init__(self, shape, dtype, capacity = 16):
+        self.shape    = shape
+        self.N_points = int(np.prod(shape, dtype = int))
+        self.buffer   = np.empty((max(capacity, 1), self.N_points), dtype = dtype)
+        self.slots    = dict()
+        self.free     = list(range(self.buffer.shape[0] - 1, -1, -1))
+        self.scratch  = np.empty(self.N_points, dtype = dtype)
+
+    @classmethod
+    def from_edge_map(cls, edge_map):
+        """
+        Buffer holding a copy of edge_map, or None if the edges can't be held in one (such as symbolic
+        edges).
+        """
+        shape, dtype = edges_shape_dtype(edge_map)
+        if shape is None:
+            return None
+        ebuf = cls(shape, dtype, capacity = 2 * len(edge_map))
+        for key, val in edge_map.items():
+            ebuf[key] = val
+        return ebuf
+
+    def to_dict(self):
+        """
+        Plain dictionary of the edges, with values in the broadcast shape
+        """
+        keys = list(self.slots.keys())
+        #a single gather, so that the values are views of one compact array
+        rows = self.buffer[[self.slots[key] for key in keys]]
+        edge_map = dict()
+        for idx, key in enumerate(keys):
+            edge_map[key] = rows[idx].reshape(self.shape)
+        return edge_map
+
+    def _slot_new(self, key):
+        if not self.free:
+            N_prev = self.buffer.shape[0]
+            buffer = np.empty((2 * N_prev, self.N_points), dtype = self.buffer.dtype)
+            buffer[:N_prev] = self.buffer
+            self.buffer = buffer
+            self.free = list(range(2 * N_prev - 1, N_prev - 1, -1))
+        slot = self.free.pop()
+        self.slots[key] = slot
+        return slot
+
+    def row(self, val):
+        """
+        val as a row of the buffer, without copying when it already is one. Rows read from the buffer
+        are flat, so they are taken as they are.
+        """
+        if np.shape(val) == (self.N_points,):
+            return val
+        return np.broadcast_to(val, self.shape).reshape(self.N_points)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def keys(self):
+        return self.slots.keys()
+
+    def values(self):
+        buffer = self.buffer
+        return [buffer[slot] for slot in self.slots.values()]
+
+    def items(self):
+        buffer = self.buffer
+        return [(key, buffer[slot]) for key, slot in self.slots.items()]
+
+    def __getitem__(self, key):
+        return self.buffer[self.slots[key]]
+
+    def get(self, key, default = None):
+        slot = self.slots.get(key, None)
+        if slot is None:
+            return default
+        return self.buffer[slot]
+
+    def __setitem__(self, key, val):
+        slot = self.slots.get(key, None)
+        if slot is None:
+            slot = self._slot_new(key)
+        self.buffer[slot] = self.row(val)
+
+    def __delitem__(self, key):
+        self.free.append(self.slots.pop(key))
+
+    def pop(self, key, *default):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        self.free.append(slot)
+        return self.buffer[slot].copy()
+
+    def update(self, other):
+        for key, val in other.items():
+            self[key] = val
+
+    def fma(self, key, val1, val2):
+        """
+        Accumulates val1 * val2 into the edge at key (creating it if missing), in place
+        """
+        slot = self.slots.get(key, None)
+        if slot is None:
+            slot = self._slot_new(key)
+            np.multiply(val1, val2, self.buffer[slot])
+        else:
+            #positional outputs, the keyword form is measurably slower per call
+            row = self.buffer[slot]
+            np.multiply(val1, val2, self.scratch)
+            np.add(row, self.scratch, row)
+        return
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+KLU-style sparse solver. The matrix is permuted to block-triangular form (BTF) using the strongly connected
+components of its graph, each diagonal block gets a fill-reducing ordering and is factored with a left-looking
+LU, and the off-diagonal blocks are only used during the block substitution. Optical systems decompose into
+many small cavities, so most blocks are tiny and all of the structural (symbolic) analysis is reusable.
+
+The numeric work is vectorized over the frequency axis. Since every frequency point shares the factorization
+pattern, the pivots are static (on the diagonal of the ordered block). A block failing the threshold pivot test at
+any frequency is instead solved densely with partial pivoting.
+"""
+from __future__ import division, print_function, unicode_literals
+from ..utilities.future_from_2 import range
+import heapq
+import warnings
+import numpy as np
+import scipy.sparse as scisparse
+import scipy.sparse.linalg as scisparselin
+import declarative
+
+from ..math.key_matrix.keymatrix_reduce_tarjan import topological_sort
+
+from . import scisparse_algorithm
+
+#threshold for the static pivots, relative to the largest element of the pivot column (matches KLU's default)
+pivot_tol = 1e-3
+
+#bounds the size of the dense right-hand-side workspace, in elements
+N_rhs_block_elements = 2**22
+
+
+def block_ordering(N_block, rows, cols):
+    """
+    Symmetric fill-reducing ordering for a diagonal block, using the minimum degree ordering on A^T + A
+    from SuperLU. The ordering is structural, so it is computed from a diagonally-dominant surrogate with
+    the same pattern.
+    """
+    if N_block <= 2:
+        return np.arange(N_block)
+    surrogate = scisparse.csc_matrix(
+        (
+            np.concatenate([np.ones(len(rows)), (N_block + 1) * np.ones(N_block)]),
+            (
+                np.concatenate([rows, np.arange(N_block)]),
+                np.concatenate([cols, np.arange(N_block)]),
+            )
+        ),
+        shape = (N_block, N_block),
+    )
+    try:
+        return scisparselin.splu(surrogate, permc_spec = 'MMD_AT_PLUS_A').perm_c
+    except RuntimeError:
+        return np.arange(N_block)
+
+
+def block_symbolic_LU(N_block, rows, cols):
+    """
+    Symbolic left-looking LU of a block with diagonal pivots. Returns the (sorted) row patterns of
+    the strictly upper part of U and strictly lower part of L for each column.
+    """
+    col_rows = [[] for idx in range(N_block)]
+    for r, c in zip(rows, cols):
+        col_rows[c].append(r)
+
+    L_pattern = []
+    U_pattern = []
+    for j in range(N_block):
+        pattern = set(col_rows[j])
+        pattern.add(j)
+        heap = [i for i in pattern if i < j]
+        heapq.heapify(heap)
+        #the reach of the column through the columns of L already factored
+        while heap:
+            i = heapq.heappop(heap)
+            for r in L_pattern[i]:
+                if r not in pattern:
+                    pattern.add(r)
+                    if r < j:
+                        heapq.heappush(heap, r)
+        U_pattern.append(np.asarray(sorted(i for i in pattern if i < j), dtype = int))
+        L_pattern.append(np.asarray(sorted(i for i in pattern if i > j), dtype = int))
+    return L_pattern, U_pattern
+
+
+def klu_analyze(N_keys, row_ind, col_ind):
+    """
+    Structural analysis of the matrix A[row, col], built from the edge index lists. Returns a Bunch
+    holding the BTF permutation (pos maps each key index to its permuted index), the diagonal blocks
+    and the off-diagonal couplings grouped by the block they are driven from.
+    """
+    row_ind = np.asarray(row_ind, dtype = int)
+    col_ind = np.asarray(col_ind, dtype = int)
+
+    #the components are emitted after all of the components they depend on, which is the order
+    #of the block forward-substitution
+    row_deps = [[] for idx in range(N_keys)]
+    for r, c in zip(row_ind, col_ind):
+        row_deps[r].append(c)
+    components = list(topological_sort(range(N_keys), lambda r : row_deps[r]))
+
+    block_of = np.empty(N_keys, dtype = int)
+    for idx_block, component in enumerate(components):
+        block_of[list(component)] = idx_block
+
+    edges_idx = np.arange(len(row_ind))
+    diagonal = block_of[row_ind] == block_of[col_ind]
+    edges_diag = edges_idx[diagonal]
+
+    #group the diagonal-block edges by block
+    diag_order = np.argsort(block_of[row_ind[edges_diag]], kind = 'mergesort')
+    edges_diag = edges_diag[diag_order]
+    diag_indptr = np.searchsorted(block_of[row_ind[edges_diag]], np.arange(len(components) + 1))
+
+    pos = np.empty(N_keys, dtype = int)
+    blocks = []
+    idx_start = 0
+    for idx_block, component in enumerate(components):
+        component = np.asarray(component, dtype = int)
+        N_block = len(component)
+        edges = edges_diag[diag_indptr[idx_block] : diag_indptr[idx_block + 1]]
+
+        local = dict((k, idx) for idx, k in enumerate(component))
+        rows = np.asarray([local[r] for r in row_ind[edges]], dtype = int)
+        cols = np.asarray([local[c] for c in col_ind[edges]], dtype = int)
+
+        order = block_ordering(N_block, rows, cols)
+        order_inv = np.empty(N_block, dtype = int)
+        order_inv[order] = np.arange(N_block)
+        rows = order_inv[rows]
+        cols = order_inv[cols]
+        pos[component[order]] = idx_start + np.arange(N_block)
+
+        if N_block == 1:
+            L_pattern, U_pattern = None, None
+        else:
+            L_pattern, U_pattern = block_symbolic_LU(N_block, rows, cols)
+
+        #the edges of each column, for scattering into the left-looking workspace
+        col_order = np.argsort(cols, kind = 'mergesort')
+        blocks.append(declarative.Bunch(
+            N         = N_block,
+            start     = idx_start,
+            edges     = edges[col_order],
+            rows      = rows[col_order],
+            cols      = cols[col_order],
+            col_ptr   = np.searchsorted(cols[col_order], np.arange(N_block + 1)),
+            L_pattern = L_pattern,
+            U_pattern = U_pattern,
+        ))
+        idx_start += N_block
+
+    #off-diagonal couplings, grouped by the block of the driving column
+    edges_off = edges_idx[~diagonal]
+    off_order = np.argsort(block_of[col_ind[edges_off]], kind = 'mergesort')
+    edges_off = edges_off[off_order]
+    off_indptr = np.searchsorted(block_of[col_ind[edges_off]], np.arange(len(components) + 1))
+    for idx_block, block in enumerate(blocks):
+        edges = edges_off[off_indptr[idx_block] : off_indptr[idx_block + 1]]
+        block.off_edges = edges
+        block.off_rows  = pos[row_ind[edges]]
+        block.off_cols  = pos[col_ind[edges]]
+
+    return declarative.Bunch(
+        N_keys   = N_keys,
+        pos      = pos,
+        blocks   = blocks,
+        N_blocks = len(blocks),
+        N_max    = max([b.N for b in blocks] + [0]),
+    )
+
+
+def block_factor(block, vals):
+    """
+    Left-looking LU of a diagonal block for all frequencies at once. vals is the (nnz, F) array of the
+    edge values. Returns None if a static pivot fails the threshold test.
+    """
+    N_block = block.N
+    N_F = vals.shape[1]
+    L_vals = []
+    U_vals = []
+    U_diag = np.empty((N_block, N_F), dtype = vals.dtype)
+    x = np.zeros((N_block, N_F), dtype = vals.dtype)
+    for j in range(N_block):
+        x[:] = 0
+        c_slice = slice(block.col_ptr[j], block.col_ptr[j + 1])
+        x[block.rows[c_slice]] = vals[block.edges[c_slice]]
+        for i in block.U_pattern[j]:
+            L_pat = block.L_pattern[i]
+            if len(L_pat):
+                x[L_pat] -= L_vals[i] * x[i]
+        U_vals.append(x[block.U_pattern[j]])
+        pivot = x[j]
+        L_col = x[block.L_pattern[j]]
+        if len(L_col):
+            col_max = np.max(abs(L_col), axis = 0)
+        else:
+            col_max = 0
+        if np.any(abs(pivot) <= pivot_tol * col_max) or np.any(pivot == 0):
+            return None
+        U_diag[j] = pivot
+        L_vals.append(L_col / pivot)
+    return L_vals, U_vals, U_diag
+
+
+def block_solve_inplace(block, factors, R):
+    """
+    Forward and back substitution of the block factors into R, an (N_block, N_alpha, F) array.
+    """
+    L_vals, U_vals, U_diag = factors
+    for j in range(block.N):
+        L_pat = block.L_pattern[j]
+        if len(L_pat):
+            R[L_pat] -= L_vals[j][:, np.newaxis, :] * R[j][np.newaxis]
+    for j in reversed(range(block.N)):
+        R[j] /= U_diag[j]
+        U_pat = block.U_pattern[j]
+        if len(U_pat):
+            R[U_pat] -= U_vals[j][:, np.newaxis, :] * R[j][np.newaxis]
+    return
+
+
+def block_solve_dense_inplace(block, vals, R):
+    """
+    Fallback for blocks with poor static pivots, using LAPACK with partial pivoting at each frequency.
+    """
+    N_F = vals.shape[1]
+    A = np.zeros((N_F, block.N, block.N), dtype = vals.dtype)
+    A[:, block.rows, block.cols] = vals[block.edges].T
+    try:
+        R[:] = np.linalg.solve(A, R.transpose(2, 0, 1)).transpose(1, 2, 0)
+    except np.linalg.LinAlgError:
+        warnings.warn("Matrix is exactly singular", scisparselin.MatrixRankWarning)
+        R[:] = np.nan
+    return
+
+
+def solve_batched(
+    N_keys,
+    N_alpha,
+    data_ind,
+    row_ind,
+    col_ind,
+    data_alpha_ind,
+    row_alpha_ind,
+    col_alpha_ind,
+    beta_rows,
+    shape,
+    arr_type,
+    structure = None,
+):
+    """
+    Matrix solver for scisparse_algorithm.mgraph_simplify_inplace. The symbolic analysis is stored
+    in the structure dictionary, if given, for later solves with the same structure.
+    """
+    edge_map_ab = dict()
+    if not beta_rows or not N_alpha:
+        return edge_map_ab
+
+    if structure is None or 'klu_symbolic' not in structure:
+        symbolic = klu_analyze(N_keys, row_ind, col_ind)
+        if structure is not None:
+            structure['klu_symbolic'] = symbolic
+    else:
+        symbolic = structure['klu_symbolic']
+    pos = symbolic.pos
+
+    N_freq = int(np.prod(shape, dtype = int))
+    data_A = np.empty((len(data_ind), N_freq), dtype = arr_type)
+    for idx, d in enumerate(data_ind):
+        data_A[idx] = d.reshape(-1)
+    data_B = np.empty((len(data_alpha_ind), N_freq), dtype = arr_type)
+    for idx, d in enumerate(data_alpha_ind):
+        data_B[idx] = d.reshape(-1)
+
+    rows_alpha = pos[np.asarray(row_alpha_ind, dtype = int)]
+    cols_alpha = np.asarray(col_alpha_ind, dtype = int)
+    rows_beta  = pos[np.asarray(beta_rows, dtype = int)]
+
+    N_chunk = max(1, N_rhs_block_elements // max(N_keys * N_alpha, 1))
+    x_out = np.empty((N_freq, len(beta_rows), N_alpha), dtype = arr_type)
+    for idx_f in range(0, N_freq, N_chunk):
+        f_slice = slice(idx_f, idx_f + N_chunk)
+        vals = data_A[:, f_slice]
+        N_F = vals.shape[1]
+
+        X = np.zeros((N_keys, N_alpha, N_F), dtype = arr_type)
+        X[rows_alpha, cols_alpha] = data_B[:, f_slice]
+        for block in symbolic.blocks:
+            R = X[block.start : block.start + block.N]
+            if block.N == 1:
+                if len(block.edges):
+                    R /= vals[block.edges[0]]
+                else:
+                    warnings.warn("Matrix is exactly singular", scisparselin.MatrixRankWarning)
+                    R[:] = np.nan
+            else:
+                factors = block_factor(block, vals)
+                if factors is None:
+                    block_solve_dense_inplace(block, vals, R)
+                else:
+                    block_solve_inplace(block, factors, R)
+            if len(block.off_edges):
+                #push the solved block into the blocks depending on it
+                np.subtract.at(
+                    X,
+                    block.off_rows,
+                    vals[block.off_edges][:, np.newaxis, :] * X[block.off_cols],
+                )
+        x_out[f_slice] = X[rows_beta].transpose(2, 0, 1)
+
+    #only the nonzero couplings become edges
+    idx_rows, idx_cols = np.nonzero(np.any(x_out != 0, axis = 0))
+    for idx_r, idx_col in zip(idx_rows, idx_cols):
+        if shape:
+            data = x_out[:, idx_r, idx_col].reshape(shape)
+        else:
+            data = x_out[0, idx_r, idx_col]
+        edge_map_ab[idx_col, beta_rows[idx_r]] = data
+    return edge_map_ab
+
+
+def inverse_solve_inplace(
+    seq, req,
+    edge_map,
+    outputs_set,
+    **kwargs
+):
+    """
+    Same signature as the other solvers. Shares the graph dressing, purging and unwrapping of the
+    scisparse solver and only replaces its matrix solve.
+    """
+    return scisparse_algorithm.inverse_solve_inplace(
+        seq           = seq,
+        req           = req,
+        edge_map      = edge_map,
+        outputs_set   = outputs_set,
+        matrix_solver = solve_batched,
+        **kwargs
+    )
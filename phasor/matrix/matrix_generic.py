@@ -2,8 +2,9 @@
 """
 """
 from __future__ import division, print_function, unicode_literals
+from ..utilities.future_from_2 import object
 import warnings
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import declarative
 
 def print_seq(seq, edge_map):
@@ -121,6 +122,108 @@ def purge_seqless_inplace(
             del req_alpha[node]
 
 
+def purge_inplace(
+        seq,
+        req,
+        req_alpha,
+        seq_beta,
+        edge_map,
+        purge_in  = True,
+        purge_out = True,
+        structure = None,
+):
+    """
+    Runs the reqless and seqless purges. If a structure dictionary is given, the purged nodes are
+    recorded into it on the first call, and later calls with the same graph structure replay the
+    recorded purge without coloring the graph again.
+    """
+    if structure is not None:
+        purge_record = structure.get('purge', None)
+        if purge_record is not None:
+            purge_set, seq_beta_purge, req_alpha_purge = purge_record
+            purge_subgraph_inplace(seq, req, edge_map, purge_set)
+            for node in seq_beta_purge:
+                seq_beta.pop(node, None)
+            for node in req_alpha_purge:
+                req_alpha.pop(node, None)
+            return
+
+    nodes_prev     = set(seq.keys())
+    seq_beta_prev  = set(seq_beta.keys())
+    req_alpha_prev = set(req_alpha.keys())
+    purge_set      = set()
+    if purge_in:
+        purge_reqless_inplace(
+            seq        = seq,
+            req        = req,
+            seq_beta   = seq_beta,
+            req_alpha  = req_alpha,
+            edge_map   = edge_map,
+        )
+        purge_set.update(nodes_prev - set(seq.keys()))
+    if purge_out:
+        nodes_prev = set(seq.keys())
+        purge_seqless_inplace(
+            seq        = seq,
+            req        = req,
+            seq_beta   = seq_beta,
+            req_alpha  = req_alpha,
+            edge_map   = edge_map,
+        )
+        purge_set.update(nodes_prev - set(seq.keys()))
+
+    if structure is not None:
+        structure['purge'] = (
+            frozenset(purge_set),
+            frozenset(seq_beta_prev - set(seq_beta.keys())),
+            frozenset(req_alpha_prev - set(req_alpha.keys())),
+        )
+    return
+
+
+class SolverPrepared(object):
+    """
+    Wraps a solver's inverse_solve_inplace to keep its structural work (purge results, orderings,
+    symbolic analysis) between solves. Callers pass a hashable structure_key that must change whenever
+    the sparsity of the graph, the inputs or the outputs change. Solves with the same key then only
+    redo the numeric work. Solves without a key are passed straight through. At most N_structures_max
+    structures are kept, evicting the least recently used. New structures start from the entries given in
+    seeds for their key, such as the orderings loaded from the topology cache of an earlier process.
+    """
+    N_structures_max = 8
+
+    def __init__(self, inverse_solve_inplace):
+        self._inverse_solve_inplace = inverse_solve_inplace
+        self.structures = OrderedDict()
+        self.seeds      = dict()
+        self.N_prepared = 0
+        self.N_reused   = 0
+        self.N_evicted  = 0
+        self.N_seeded   = 0
+
+    def inverse_solve_inplace(self, structure_key = None, **kwargs):
+        if structure_key is None:
+            return self._inverse_solve_inplace(**kwargs)
+
+        structure = self.structures.pop(structure_key, None)
+        if structure is None:
+            while len(self.structures) >= self.N_structures_max:
+                self.structures.popitem(last = False)
+                self.N_evicted += 1
+            seed = self.seeds.get(structure_key, None)
+            if seed is not None:
+                structure = dict(seed)
+                self.N_seeded += 1
+            else:
+                structure = dict()
+            self.N_prepared += 1
+        else:
+            self.N_reused += 1
+        #reinserted to mark it as the most recently used
+        self.structures[structure_key] = structure
+        return self._inverse_solve_inplace(structure = structure, **kwargs)
+
+
 def edgedelwarn(
         edge_map,
         nfrom,
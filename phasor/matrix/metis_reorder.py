@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 """
+Fill-reducing node orderings for the elimination solvers. The ordering is a nested dissection computed
+in-process on the integer adjacency of the graph. SRABE2METIS can still export the graph in the METIS
+text format for use with external tools.
 """
 from __future__ import division, print_function, unicode_literals
-import warnings
-import os
+from ..utilities.future_from_2 import str
 import numpy as np
 from collections import defaultdict
-import tempfile
+import scipy.sparse as scisparse
+import scipy.sparse.csgraph as csgraph
 
 #from ..math.dispatched import abs_sq
 
@@ -68,7 +71,6 @@ def SRABE2METIS(
             vertices = len(nlist),
             edges    = n_edges,
         ))
-        print("NUM EDGES: ", len(edge_weights))
 
         for idx, node in enumerate(nlist):
             edict = edge_weights.get(idx, dict())
@@ -91,62 +93,146 @@ def SRABE2METIS(
             Fmetis.close()
     return nlist
 
-def METIS_reorder(
-    SRABE,
-    METIS_fname,
-    clear_file  = False,
-):
-    clear_results = True
-    if METIS_fname is tempfile:
-        #TODO create tempfile
-        METIS_fd, METIS_fname = tempfile.mkstemp(
-            suffix = '.metis',
-            text = True
-        )
-        clear_file = True
 
-        nlist = SRABE2METIS(
-            SRABE,
-            os.fdopen(os.dup(METIS_fd), 'w'),
-        )
-    else:
-        METIS_fd = None
+#subgraphs at or below this size are not dissected further
+N_leaf = 8
 
-        nlist = SRABE2METIS(
-            SRABE,
-            METIS_fname,
-        )
 
-    import subprocess
-    try:
-        retoutput = subprocess.check_output(
-            ['ndmetis', METIS_fname],
+
+def level_separator(adj):
+    """
+    Finds a vertex separator of the connected graph adj (symmetric CSR) from the middle level of a
+    breadth-first level structure rooted at a pseudo-peripheral node. Returns the boolean masks
+    (part_A, part_B, separator), or None if the graph can't be split.
+    """
+    N = adj.shape[0]
+    degrees = np.diff(adj.indptr)
+    root = np.argmin(degrees)
+    #two sweeps to find a pseudo-peripheral root, which gives the deepest level structure
+    for idx in range(2):
+        levels = csgraph.shortest_path(
+            adj,
+            unweighted = True,
+            directed   = False,
+            indices    = root,
         )
-    except subprocess.CalledProcessError as E:
-        print(E.output)
-        warnings.warn("Calling ndmetis failed. Is it installed? It will speed up the computation")
+        root = np.argmax(levels)
+    levels = levels.astype(int)
+    L = levels.max()
+    if L < 2:
         return None
 
-    nlistI = []
-    with open(METIS_fname + '.iperm', 'r') as FmetisO:
-        for line in FmetisO.readlines():
-            nlistI.append(int(line))
-    print(nlistI)
-    nlistI = np.asarray(nlistI)
-    nlist_reorder = []
-    for idx in np.argsort(nlistI):
-        nlist_reorder.append(nlist[idx])
-
-    if METIS_fd is not None:
-        os.close(METIS_fd)
-    if clear_file:
-        os.unlink(METIS_fname)
-    if clear_results:
-        os.unlink(METIS_fname + '.iperm')
-    #return None
-    return nlist
-    return nlist_reorder
-    #for idx_from, idx_to in enumerate(nlistI):
+    counts = np.bincount(levels, minlength = L + 1)
+    level_mid = np.searchsorted(np.cumsum(counts), N / 2.)
+    level_mid = min(max(level_mid, 1), L - 1)
+
+    part_A = levels < level_mid
+    part_B = levels > level_mid
+    separator = levels == level_mid
+
+    #separator nodes without neighbors in B can be moved into A
+    touches_B = (adj.dot(part_B.astype(np.int8)) > 0)
+    part_A |= separator & ~touches_B
+    separator &= touches_B
+    return part_A, part_B, separator
+
+
+def nested_dissection(adj):
+    """
+    Nested-dissection ordering of the symmetric adjacency adj (CSR, no self-loops).
+    Returns the elimination order as an array of node indices.
+    """
+    order = []
+
+    def dissect(nodes):
+        sub = adj[nodes][:, nodes]
+        N_comp, labels = csgraph.connected_components(sub, directed = False)
+        for idx_comp in range(N_comp):
+            comp = np.nonzero(labels == idx_comp)[0]
+            if len(comp) <= N_leaf:
+                #low degree first in the leaves
+                degrees = np.diff(sub.indptr)[comp]
+                order.append(nodes[comp[np.argsort(degrees, kind = 'mergesort')]])
+                continue
+            if N_comp > 1:
+                sub_comp = sub[comp][:, comp]
+            else:
+                sub_comp = sub
+            split = level_separator(sub_comp)
+            if split is None:
+                degrees = np.diff(sub_comp.indptr)
+                order.append(nodes[comp[np.argsort(degrees, kind = 'mergesort')]])
+                continue
+            part_A, part_B, separator = split
+            dissect(nodes[comp[part_A]])
+            dissect(nodes[comp[part_B]])
+            #the separator is eliminated last
+            order.append(nodes[comp[separator]])
+        return
+
+    if adj.shape[0] > 0:
+        dissect(np.arange(adj.shape[0]))
+    if not order:
+        return np.zeros(0, dtype = int)
+    return np.concatenate(order)
+
+
+def SRABE_adjacency(SRABE):
+    """
+    Integer symmetric adjacency of the internal nodes of SRABE, without self-loops.
+    Returns the node list and the CSR adjacency.
+    """
+    (seq, req, req_alpha, seq_beta, edge_map) = SRABE
 
+    from .scisparse_algorithm import sortkeys_inplace
+    nlist = list(seq.keys())
+    sortkeys_inplace(nlist)
+    nlist_inv = dict()
+    for idx, node in enumerate(nlist):
+        nlist_inv[node] = idx
+
+    rows = []
+    cols = []
+    for node, sset in seq.items():
+        ridx = nlist_inv[node]
+        for snode in sset:
+            sidx = nlist_inv.get(snode, None)
+            if sidx is None or sidx == ridx:
+                continue
+            rows.append(ridx)
+            cols.append(sidx)
+    N = len(nlist)
+    adj = scisparse.csr_matrix(
+        (np.ones(len(rows), dtype = np.int8), (rows, cols)),
+        shape = (N, N),
+    )
+    adj = ((adj + adj.T) > 0).astype(np.int8).tocsr()
+    adj.sort_indices()
+    return nlist, adj
 
 
+def METIS_reorder(
+    SRABE,
+    METIS_fname = None,
+    structure   = None,
+):
+    """
+    Nested-dissection elimination order of the internal nodes of SRABE. The order is kept in the
+    structure dictionary if given, so that repeated solves of the same structure skip it. Those are
+    held (and evicted) by SolverPrepared, so no other cache is kept here. If METIS_fname is given, the
+    graph is also written there in the METIS format.
+    """
+    if structure is not None:
+        order = structure.get('ND_order', None)
+        if order is not None:
+            return order
+
+    nlist, adj = SRABE_adjacency(SRABE)
+    if METIS_fname is not None:
+        SRABE2METIS(SRABE, METIS_fname)
+
+    perm = nested_dissection(adj)
+    order = [nlist[idx] for idx in perm]
+    if structure is not None:
+        structure['ND_order'] = order
+    return order
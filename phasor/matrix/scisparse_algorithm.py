@@ -3,6 +3,7 @@
 """
 from __future__ import division, print_function, unicode_literals
 from ..utilities.future_from_2 import str
+import warnings
 import numpy as np
 from collections import defaultdict
 import declarative
@@ -14,8 +15,7 @@ from phasor.utilities.print import pprint
 
 from .matrix_generic import (
     pre_purge_inplace,
-    purge_seqless_inplace,
-    purge_reqless_inplace,
+    purge_inplace,
     check_seq_req_balance,
 )
 
@@ -90,6 +90,9 @@ def mgraph_simplify_inplace(
     seq, req, req_alpha, seq_beta, edge_map,
     verbose        = False,
     sorted_order   = False,
+    batched        = True,
+    structure      = None,
+    matrix_solver  = None,
 ):
     if verbose:
         def vprint(*p):
@@ -107,6 +110,87 @@ def mgraph_simplify_inplace(
     req       = dict(req)
     seq       = dict(seq)
 
+    edge_map_beta = dict()
+    for node, sset in seq_beta.items():
+        for snode in sset:
+            edge_map_beta[node, snode] = edge_map[node, snode]
+
+    if structure is None or 'keys' not in structure:
+        pattern = _pattern_generate(seq, req, req_alpha, seq_beta)
+        if structure is not None:
+            structure.update(pattern)
+    else:
+        pattern = structure
+    keys       = pattern['keys']
+    keys_alpha = pattern['keys_alpha']
+
+    #CSR generation routine
+
+    arr_keys = []
+    arr_arrays = []
+    for k, a in edge_map.items():
+        arr_keys.append(k)
+        arr_arrays.append(np.asarray(a))
+
+    arr_type = np.common_type(*arr_arrays)
+    arr_arrays = np.broadcast_arrays(*arr_arrays)
+    shape = arr_arrays[0].shape
+
+    edge_map_bcast = dict()
+    for k, a in zip(arr_keys, arr_arrays):
+        edge_map_bcast[k] = a
+
+    data_ind       = [edge_map_bcast[k] for k in pattern['edges']]
+    data_alpha_ind = [edge_map_bcast[k] for k in pattern['edges_alpha']]
+
+    #the matrix solvers all share this signature
+    if matrix_solver is None:
+        if batched:
+            matrix_solver = _solve_batched
+        else:
+            matrix_solver = _solve_pointwise
+    edge_map_ab = matrix_solver(
+        N_keys         = len(keys),
+        N_alpha        = len(keys_alpha),
+        data_ind       = data_ind,
+        row_ind        = pattern['row_ind'],
+        col_ind        = pattern['col_ind'],
+        data_alpha_ind = data_alpha_ind,
+        row_alpha_ind  = pattern['row_alpha_ind'],
+        col_alpha_ind  = pattern['col_alpha_ind'],
+        beta_rows      = pattern['beta_rows'],
+        shape          = shape,
+        arr_type       = arr_type,
+        structure      = structure,
+    )
+
+    #now reapply the seq and req lists
+    edge_map.clear()
+    #pprint(edge_map_ab)
+
+    for (idx_col, idx_row), data in edge_map_ab.items():
+        k_fr = keys_alpha[idx_col]
+        #TODO can only currently deal with 1:1 seq_beta map
+        k_to = keys[idx_row]
+        sset = seq_beta.get(k_to, None)
+        #print(k_fr, k_to, sset)
+        if sset:
+            assert(len(sset) == 1)
+            s_k_to = next(iter(sset))
+            edge_map[k_fr, s_k_to] = data * edge_map_beta[k_to, s_k_to]
+            sbetaO[k_fr].add(s_k_to)
+            ralphaO[s_k_to].add(k_fr)
+    #pprint(seqO)
+    #pprint(reqO)
+    return
+
+
+
+def _pattern_generate(seq, req, req_alpha, seq_beta):
+    """
+    Orders the nodes and edges of the graph into the integer index lists used to build the sparse
+    matrices. This depends only on the structure, so it is stored when solving with a structure cache.
+    """
     keys = set(seq.keys()) | set(req.keys())
     for node, rset in req.items():
         keys.add(node)
@@ -119,23 +203,9 @@ def mgraph_simplify_inplace(
     for node, rset in req_alpha.items():
         keys_alpha.update(rset)
 
-    edge_map_beta = dict()
-    for node, sset in seq_beta.items():
-        for snode in sset:
-            edge_map_beta[node, snode] = edge_map[node, snode]
-
-    #pprint(req)
-    #pprint(seq)
-    #pprint(req_alpha)
-    #pprint(seq_beta)
-
-    #keys = (keys - keys_alpha) - keys_beta
-
     keys = list(keys)
-    #pprint(keys)
     sortkeys_inplace(keys)
     keys_alpha = list(keys_alpha)
-    #print(keys_alpha)
     sortkeys_inplace_split(keys_alpha)
 
     keys_inv = dict()
@@ -146,55 +216,65 @@ def mgraph_simplify_inplace(
     for idx, k in enumerate(keys_alpha):
         keys_alpha_inv[k] = idx
 
-    #CSR generation routine
-
-    arr_keys = []
-    arr_arrays = []
-    for k, a in edge_map.items():
-        arr_keys.append(k)
-        arr_arrays.append(np.asarray(a))
-
-    arr_type = np.common_type(*arr_arrays)
-    arr_arrays = np.broadcast_arrays(*arr_arrays)
-
-    edge_map_bcast = dict()
-    for k, a in zip(arr_keys, arr_arrays):
-        edge_map_bcast[k] = a
-
-    data_ind = []
+    edges = []
     row_ind = []
     col_ind = []
-
     for k_fr, seqset in seq.items():
         for k_to in seqset:
-            a = edge_map_bcast[k_fr, k_to]
-            data_ind.append(a)
+            edges.append((k_fr, k_to))
             col_ind.append(keys_inv[k_fr])
             row_ind.append(keys_inv[k_to])
 
-    data_alpha_ind = []
+    edges_alpha = []
     row_alpha_ind = []
     col_alpha_ind = []
-
     for k_to, reqset in req_alpha.items():
         for k_fr in reqset:
-            #print(k_fr, k_to)
-            a = edge_map_bcast[k_fr, k_to]
-            data_alpha_ind.append(a)
+            edges_alpha.append((k_fr, k_to))
             col_alpha_ind.append(keys_alpha_inv[k_fr])
             row_alpha_ind.append(keys_inv[k_to])
 
-    #TODO: should use the direct constructor after sorting and converting to data, indices, indptr!
+    return dict(
+        keys          = keys,
+        keys_alpha    = keys_alpha,
+        edges         = edges,
+        row_ind       = row_ind,
+        col_ind       = col_ind,
+        edges_alpha   = edges_alpha,
+        row_alpha_ind = row_alpha_ind,
+        col_alpha_ind = col_alpha_ind,
+        beta_rows     = [keys_inv[k] for k in keys if seq_beta.get(k, None)],
+    )
+
 
-    edge_map_ab = defaultdict(lambda : np.zeros_like(a, dtype = arr_type))
-    for index in np.ndindex(a.shape):
+def _solve_pointwise(
+    N_keys,
+    N_alpha,
+    data_ind,
+    row_ind,
+    col_ind,
+    data_alpha_ind,
+    row_alpha_ind,
+    col_alpha_ind,
+    beta_rows,
+    shape,
+    arr_type,
+    structure = None,
+):
+    """
+    Solves each point of the broadcast shape independently with spsolve. This is the original
+    algorithm, kept since it dispatches to umfpack when it is selected through use_solver.
+    """
+    #TODO: should use the direct constructor after sorting and converting to data, indices, indptr!
+    edge_map_ab = defaultdict(lambda : np.zeros(shape, dtype = arr_type))
+    for index in np.ndindex(shape):
         #uses 4th constructor of https://docs.scipy.org/doc/scipy/reference/generated/scipy.sparse.csr_matrix.html#scipy.sparse.csr_matrix
         A_csc = scisparse.csc_matrix(
             (
                 [d[index] for d in data_ind],
                 (row_ind, col_ind)
             ),
-            shape = (len(keys), len(keys)),
+            shape = (N_keys, N_keys),
             dtype = arr_type,
         )
         b_csc = scisparse.csc_matrix(
@@ -202,7 +282,7 @@ def mgraph_simplify_inplace(
                 [d[index] for d in data_alpha_ind],
                 (row_alpha_ind, col_alpha_ind)
             ),
-            shape = (len(keys), len(keys_alpha)),
+            shape = (N_keys, N_alpha),
             dtype = arr_type,
         )
         #print(arr_type)
@@ -239,26 +319,269 @@ def mgraph_simplify_inplace(
                 for idx_row in np.nonzero(x_csc)[0]:
                     edge_map_ab[0, idx_row] = x_csc[idx_row]
             #pprint(arr - arr1)
+    return edge_map_ab
+
+
+#bounds the size of the dense right-hand-side blocks in the batched solve
+N_rhs_block_elements = 2**22
+
+
+def _csc_pattern_generate(N_keys, row_ind, col_ind, data, beta_rows, ordering = True):
+    """
+    Generates the column-permuted CSC index arrays. Returns (indices, indptr, data_perm, row_select)
+    where data_perm maps the edge data into CSC order and row_select picks the beta rows out of
+    the permuted solution. Without ordering, the columns are kept in their natural order.
+    """
+    N_nnz = len(row_ind)
+    #the pattern stores (1 + edge index) as its data, to map edges into CSC order
+    A_pattern = scisparse.csc_matrix(
+        (
+            np.arange(1, N_nnz + 1),
+            (row_ind, col_ind)
+        ),
+        shape = (N_keys, N_keys),
+    )
+    col_order = np.arange(N_keys)
+    if ordering:
+        A_0 = scisparse.csc_matrix(
+            (
+                data[A_pattern.data - 1],
+                A_pattern.indices,
+                A_pattern.indptr,
+            ),
+            shape = (N_keys, N_keys),
+        )
+        #fill-reducing ordering computed once for the whole pattern
+        try:
+            col_order = np.argsort(scisparselin.splu(A_0, permc_spec = 'COLAMD').perm_c)
+        except RuntimeError:
+            pass
+    A_pattern = A_pattern[:, col_order]
+    A_pattern.sort_indices()
+    return (
+        A_pattern.indices,
+        A_pattern.indptr,
+        A_pattern.data - 1,
+        np.argsort(col_order)[beta_rows],
+    )
 
-    #now reapply the seq and req lists
-    edge_map.clear()
-    #pprint(edge_map_ab)
 
-    for (idx_col, idx_row), data in edge_map_ab.items():
-        k_fr = keys_alpha[idx_col]
-        #TODO can only currently deal with 1:1 seq_beta map
-        k_to = keys[idx_row]
-        sset = seq_beta.get(k_to, None)
-        #print(k_fr, k_to, sset)
-        if sset:
-            assert(len(sset) == 1)
-            s_k_to = next(iter(sset))
-            edge_map[k_fr, s_k_to] = data * edge_map_beta[k_to, s_k_to]
-            sbetaO[k_fr].add(s_k_to)
-            ralphaO[s_k_to].add(k_fr)
-    #pprint(seqO)
-    #pprint(reqO)
-    return
+def _batched_setup(
+    N_keys,
+    data_ind,
+    row_ind,
+    col_ind,
+    data_alpha_ind,
+    beta_rows,
+    shape,
+    arr_type,
+    structure,
+    ordering = True,
+):
+    """
+    The edge data as (N_freq, nnz) arrays, so that each point is a contiguous slice, along with the
+    CSC pattern. The pattern is kept in the structure dictionary, if given, for later solves.
+    """
+    N_freq = int(np.prod(shape, dtype = int))
+    data_A = np.empty((N_freq, len(data_ind)), dtype = arr_type)
+    for idx, d in enumerate(data_ind):
+        data_A[:, idx] = d.reshape(-1)
+    data_B = np.empty((N_freq, len(data_alpha_ind)), dtype = arr_type)
+    for idx, d in enumerate(data_alpha_ind):
+        data_B[:, idx] = d.reshape(-1)
+
+    sname = 'csc_pattern' if ordering else 'csc_pattern_natural'
+    if structure is None or sname not in structure:
+        csc_pattern = _csc_pattern_generate(
+            N_keys    = N_keys,
+            row_ind   = row_ind,
+            col_ind   = col_ind,
+            data      = data_A[0],
+            beta_rows = beta_rows,
+            ordering  = ordering,
+        )
+        if structure is not None:
+            structure[sname] = csc_pattern
+    else:
+        csc_pattern = structure[sname]
+    return N_freq, data_A, data_B, csc_pattern
+
+
+def _batched_edges(x_out, beta_rows, shape):
+    """
+    Converts the (N_freq, N_out, N_in) solution into edges, only for the nonzero couplings
+    """
+    edge_map_ab = dict()
+    idx_rows, idx_cols = np.nonzero(np.any(x_out != 0, axis = 0))
+    for idx_r, idx_col in zip(idx_rows, idx_cols):
+        if shape:
+            data = x_out[:, idx_r, idx_col].reshape(shape)
+        else:
+            data = x_out[0, idx_r, idx_col]
+        edge_map_ab[idx_col, beta_rows[idx_r]] = data
+    return edge_map_ab
+
+
+def _solve_batched(
+    N_keys,
+    N_alpha,
+    data_ind,
+    row_ind,
+    col_ind,
+    data_alpha_ind,
+    row_alpha_ind,
+    col_alpha_ind,
+    beta_rows,
+    shape,
+    arr_type,
+    structure = None,
+):
+    """
+    Solves all points of the broadcast shape using a single sparsity pattern, with SuperLU. The CSC
+    index arrays and the fill-reducing (COLAMD) column ordering are computed once and reused, but
+    splu can't keep a symbolic factorization between calls, so every point still runs the full
+    factorization on the preordered matrix. See _solve_batched_umfpack for the numeric-only
+    refactorization. The results are written into a preallocated (N_freq, N_out, N_in) array.
+    """
+    if not beta_rows or not N_alpha:
+        return dict()
+
+    N_freq, data_A, data_B, csc_pattern = _batched_setup(
+        N_keys         = N_keys,
+        data_ind       = data_ind,
+        row_ind        = row_ind,
+        col_ind        = col_ind,
+        data_alpha_ind = data_alpha_ind,
+        beta_rows      = beta_rows,
+        shape          = shape,
+        arr_type       = arr_type,
+        structure      = structure,
+    )
+    indices, indptr, data_perm, row_select = csc_pattern
+
+    B = np.zeros((N_keys, N_alpha), dtype = arr_type)
+    N_block = max(1, N_rhs_block_elements // max(N_keys, 1))
+
+    x_out = np.empty((N_freq, len(beta_rows), N_alpha), dtype = arr_type)
+    for idx_f in range(N_freq):
+        A_csc = scisparse.csc_matrix(
+            (
+                data_A[idx_f, data_perm],
+                indices,
+                indptr,
+            ),
+            shape = (N_keys, N_keys),
+        )
+        B[row_alpha_ind, col_alpha_ind] = data_B[idx_f]
+        try:
+            lu = scisparselin.splu(A_csc, permc_spec = 'NATURAL')
+        except RuntimeError:
+            warnings.warn("Matrix is exactly singular", scisparselin.MatrixRankWarning)
+            x_out[idx_f] = np.nan
+            continue
+        for idx_c in range(0, N_alpha, N_block):
+            x = lu.solve(B[:, idx_c : idx_c + N_block])
+            x_out[idx_f, :, idx_c : idx_c + N_block] = x[row_select]
+    return _batched_edges(x_out, beta_rows, shape)
+
+
+def _solve_batched_umfpack(
+    N_keys,
+    N_alpha,
+    data_ind,
+    row_ind,
+    col_ind,
+    data_alpha_ind,
+    row_alpha_ind,
+    col_alpha_ind,
+    beta_rows,
+    shape,
+    arr_type,
+    structure = None,
+):
+    """
+    Same as _solve_batched, but with UMFPACK, which splits the factorization. The symbolic analysis
+    (ordering and fill pattern) runs once per structure, held in the structure dictionary, and every
+    point only runs the numeric factorization. Falls back to _solve_batched without scikits.umfpack.
+    """
+    try:
+        import scikits.umfpack as umfpack
+    except ImportError:
+        return _solve_batched(
+            N_keys         = N_keys,
+            N_alpha        = N_alpha,
+            data_ind       = data_ind,
+            row_ind        = row_ind,
+            col_ind        = col_ind,
+            data_alpha_ind = data_alpha_ind,
+            row_alpha_ind  = row_alpha_ind,
+            col_alpha_ind  = col_alpha_ind,
+            beta_rows      = beta_rows,
+            shape          = shape,
+            arr_type       = arr_type,
+            structure      = structure,
+        )
+
+    if not beta_rows or not N_alpha:
+        return dict()
+
+    #UMFPACK orders the columns itself during the symbolic analysis
+    if np.iscomplexobj(np.empty(0, dtype = arr_type)):
+        arr_type = np.complex128
+        family = 'zi'
+    else:
+        arr_type = np.float64
+        family = 'di'
+    N_freq, data_A, data_B, csc_pattern = _batched_setup(
+        N_keys         = N_keys,
+        data_ind       = data_ind,
+        row_ind        = row_ind,
+        col_ind        = col_ind,
+        data_alpha_ind = data_alpha_ind,
+        beta_rows      = beta_rows,
+        shape          = shape,
+        arr_type       = arr_type,
+        structure      = structure,
+        ordering       = False,
+    )
+    indices, indptr, data_perm, row_select = csc_pattern
+    indices = indices.astype(np.int32)
+    indptr = indptr.astype(np.int32)
+
+    context = None
+    if structure is not None:
+        context = structure.get(('umfpack', family), None)
+    if context is None:
+        context = umfpack.UmfpackContext(family)
+        A_csc = scisparse.csc_matrix(
+            (data_A[0, data_perm], indices, indptr),
+            shape = (N_keys, N_keys),
+        )
+        context.symbolic(A_csc)
+        if structure is not None:
+            structure[('umfpack', family)] = context
+            structure['umfpack_N_symbolic'] = structure.get('umfpack_N_symbolic', 0) + 1
+
+    B = np.zeros((N_keys, N_alpha), dtype = arr_type)
+    x_out = np.empty((N_freq, len(beta_rows), N_alpha), dtype = arr_type)
+    for idx_f in range(N_freq):
+        A_csc = scisparse.csc_matrix(
+            (data_A[idx_f, data_perm], indices, indptr),
+            shape = (N_keys, N_keys),
+        )
+        B[row_alpha_ind, col_alpha_ind] = data_B[idx_f]
+        context.free_numeric()
+        try:
+            context.numeric(A_csc)
+        except RuntimeError:
+            warnings.warn("Matrix is exactly singular", scisparselin.MatrixRankWarning)
+            x_out[idx_f] = np.nan
+            continue
+        for idx_c in range(N_alpha):
+            x = context.solve(umfpack.UMFPACK_A, A_csc, B[:, idx_c], autoTranspose = False)
+            x_out[idx_f, :, idx_c] = x[row_select]
+    context.free_numeric()
+    return _batched_edges(x_out, beta_rows, shape)
 
 
 def inverse_solve_inplace(
@@ -272,6 +595,7 @@ def inverse_solve_inplace(
     verbose      = False,
     negative     = False,
     scattering   = False,
+    structure    = None,
     **kwargs
 ):
     #the later inverter balks if the edge map is empty, so exit early in that case
@@ -287,7 +611,6 @@ def inverse_solve_inplace(
         keys = set(seq.keys()) | set(req.keys()) | inputs_set | outputs_set
         if inputs_map is not None:
             keys.update(inputs_map.keys())
-        print("IMAP: ", inputs_set)
         for node in keys:
             if node in seq[node]:
                 edge_map[node, node] = edge_map[node, node] - 1
@@ -329,24 +652,17 @@ def inverse_solve_inplace(
         seq_beta[onode].add(wonode)
         edge_map[onode, wonode] = value
 
-    #purge_in = False
-    #purge_out = False
-    if purge_in:
-        purge_reqless_inplace(
-            seq       = seq,
-            req       = req,
-            seq_beta  = seq_beta,
-            req_alpha = req_alpha,
-            edge_map  = edge_map,
-        )
-    if purge_out:
-        purge_seqless_inplace(
-            seq        = seq,
-            req        = req,
-            seq_beta   = seq_beta,
-            req_alpha  = req_alpha,
-            edge_map   = edge_map,
-        )
+    purge_inplace(
+        seq        = seq,
+        req        = req,
+        seq_beta   = seq_beta,
+        req_alpha  = req_alpha,
+        edge_map   = edge_map,
+        purge_in   = purge_in,
+        purge_out  = purge_out,
+        structure  = structure,
+    )
+
     #print("SEQ")
     #print_seq(seq, edge_map)
 
@@ -361,6 +677,7 @@ def inverse_solve_inplace(
         req_alpha = req_alpha,
         edge_map  = edge_map,
         verbose   = verbose,
+        structure = structure,
         **kwargs
     )
 
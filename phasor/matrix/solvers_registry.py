@@ -4,6 +4,7 @@
 from __future__ import division, print_function, unicode_literals
 from ..utilities.future_from_2 import str, object
 
+import functools
 import numpy as np
 from collections import defaultdict
 import declarative
@@ -41,8 +42,66 @@ def loop_fast_unstable():
 
 def loop_LUQ():
     from ..matrix import DAG_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
     return declarative.Bunch(
         inverse_solve_inplace = DAG_algorithm.inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            DAG_algorithm.inverse_solve_inplace,
+        ),
+        symbolics_supported   = True,
+        symbolics_inline      = False,
+    )
+
+
+def loop_LUQ_tape():
+    from ..matrix import DAG_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
+    #replays the recorded elimination steps between solves of the same structure
+    inverse_solve_inplace = functools.partial(
+        DAG_algorithm.inverse_solve_inplace,
+        elimination_tape = True,
+    )
+    return declarative.Bunch(
+        inverse_solve_inplace = inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            inverse_solve_inplace,
+        ),
+        symbolics_supported   = True,
+        symbolics_inline      = False,
+    )
+
+
+def loop_LUQ_buffered():
+    from ..matrix import DAG_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
+    #accumulates the numeric fill-in in place, for long frequency vectors
+    inverse_solve_inplace = functools.partial(
+        DAG_algorithm.inverse_solve_inplace,
+        edge_buffer = True,
+    )
+    return declarative.Bunch(
+        inverse_solve_inplace = inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            inverse_solve_inplace,
+        ),
+        symbolics_supported   = True,
+        symbolics_inline      = False,
+    )
+
+
+def loop_LUQ_SCC():
+    from ..matrix import SCC_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
+    #solves the strongly connected components separately, keeping the blocks between solves
+    return declarative.Bunch(
+        inverse_solve_inplace = SCC_algorithm.inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            SCC_algorithm.inverse_solve_inplace,
+        ),
         symbolics_supported   = True,
         symbolics_inline      = False,
     )
@@ -50,43 +109,78 @@ def loop_LUQ():
 
 def scisparse():
     from ..matrix import scisparse_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
     return declarative.Bunch(
         inverse_solve_inplace = scisparse_algorithm.inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            scisparse_algorithm.inverse_solve_inplace,
+        ),
         symbolics_supported   = False,
     )
 
 
 def scisparse_superLU():
     from ..matrix import scisparse_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
     from scipy.sparse.linalg import use_solver
     use_solver(useUmfpack = False)
     return declarative.Bunch(
         inverse_solve_inplace = scisparse_algorithm.inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            scisparse_algorithm.inverse_solve_inplace,
+        ),
         symbolics_supported   = False,
     )
 
 
 def scisparse_umfpack():
     from ..matrix import scisparse_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
     from scipy.sparse.linalg import use_solver
     use_solver(useUmfpack = True)
+    #the symbolic analysis is kept with the structure, each point only refactors numerically
+    inverse_solve_inplace = functools.partial(
+        scisparse_algorithm.inverse_solve_inplace,
+        matrix_solver = scisparse_algorithm._solve_batched_umfpack,
+    )
     return declarative.Bunch(
-        inverse_solve_inplace = scisparse_algorithm.inverse_solve_inplace,
+        inverse_solve_inplace = inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            inverse_solve_inplace,
+        ),
         symbolics_supported   = False,
     )
 
-#TODO: Make a KLU solver since Finesse uses it. We could also reuse the symbolic solver portion!
+
+def klu():
+    from ..matrix import klu_algorithm
+    from ..matrix.matrix_generic import SolverPrepared
+    return declarative.Bunch(
+        inverse_solve_inplace = klu_algorithm.inverse_solve_inplace,
+        prepare               = functools.partial(
+            SolverPrepared,
+            klu_algorithm.inverse_solve_inplace,
+        ),
+        symbolics_supported   = False,
+    )
 
 
 solvers_symbolic = dict(
     loop_fast_unstable = loop_fast_unstable,
     loop_LUQ           = loop_LUQ,
+    loop_LUQ_tape      = loop_LUQ_tape,
+    loop_LUQ_buffered  = loop_LUQ_buffered,
+    loop_LUQ_SCC       = loop_LUQ_SCC,
 )
 
 solvers_numeric = dict(
     scisparse_umfpack = scisparse_umfpack,
     scisparse_superLU = scisparse_superLU,
     scisparse         = scisparse,
+    klu               = klu,
 )
 
 solvers_all = dict()
@@ -5,7 +5,7 @@ from __future__ import division, print_function, unicode_literals
 from ..utilities.future_from_2 import str, object
 
 #from phasor.utilities.print import print
-#import declarative
+import declarative
 import collections
 #import copy
 import numpy as np
@@ -16,6 +16,7 @@ from ..utilities.print import pprint
 from ..system.matrix_injections import (
     FactorCouplingBase,
 )
+from ..matrix.edge_buffer import edges_shape_dtype
 
 def pk_prefs(*preflist):
     def key(pk):
@@ -81,6 +82,62 @@ def lt_sort_collect(new_list):
     return list_gen
 
 
+def starts_find(idx_sorted):
+    """
+    Starting indices of the runs of equal values in idx_sorted
+    """
+    if not len(idx_sorted):
+        return idx_sorted
+    return np.flatnonzero(np.concatenate([[True], idx_sorted[1:] != idx_sorted[:-1]]))
+
+
+def segments_sum(arr, starts):
+    """
+    Sums the rows of arr over the segments beginning at starts. The segments are short, so they are
+    summed by their position rather than through np.add.reduceat, which is slow along the leading axis.
+    """
+    lengths = np.diff(np.concatenate([starts, [len(arr)]]))
+    arr_sum = arr[starts]
+    for idx_pos in range(1, np.max(lengths)):
+        select = lengths > idx_pos
+        arr_sum[select] += arr[starts[select] + idx_pos]
+    return arr_sum
+
+
+def terms_eval(gains, vals, t_gains, t_factors, starts):
+    """
+    Sums of the products gain * vals[factors...] over the segments of the terms
+    """
+    prods = gains[t_gains] * vals[t_factors[:, 0]]
+    for idx_factor in range(1, t_factors.shape[1]):
+        prods *= vals[t_factors[:, idx_factor]]
+    return segments_sum(prods, starts)
+
+
+def group_reduce(group, vals_NZ):
+    """
+    The terms of a group of the numeric plan of ExpMatCoupling, dropping those with a factor of zero
+    """
+    t_NZ = np.all(vals_NZ[group.t_factors], axis = 1)
+    d_NZ = np.all(vals_NZ[group.d_factors], axis = 1)
+    t_rows = group.t_rows[t_NZ]
+    t_starts = starts_find(t_rows)
+    d_entries = group.d_entries[d_NZ]
+    d_starts = starts_find(d_entries)
+    d_entries = d_entries[d_starts]
+    return declarative.Bunch(
+        idx_rows_upd = group.idx_rows[t_rows[t_starts]],
+        t_gains      = group.t_gains[t_NZ],
+        t_factors    = group.t_factors[t_NZ],
+        t_starts     = t_starts,
+        d_gains      = group.d_gains[d_NZ],
+        d_factors    = group.d_factors[d_NZ],
+        d_starts     = d_starts,
+        d_rows       = group.idx_rows[group.d_rows[d_entries]],
+        d_cols       = group.d_cols[d_entries],
+    )
+
+
 class ExpMatCoupling(FactorCouplingBase):
     """
     Generated by a dict-dict mapping ddlt[out][in] = list-tup-expr
@@ -105,15 +162,25 @@ class ExpMatCoupling(FactorCouplingBase):
         dLt,
         in_map,
         out_map,
-        N_ode = 1,
+        N_ode    = 1,
+        adaptive = False,
+        rtol     = 1e-4,
     ):
         self.N_ode     = N_ode
+        self.adaptive  = adaptive
+        self.rtol      = rtol
         self.dLt       = dLt
         self.out_map   = out_map
         self.in_map    = in_map
         self.solution  = dict()
         self.vals_prev = dict()
         self.vals_inj  = dict()
+        self.ode_stats = declarative.Bunch(
+            N_solutions  = 0,
+            N_steps      = 0,
+            N_rejected   = 0,
+            N_steps_last = 0,
+        )
 
         #make the internal solution have no action initially (so that cavity feedback converges faster)
         for pk_internal, pk_in in self.in_map.items():
@@ -161,8 +228,6 @@ class ExpMatCoupling(FactorCouplingBase):
 
         #print(ins_p, sol_vector)
         self.pks = list(pks)
-        #TODO: debug config
-        print("Number of states: ", len(pks))
         #pprint(pks)
         self.pks.sort(key = pk_prefs(
             ports.QuantumKey,
@@ -203,6 +268,14 @@ class ExpMatCoupling(FactorCouplingBase):
 
     _prev_sol_vector = None
 
+    #integrate through index arrays when the gains and values are numeric
+    vectorized = True
+    #points integrated together by the array integration
+    numeric_chunk_points = 512
+    #bound on the steps of the adaptive integration
+    N_steps_max = 100000
+    _numeric_plan_cache = None
+
     def update_solution(self, sol_vector):
         if self._prev_sol_vector is None or sol_vector != self._prev_sol_vector:
             self._prev_sol_vector = sol_vector
@@ -248,6 +321,21 @@ class ExpMatCoupling(FactorCouplingBase):
 
         pk_original = pkv.copy()
 
+        self.vals_prev = dict()
+        #inject subtracted values at input to remove the DC values an only get the derivative
+        for idx_in in range(len(pks)):
+            pkin = self.in_map[pks[idx_in]]
+
+            val = pk_original[idx_in]
+            if np.any(val != 0):
+                self.vals_prev[pkin] = val
+
+        if self.vectorized:
+            shape, dtype = edges_shape_dtype(dict(enumerate(pkv)))
+            if shape is not None and self._numeric_plan() is not None:
+                self.generate_solution_numeric(pkv, shape, dtype)
+                return
+
         def lt_val(lt):
             assert(isinstance(lt, list))
             val = 0
@@ -379,15 +467,6 @@ class ExpMatCoupling(FactorCouplingBase):
                         dMexp_s1[idx_pk][idx_in] += vec_val
             #print("FULLSKIP: ", fullskip, fullskip / len(dLt_idx_list))
 
-        self.vals_prev = dict()
-        #inject subtracted values at input to remove the DC values an only get the derivative
-        for idx_in in range(len(pks)):
-            pkin = self.in_map[pks[idx_in]]
-
-            val = pk_original[idx_in]
-            if np.any(val != 0):
-                self.vals_prev[pkin] = val
-
         #print("START EDGES")
         #for idx_out in range(len(pks)):
         #    for idx_in in range(len(pks)):
@@ -442,9 +521,290 @@ class ExpMatCoupling(FactorCouplingBase):
             vals_inj[pkout] = altered_val
         self.vals_inj = vals_inj
 
+        self._ode_stats_update(self.N_ode)
         #print("DONE SOLVING ")
         return
 
+    def _numeric_plan(self):
+        """
+        Index arrays of the terms of dLt_accel, for the states updated in order. Consecutive states
+        that don't read each other are grouped, so that each group is a single update and gives the
+        same values as the ordered updates. The factor indices are padded with len(pks), the slot
+        holding a one. None if the gains are not numeric.
+        """
+        plan = self._numeric_plan_cache
+        if plan is not None:
+            return plan or None
+        N = len(self.pks)
+
+        def padded(factor_lists):
+            D = max([1] + [len(factors) for factors in factor_lists])
+            arr = np.full((len(factor_lists), D), N, dtype = int)
+            for idx, factors in enumerate(factor_lists):
+                arr[idx, :len(factors)] = factors
+            return arr
+
+        row_groups = [[]]
+        updated = set()
+        for idx_pk, lt in sorted(self.dLt_accel.items()):
+            if not lt:
+                continue
+            reads = set()
+            for sublt in lt:
+                reads.update(sublt[1:])
+            if reads & updated:
+                row_groups.append([])
+                updated = set()
+            row_groups[-1].append((idx_pk, lt))
+            updated.add(idx_pk)
+
+        gains = []
+        groups = []
+        for row_group in row_groups:
+            if not row_group:
+                continue
+            t_gains = []
+            t_rows = []
+            t_factors = []
+            d_terms = []
+            for idx_row, (idx_pk, lt) in enumerate(row_group):
+                for sublt in lt:
+                    factors = sublt[1:]
+                    t_gains.append(len(gains))
+                    t_rows.append(idx_row)
+                    t_factors.append(factors)
+                    for idx_idx, pk_idx_from in enumerate(factors):
+                        d_terms.append((
+                            idx_row,
+                            pk_idx_from,
+                            len(gains),
+                            factors[:idx_idx] + factors[idx_idx + 1:],
+                        ))
+                    gains.append(sublt[0])
+            #the derivative terms are summed into (row, column) entries, so they are ordered by them
+            d_terms.sort(key = lambda term: term[:2])
+            d_entries = sorted(set(term[:2] for term in d_terms))
+            d_entries_inv = dict((entry, idx) for idx, entry in enumerate(d_entries))
+            groups.append(declarative.Bunch(
+                idx_rows   = np.asarray([idx_pk for idx_pk, lt in row_group], dtype = int),
+                t_gains    = np.asarray(t_gains, dtype = int),
+                t_factors  = padded(t_factors),
+                t_rows     = np.asarray(t_rows, dtype = int),
+                d_gains    = np.asarray([term[2] for term in d_terms], dtype = int),
+                d_factors  = padded([term[3] for term in d_terms]),
+                d_entries  = np.asarray([d_entries_inv[term[:2]] for term in d_terms], dtype = int),
+                d_rows     = np.asarray([entry[0] for entry in d_entries], dtype = int),
+                d_cols     = np.asarray([entry[1] for entry in d_entries], dtype = int),
+            ))
+
+        shape, dtype = edges_shape_dtype(dict(enumerate(gains)))
+        if shape is None:
+            #cached as False to skip the checks
+            self._numeric_plan_cache = False
+            return None
+        self._numeric_plan_cache = (gains, groups)
+        return self._numeric_plan_cache
+
+    def generate_solution_numeric(self, pkv, shape, dtype):
+        """
+        Same integration as generate_solution, with the states held in an (N + 1, points) array and the
+        nonzero edges of the derivative matrix in rows of an (edges, points) array, so that each group of
+        updates is a few array operations rather than loops over dictionaries of values.
+        """
+        gains_list, groups = self._numeric_plan()
+        pks = self.pks
+        N = len(pks)
+
+        gshape, gdtype = edges_shape_dtype(dict(enumerate(gains_list)))
+        shape = np.broadcast(np.empty(shape, dtype = bool), np.empty(gshape, dtype = bool)).shape
+        dtype = np.promote_types(dtype, gdtype)
+        N_points = int(np.prod(shape, dtype = int))
+
+        def flat(val):
+            return np.broadcast_to(val, shape).reshape(N_points)
+
+        def unflat(arr):
+            if shape:
+                return arr.reshape(shape)
+            return arr[0]
+
+        gains = np.empty((len(gains_list), N_points), dtype = dtype)
+        for idx, gain in enumerate(gains_list):
+            gains[idx] = flat(gain)
+        vals = np.empty((N + 1, N_points), dtype = dtype)
+        for idx, val in enumerate(pkv):
+            vals[idx] = flat(val)
+        vals[N] = 1
+        vals_orig = vals[:N].copy()
+
+        #the points are independent, and are integrated in chunks so that the temporaries stay in cache
+        chunks = []
+        N_steps = 0
+        for idx_start in range(0, N_points, self.numeric_chunk_points):
+            chunk = slice(idx_start, idx_start + self.numeric_chunk_points)
+            vals_chunk = vals[:, chunk].copy()
+            gains_chunk = gains[:, chunk].copy()
+            if self.adaptive:
+                steps = self._adaptive_steps(groups, gains_chunk, vals_chunk)
+            else:
+                steps = [1] * self.N_ode
+            N_steps = max(N_steps, len(steps))
+            edge_slots, dMexp = self._integrate_numeric(groups, gains_chunk, vals_chunk, steps)
+            vals[:, chunk] = vals_chunk
+            chunks.append((chunk, edge_slots, dMexp))
+        self._ode_stats_update(N_steps)
+
+        #the union of the nonzero edges, ordered by their output
+        edges_NZ = np.zeros(N * N, dtype = bool)
+        for chunk, edge_slots, dMexp_chunk in chunks:
+            edges_NZ |= (edge_slots >= 0)
+        edges = np.flatnonzero(edges_NZ)
+        if len(chunks) == 1:
+            dMexp = dMexp_chunk[edge_slots[edges]]
+        else:
+            dMexp = np.zeros((len(edges), N_points), dtype = dtype)
+            for chunk, edge_slots, dMexp_chunk in chunks:
+                slots = edge_slots[edges]
+                dMexp[slots >= 0, chunk] = dMexp_chunk[slots[slots >= 0]]
+        edges_out = edges // N
+        edges_in = edges % N
+
+        solution = dict()
+        for idx_edge, (idx_out, idx_in) in enumerate(zip(edges_out, edges_in)):
+            pkin = self.in_map[pks[idx_in]]
+            pkout = self.out_map[pks[idx_out]]
+            if pkin is not None and pkout is not None:
+                solution[pkin, pkout] = unflat(dMexp[idx_edge])
+        self.solution = solution
+
+        #dval_out cancels the forward propagation of the inputs, as in generate_solution. Every output
+        #has its diagonal edge
+        dval_out = segments_sum(dMexp * vals_orig[edges_in], starts_find(edges_out))
+        vals_inj = dict()
+        for idx_out in range(N):
+            pkout = self.out_map[pks[idx_out]]
+            if pkout is None:
+                continue
+            vals_inj[pkout] = unflat(vals[idx_out] - dval_out[idx_out])
+        self.vals_inj = vals_inj
+        return
+
+    def _integrate_numeric(self, groups, gains, vals, steps):
+        """
+        Integrates vals in place, over steps given in units of 1 / N_ode. Returns the slots of the
+        (out, in) edges, -1 for the zero edges, and the array holding the edges in its rows.
+        """
+        N = len(self.pks)
+        N_points = vals.shape[1]
+
+        #the derivative matrix, including the identity
+        edge_slots = np.full(N * N, -1, dtype = int)
+        edge_slots[np.arange(N) * (N + 1)] = np.arange(N)
+        dMexp = np.zeros((4 * N, N_points), dtype = vals.dtype)
+        dMexp[:N] = 1
+        N_slots = N
+
+        #as in generate_solution, the terms with a factor of zero are dropped until that state changes
+        vals_NZ = np.any(vals != 0, axis = 1)
+        groups_NZ = [group_reduce(group, vals_NZ) for group in groups]
+
+        for step in steps:
+            #the gains of dLt_accel hold the step 1 / N_ode
+            if step == 1:
+                gains_step = gains
+            else:
+                gains_step = gains * step
+            for idx_group in range(len(groups)):
+                group = groups_NZ[idx_group]
+                #the derivatives use the values before this update
+                if len(group.d_gains):
+                    Mexp_vec = terms_eval(gains_step, vals, group.d_gains, group.d_factors, group.d_starts)
+                if len(group.t_gains):
+                    dvals = terms_eval(gains_step, vals, group.t_gains, group.t_factors, group.t_starts)
+                    vals[group.idx_rows_upd] += dvals
+                    rows_NZ = group.idx_rows_upd[np.any(dvals != 0, axis = 1)]
+                    if not np.all(vals_NZ[rows_NZ]):
+                        vals_NZ[rows_NZ] = True
+                        groups_NZ = [group_reduce(group, vals_NZ) for group in groups]
+                if not len(group.d_gains):
+                    continue
+
+                #(entry, in) pairs of the products with nonzero edges, ordered by the updated edge
+                idx_e, idx_k = np.nonzero(edge_slots.reshape(N, N)[group.d_cols] >= 0)
+                if not len(idx_e):
+                    continue
+                edges_upd = group.d_rows[idx_e] * N + idx_k
+                order = np.argsort(edges_upd, kind = 'mergesort')
+                idx_e = idx_e[order]
+                idx_k = idx_k[order]
+                edges_upd = edges_upd[order]
+                starts = starts_find(edges_upd)
+                dMexp_prods = Mexp_vec[idx_e] * dMexp[edge_slots[group.d_cols[idx_e] * N + idx_k]]
+                edges_upd = edges_upd[starts]
+
+                edges_new = edges_upd[edge_slots[edges_upd] < 0]
+                if len(edges_new):
+                    if N_slots + len(edges_new) > len(dMexp):
+                        dMexp_prev = dMexp
+                        dMexp = np.empty((2 * (N_slots + len(edges_new)), N_points), dtype = vals.dtype)
+                        dMexp[:N_slots] = dMexp_prev[:N_slots]
+                    edge_slots[edges_new] = np.arange(N_slots, N_slots + len(edges_new))
+                    dMexp[N_slots : N_slots + len(edges_new)] = 0
+                    N_slots += len(edges_new)
+                dMexp[edge_slots[edges_upd]] += segments_sum(dMexp_prods, starts)
+        return edge_slots, dMexp[:N_slots]
+
+    def _adaptive_steps(self, groups, gains, vals):
+        """
+        Steps (in units of 1 / N_ode) chosen by step doubling. Each step is compared to two steps of
+        half the size, whose difference estimates the error of the first order update. The halves of
+        the accepted steps are returned, and the step grows or shrinks with the estimated error.
+        """
+        groups_full = [group_reduce(group, np.ones(len(vals), dtype = bool)) for group in groups]
+
+        def step_vals(vals, step):
+            vals = vals.copy()
+            gains_step = gains * (step * self.N_ode)
+            for group in groups_full:
+                if len(group.t_gains):
+                    vals[group.idx_rows_upd] += terms_eval(
+                        gains_step, vals, group.t_gains, group.t_factors, group.t_starts
+                    )
+            return vals
+
+        steps = []
+        position = 0
+        step = 1
+        N_tries = 0
+        while 1 - position > 1e-12:
+            N_tries += 1
+            if N_tries > self.N_steps_max:
+                raise RuntimeError("Adaptive ODE solution exceeded N_steps_max")
+            step = min(step, 1 - position)
+            vals_full = step_vals(vals, step)
+            vals_half = step_vals(step_vals(vals, step / 2), step / 2)
+            #the error is relative to the largest state at each point
+            scale = self.rtol * np.max(abs(vals_half[:-1]), axis = 0)
+            diff = np.max(abs(vals_full[:-1] - vals_half[:-1]), axis = 0)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                err = np.max(np.where(diff > 0, diff / scale, 0))
+            if err <= 1:
+                vals = vals_half
+                position += step
+                steps.extend([step / 2 * self.N_ode] * 2)
+            else:
+                self.ode_stats.N_rejected += 1
+            if err == 0:
+                step = step * 4
+            else:
+                step = step * min(4, max(.2, .9 / err**.5))
+        return steps
+
+    def _ode_stats_update(self, N_steps):
+        self.ode_stats.N_solutions  += 1
+        self.ode_stats.N_steps      += N_steps
+        self.ode_stats.N_steps_last  = N_steps
+        return
 
 
 #Old version
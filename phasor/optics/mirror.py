@@ -50,19 +50,23 @@ class Mirror(
         val = self.ctree.setdefault('R_backscatter', val)
         return val
 
+    #the transmission and losses may be replaced after construction, see BGSystem.element_update
     @declarative.dproperty
-    def T_hr(self, val = 0):
-        val = self.ctree.setdefault('T_hr', val)
+    def T_hr(self, val = 0, val_prev = declarative.NOARG):
+        if val_prev is declarative.NOARG:
+            val = self.ctree.setdefault('T_hr', val)
         return val
 
     @declarative.dproperty
-    def L_hr(self, val = 0):
-        val = self.ctree.setdefault('L_hr', val)
+    def L_hr(self, val = 0, val_prev = declarative.NOARG):
+        if val_prev is declarative.NOARG:
+            val = self.ctree.setdefault('L_hr', val)
         return val
 
     @declarative.dproperty
-    def L_t(self, val = 0):
-        val = self.ctree.setdefault('L_t', val)
+    def L_t(self, val = 0, val_prev = declarative.NOARG):
+        if val_prev is declarative.NOARG:
+            val = self.ctree.setdefault('L_t', val)
         return val
 
     #self.angleZ  = MechanicalPortHolder(self, x = 'aZ')
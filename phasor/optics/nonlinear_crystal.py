@@ -31,6 +31,23 @@ class NonlinearCrystal(
         val = self.ctree.setdefault('N_ode', val)
         return val
 
+    @declarative.dproperty
+    def ode_adaptive(self, val = False):
+        """
+        Choose the steps of the ODE solution from an estimate of their error, rather than using N_ode
+        equal steps. Symbolic solutions always use N_ode steps.
+        """
+        val = self.ctree.setdefault('ode_adaptive', val)
+        return val
+
+    @declarative.dproperty
+    def ode_rtol(self, val = 1e-4):
+        """
+        Error allowed for each adaptive step, relative to the largest field
+        """
+        val = self.ctree.setdefault('ode_rtol', val)
+        return val
+
     @declarative.dproperty
     def nlg(self, val):
         """
@@ -153,6 +170,7 @@ class NonlinearCrystal(
             self.po_Bk: self.po_Fr,
         }
 
+        self.ode_couplings = []
         for port in self.ports_optical:
             dLt = collections.defaultdict(list)
             out_map = dict()
@@ -241,14 +259,29 @@ class NonlinearCrystal(
                     #        #print("JOIN2: ", kfrom, kfrom2, kto)
 
             #pprint(dLt)
-            matrix_algorithm.injection_insert(
-                ODE_solver.ExpMatCoupling(
-                    dLt         = dLt,
-                    in_map      = in_map,
-                    out_map     = out_map,
-                    N_ode       = self.N_ode,
-                )
+            coupling = ODE_solver.ExpMatCoupling(
+                dLt         = dLt,
+                in_map      = in_map,
+                out_map     = out_map,
+                N_ode       = self.N_ode,
+                adaptive    = self.ode_adaptive,
+                rtol        = self.ode_rtol,
             )
+            self.ode_couplings.append(coupling)
+            matrix_algorithm.injection_insert(coupling)
         return
 
+    def ode_stats(self):
+        """
+        Steps taken by the ODE solutions of both directions, N_steps_last is the largest count of
+        the last solutions
+        """
+        stats = [coupling.ode_stats for coupling in self.ode_couplings]
+        return declarative.Bunch(
+            N_solutions  = sum(stat.N_solutions for stat in stats),
+            N_steps      = sum(stat.N_steps for stat in stats),
+            N_rejected   = sum(stat.N_rejected for stat in stats),
+            N_steps_last = max([0] + [stat.N_steps_last for stat in stats]),
+        )
+
 
@@ -52,10 +52,8 @@ class Space(
 
     def system_setup_ports(self, ports_algorithm):
         for port in self.ports_optical:
-            for kfrom in ports_algorithm.port_update_get(port.i):
-                ports_algorithm.port_coupling_needed(self.pmap[port].o, kfrom)
-            for kto in ports_algorithm.port_update_get(port.o):
-                ports_algorithm.port_coupling_needed(self.pmap[port].i, kto)
+            ports_algorithm.port_couplings_needed(self.pmap[port].o, ports_algorithm.port_update_get(port.i))
+            ports_algorithm.port_couplings_needed(self.pmap[port].i, ports_algorithm.port_update_get(port.o))
         return
 
     def system_setup_coupling(self, matrix_algorithm):
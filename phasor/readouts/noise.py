@@ -5,6 +5,7 @@ from __future__ import division, print_function, unicode_literals
 #from ..utilities.print import pprint
 
 import numpy as np
+import warnings
 from collections import defaultdict
 
 import declarative
@@ -13,6 +14,18 @@ from ..utilities.future_from_2 import super
 from .. import base
 
 
+def shape_broadcast(vals):
+    """
+    The shape that all of vals broadcast to.
+    """
+    shape = ()
+    for val in vals:
+        vshape = np.shape(val)
+        if vshape != shape:
+            shape = np.broadcast(np.empty(shape, dtype = bool), np.empty(vshape, dtype = bool)).shape
+    return shape
+
+
 class NoiseReadout(base.SystemElementBase):
     def __init__(
             self,
@@ -89,61 +102,120 @@ class NoiseReadout(base.SystemElementBase):
                 ncollect = self.external_collect
             )
 
-        #TODO, can definitely condense this
         cbunch = self.system.solution.coupling_solution_get(
             drive_set = 'noise',
             readout_set = self.port_set,
         )
         coupling_matrix_inv = cbunch.coupling_matrix_inv
-        #pprint(coupling_matrix_inv)
         nmap = self.system.solution.noise_map()
-        #pprint(("NMAP: ", nmap))
+
+        #the readout views, P and N sidebands. Several names may view the same port
+        pnames = list(self.port_map.keys())
+        viewsP = defaultdict(list)
+        viewsN = defaultdict(list)
+        for idx_view, pname in enumerate(pnames):
+            port = self.port_map[pname]
+            viewsP[port, self.keyP].append(idx_view)
+            viewsN[port, self.keyN].append(idx_view)
+
+        #single scan of the inverse for the transfer vectors of all views
+        tvecsP = defaultdict(dict)
+        tvecsN = defaultdict(dict)
+        for (pkfrom, pkto), cplg in coupling_matrix_inv.items():
+            for idx_view in viewsP.get(pkto, ()):
+                tvecsP[pkfrom][idx_view] = cplg
+            for idx_view in viewsN.get(pkto, ()):
+                tvecsN[pkfrom][idx_view] = cplg
+
+        #the noise cross-spectra as sparse entries, grouped by source
+        sources = []
+        entries = defaultdict(list)
+        for pk1, nmap_inner in nmap.items():
+            if pk1 not in tvecsP:
+                continue
+            for pk2, vals in nmap_inner.items():
+                if pk2 not in tvecsN:
+                    continue
+                for pe_1, k1, pe_2, k2, nobj in vals:
+                    pspec_2sided = nobj.noise_2pt_expectation(pe_1, k1, pe_2, k2)
+                    if nobj not in entries:
+                        sources.append(nobj)
+                    entries[nobj].append((pk1, pk2, pspec_2sided))
 
         ncollect = defaultdict(lambda: defaultdict(lambda: 0))
         nsums    = dict()
+        for pnameP in pnames:
+            for pnameN in pnames:
+                nsums[pnameP, pnameN] = 0
+        if not sources:
+            return declarative.Bunch(
+                ncollect = ncollect,
+                nsums    = nsums,
+            )
 
-        pkviewsP = dict()
-        pkviewsN = dict()
-        for pname, port in list(self.port_map.items()):
-            pkviewsP[pname] = (port, self.keyP)
-            pkviewsN[pname] = (port, self.keyN)
-            for pname2, port2 in list(self.port_map.items()):
-                nsums[pname, pname2] = 0
-
-        kvecsP = defaultdict(dict)
-        kvecsN = defaultdict(dict)
-        for (pkfrom, pkto), cplg in list(coupling_matrix_inv.items()):
-            for pname, pkview in list(pkviewsP.items()):
-                if pkto == pkview:
-                    kvecsP[pname][pkfrom] = cplg
-            for pname, pkview in list(pkviewsN.items()):
-                if pkto == pkview:
-                    kvecsN[pname][pkfrom] = cplg
-
-        for pnameP, kvecP in list(kvecsP.items()):
-            for pnameN, kvecN in list(kvecsN.items()):
-                nsum = 0
-                for pk1, cplg1 in list(kvecP.items()):
-                    nmap_inner = nmap.get(pk1, None)
-                    if nmap_inner is None:
-                        continue
-                    for pk2, cplg2 in list(kvecN.items()):
-                        vals = nmap_inner.get(pk2, None)
-                        if vals is None:
-                            continue
-                        for pe_1, k1, pe_2, k2, nobj in vals:
-                            pspec_2sided = nobj.noise_2pt_expectation(pe_1, k1, pe_2, k2)
-                            #print("PSPEC: ", pe_1, k1, pe_2, k2, pspec_2sided, cplg1 * cplg2)
-                            pspec_tot = self.system.adjust_PSD * pspec_2sided * cplg1 * cplg2
-                            if pnameP == pnameN:
-                                pspec_tot = np.real(pspec_tot)
-
-                            if not np.all(np.isfinite(pspec_tot)):
-                                print("BADNESS: ", nobj.name_system, pspec_tot)
-                            else:
-                                nsum += pspec_tot
-                                ncollect[nobj][pnameP, pnameN] = ncollect[nobj][pnameP, pnameN] + pspec_tot
-                nsums[pnameP, pnameN] = nsum
+        idxP = dict((pk, idx) for idx, pk in enumerate(tvecsP.keys()))
+        idxN = dict((pk, idx) for idx, pk in enumerate(tvecsN.keys()))
+        shape = shape_broadcast(
+            [cplg for tvec in tvecsP.values() for cplg in tvec.values()]
+            + [cplg for tvec in tvecsN.values() for cplg in tvec.values()]
+            + [e[2] for nobj in sources for e in entries[nobj]]
+        )
+        N_points = int(np.prod(shape, dtype = int))
+
+        def pack(val):
+            return np.broadcast_to(val, shape).reshape(N_points)
+
+        N_views = len(pnames)
+        TP = np.zeros((N_views, len(idxP), N_points), dtype = np.complex128)
+        TN = np.zeros((N_views, len(idxN), N_points), dtype = np.complex128)
+        for pk, tvec in tvecsP.items():
+            for idx_view, cplg in tvec.items():
+                TP[idx_view, idxP[pk]] = pack(cplg)
+        for pk, tvec in tvecsN.items():
+            for idx_view, cplg in tvec.items():
+                TN[idx_view, idxN[pk]] = pack(cplg)
+
+        #entries are contiguous by source, so each source contracts its own slice of them
+        I = []
+        J = []
+        S = []
+        source_offsets = []
+        for nobj in sources:
+            source_offsets.append(len(I))
+            for pk1, pk2, pspec_2sided in entries[nobj]:
+                I.append(idxP[pk1])
+                J.append(idxN[pk2])
+                S.append(pack(pspec_2sided))
+        source_offsets.append(len(I))
+        S = np.asarray(S) * self.system.adjust_PSD
+
+        #T . S . T^H summed over the entries of each source, never holding the per-entry terms
+        by_source = np.empty((len(sources), N_views, N_views, N_points), dtype = np.complex128)
+        for idx_src, nobj in enumerate(sources):
+            e_sl = slice(source_offsets[idx_src], source_offsets[idx_src + 1])
+            TP_src = TP[:, I[e_sl]]
+            TN_src = TN[:, J[e_sl]]
+            src = np.einsum('pef,ef,qef->pqf', TP_src, S[e_sl], TN_src)
+            if not np.all(np.isfinite(src)):
+                #drop the entries which aren't finite, as pairs of views
+                terms = np.einsum('pef,ef,qef->pqef', TP_src, S[e_sl], TN_src)
+                finite = np.all(np.isfinite(terms), axis = -1)
+                terms[~finite] = 0
+                src = np.sum(terms, axis = 2)
+                warnings.warn("Non-finite noise from {0} dropped".format(nobj.name_system))
+            by_source[idx_src] = src
+        totals = np.sum(by_source, axis = 0)
+
+        for idx_P, pnameP in enumerate(pnames):
+            for idx_N, pnameN in enumerate(pnames):
+                tot = totals[idx_P, idx_N]
+                src = by_source[:, idx_P, idx_N]
+                if pnameP == pnameN:
+                    tot = np.real(tot)
+                    src = np.real(src)
+                nsums[pnameP, pnameN] = tot.reshape(shape)
+                for idx_src, nobj in enumerate(sources):
+                    ncollect[nobj][pnameP, pnameN] = src[idx_src].reshape(shape)
         return declarative.Bunch(
             ncollect = ncollect,
             nsums    = nsums,
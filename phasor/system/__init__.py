@@ -5,6 +5,12 @@ from .system import (
     BGSystem,
 )
 
+from .sweep import (
+    AC_sweep,
+    AC_sweep_chunks,
+    AC_sweep_parallel,
+)
+
 from ..base import (
     Frequency,
 )
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Integer-indexed, frozen form of the coherent coupling graph.
+
+The seq/req graphs built by the MatrixBuildAlgorithm are dict-of-set containers keyed by (port, DictKey)
+tuples. They are fine to construct, but copying and pruning them for every solve is expensive on large
+models. The CompiledCouplingGraph is built once from those graphs using the integer index of the frozen
+field space. It stores the edges in CSC (seq, grouped by the from-node) and CSR (req, grouped by the to-node)
+index arrays, along with the edge-generating functions resolved once for each edge slot. Solves then only
+fill a data array (one value per edge slot) and a keep-mask.
+"""
+from __future__ import division, print_function, unicode_literals
+from ..utilities.future_from_2 import object
+
+import numpy as np
+from collections import defaultdict
+
+
+def indptr_counts(idx_array, keep, N):
+    counts = np.bincount(idx_array[keep], minlength = N)
+    indptr = np.empty(N + 1, dtype = np.intp)
+    indptr[0] = 0
+    np.cumsum(counts, out = indptr[1:])
+    return indptr
+
+
+class CompiledCouplingGraph(object):
+
+    def __init__(
+        self,
+        field_space,
+        seq,
+        req,
+        bonds_trivial,
+        inj_funclist,
+    ):
+        self.field_space = field_space
+        self.nodes       = field_space.idx_map_full()
+        self.N_nodes     = len(self.nodes)
+
+        edge_from = []
+        edge_to   = []
+        for pkfrom, seq_set in seq.items():
+            idx_from = field_space.key_map(pkfrom)
+            for pkto in seq_set:
+                edge_from.append(idx_from)
+                edge_to.append(field_space.key_map(pkto))
+        for pkto, req_set in req.items():
+            for pkfrom in req_set:
+                assert(pkto in seq[pkfrom])
+
+        edge_from = np.asarray(edge_from, dtype = np.intp)
+        edge_to   = np.asarray(edge_to, dtype = np.intp)
+        #canonical edge-slot ordering is sorted by (from, to)
+        order     = np.lexsort((edge_to, edge_from))
+        edge_from = edge_from[order]
+        edge_to   = edge_to[order]
+        self.edge_from = edge_from
+        self.edge_to   = edge_to
+        self.N_edges   = len(edge_from)
+
+        #CSC form of the coupling matrix (columns are the from-nodes). Matches the seq container.
+        self.seq_indptr  = indptr_counts(edge_from, self.keep_all(), self.N_nodes)
+        self.seq_indices = edge_to
+
+        #CSR form of the coupling matrix (rows are the to-nodes). Matches the req container.
+        #req_edges maps each CSR position back to its edge slot
+        self.req_edges   = np.argsort(edge_to, kind = 'mergesort')
+        self.req_indptr  = indptr_counts(edge_to, self.keep_all(), self.N_nodes)
+        self.req_indices = edge_from[self.req_edges]
+
+        #nodes that are keys in the original containers. The solvers treat every key as a node
+        #(scattering adds self-edges to them) so these are preserved even when all edges drop
+        self.seq_key_idx = np.sort(np.asarray([field_space.key_map(k) for k in seq.keys()], dtype = np.intp))
+        self.req_key_idx = np.sort(np.asarray([field_space.key_map(k) for k in req.keys()], dtype = np.intp))
+
+        #resolve the edge-generating functions once. None indicates a trivial bond with unit coupling
+        edge_keys  = []
+        edge_funcs = []
+        for idx_from, idx_to in zip(edge_from, edge_to):
+            pkfrom = self.nodes[idx_from]
+            pkto   = self.nodes[idx_to]
+            edge_keys.append((pkfrom, pkto))
+            factor_func_list = inj_funclist.get((pkfrom, pkto), None)
+            if factor_func_list is None:
+                #if it's not in the injection funclist then it must be a bond
+                assert(pkto in bonds_trivial[pkfrom])
+                edge_funcs.append(None)
+            else:
+                assert(pkto not in bonds_trivial[pkfrom])
+                edge_funcs.append(tuple(factor_func_list))
+        self.edge_keys  = edge_keys
+        self.edge_funcs = edge_funcs
+        self.edge_slots = dict((pkpk, idx) for idx, pkpk in enumerate(edge_keys))
+        return
+
+    def edge_funcs_update(self, pkpk, funclist):
+        """
+        Replaces the edge-generating functions of an edge, if the graph holds it
+        """
+        idx = self.edge_slots.get(pkpk, None)
+        if idx is None:
+            return
+        assert(self.edge_funcs[idx] is not None)
+        self.edge_funcs[idx] = tuple(funclist)
+        return
+
+    def keep_all(self):
+        return np.ones(self.N_edges, dtype = bool)
+
+    def seqreq_generate(self, keep = None):
+        """
+        Generate fresh seq/req dict-of-set containers from the edge slots marked in keep (or all of them).
+        The returned containers are owned by the caller, so the solvers may mutate them.
+        """
+        nodes = self.nodes
+        seq = defaultdict(set)
+        req = defaultdict(set)
+        if keep is None:
+            to_nodes   = nodes[self.seq_indices]
+            from_nodes = nodes[self.req_indices]
+            seq_indptr = self.seq_indptr
+            req_indptr = self.req_indptr
+        else:
+            to_nodes   = nodes[self.seq_indices[keep]]
+            from_nodes = nodes[self.req_indices[keep[self.req_edges]]]
+            seq_indptr = indptr_counts(self.edge_from, keep, self.N_nodes)
+            req_indptr = indptr_counts(self.edge_to, keep, self.N_nodes)
+
+        for idx in self.seq_key_idx:
+            seq[nodes[idx]] = set(to_nodes[seq_indptr[idx]:seq_indptr[idx + 1]])
+        for idx in self.req_key_idx:
+            req[nodes[idx]] = set(from_nodes[req_indptr[idx]:req_indptr[idx + 1]])
+        return seq, req
+
+
+class PackedSolution(object):
+    """
+    Solution vector packed into a single (N_nodes, N_points) complex array indexed by the frozen field
+    space. N_points is the flattened broadcast shape of the node values, stored in shape. The present mask
+    marks the nodes held by the original (sparse) solution.
+    """
+
+    def __init__(self, field_space, solution):
+        self.field_space = field_space
+        N_nodes = len(field_space.idx_map_full())
+
+        nodes = list(solution.keys())
+        if nodes:
+            arrays = np.broadcast_arrays(*[np.asarray(solution[k]) for k in nodes])
+            self.shape = arrays[0].shape
+        else:
+            arrays = []
+            self.shape = ()
+        self.N_points = int(np.prod(self.shape, dtype = int))
+
+        idx = np.asarray([field_space.key_map(k) for k in nodes], dtype = np.intp)
+        self.packed = np.zeros((N_nodes, self.N_points), dtype = np.complex128)
+        if nodes:
+            values = np.asarray(arrays)
+            if values.dtype.kind not in 'biufc':
+                raise TypeError("Solution values are not numeric")
+            self.packed[idx] = values.reshape(len(nodes), self.N_points)
+        self.present = np.zeros(N_nodes, dtype = bool)
+        self.present[idx] = True
+        return
+
+    def broadcast(self, shape):
+        """
+        The packed array broadcast to a (larger) value shape, still 2D.
+        """
+        if shape == self.shape:
+            return self.packed
+        N_nodes = self.packed.shape[0]
+        #value shapes broadcast from the right, so pad with leading singleton axes
+        shape_self = (1,) * (len(shape) - len(self.shape)) + self.shape
+        packed = np.broadcast_to(self.packed.reshape((N_nodes,) + shape_self), (N_nodes,) + shape)
+        return packed.reshape(N_nodes, -1)
+
+    def value(self, idx):
+        return self.packed[idx].reshape(self.shape)
+
+
+def solution_pack(field_space, solution):
+    """
+    Packs a solution vector, or returns None if the values can't be held in a complex array
+    (such as symbolic values).
+    """
+    try:
+        return PackedSolution(field_space, solution)
+    except (TypeError, ValueError):
+        return None
@@ -20,6 +20,12 @@ from ..matrix.matrix_generic import (
     purge_seqless_inplace,
 )
 
+from .compiled_graph import (
+    CompiledCouplingGraph,
+)
+
+from . import topology_cache
+
 from .matrix_injections import (
     ConstantEdgeCoupling,
     ConstantSourceCoupling,
@@ -55,6 +61,8 @@ class MatrixBuildAlgorithm(object):
         else:
             field_space = system.field_space_proto.copy()
         self.field_space                 = field_space
+        #the Newton mode needs the nodes read by the newton_terms of the injections in the solution
+        self.newton = getattr(system, 'nonlinear_solver', 'fixed_point') == 'newton'
 
         self.source_vector_injlist             = defaultdict(list)
         self.source_vector_inj_funclist        = defaultdict(list)
@@ -62,6 +70,8 @@ class MatrixBuildAlgorithm(object):
         self.coupling_matrix_inj_funclist      = defaultdict(list)
         self.floating_in_out_func_pair_injlist = []
         self.floating_req_set_injlist          = []
+        #injections whose funcs aren't linear in the solution vector, see FactorCouplingBase.newton_terms
+        self.newton_injlist                    = []
         self.all_injections = list()
 
         self.noise_pk_set = set()
@@ -93,15 +103,37 @@ class MatrixBuildAlgorithm(object):
         self.coupling_matrix_inj_funclist      = dict(self.coupling_matrix_inj_funclist.items())
         self.floating_in_out_func_pair_injlist = tuple(self.floating_in_out_func_pair_injlist)
         self.floating_req_set_injlist          = tuple(self.floating_req_set_injlist)
+        self.newton_injlist                    = tuple(self.newton_injlist)
+
+        #compile the sparsity graphs once now that the field space is frozen
+        csgb = self.coherent_subgraph_bunch
+        csgb.compiled_full = CompiledCouplingGraph(
+            field_space   = self.field_space,
+            seq           = csgb.seq_full,
+            req           = csgb.req_full,
+            bonds_trivial = self.bonds_trivial,
+            inj_funclist  = self.coupling_matrix_inj_funclist,
+        )
+        csgb.compiled_perturb = CompiledCouplingGraph(
+            field_space   = self.field_space,
+            seq           = csgb.seq_perturb,
+            req           = csgb.req_perturb,
+            bonds_trivial = self.bonds_trivial,
+            inj_funclist  = self.coupling_matrix_inj_funclist,
+        )
 
     def _setup_system(self):
+        #the injections of each element, to be replaced by element_injections_update
+        self.element_injections = dict()
         for el in self.system.elements:
             try:
                 ssc = el.system_setup_coupling
             except AttributeError:
                 pass
             else:
+                N_prev = len(self.all_injections)
                 ssc(self)
+                self.element_injections[el] = self.all_injections[N_prev:]
 
         AC_in_all = set()
         AC_out_all = set()
@@ -113,7 +145,19 @@ class MatrixBuildAlgorithm(object):
         #print("IN  ALL: ", self.AC_in_all)
         #print("OUT ALL: ", self.AC_out_all)
 
-        self.coherent_subgraph_bunch = self._coherent_sparsity_graph()
+        self.bonds_trivial = self._bonds_trivial_generate()
+        cache = self.ports_algo.topology_cache
+        csgb = None
+        if cache is not None:
+            csgb = topology_cache.sparsity_graph_load(cache)
+        if csgb is None:
+            csgb = self._coherent_sparsity_graph()
+            if cache is not None:
+                try:
+                    topology_cache.sparsity_graph_save(csgb, cache)
+                except topology_cache.TopologyCacheMiss:
+                    pass
+        self.coherent_subgraph_bunch = csgb
         return
 
     def _noise_map(self):
@@ -192,6 +236,8 @@ class MatrixBuildAlgorithm(object):
 
     def injection_insert(self, inj_obj):
         self.all_injections.append(inj_obj)
+        if inj_obj.newton_terms is not None:
+            self.newton_injlist.append(inj_obj)
         if inj_obj.floating_in_out_func_pairs is not None:
             self.floating_in_out_func_pair_injlist.append(inj_obj)
             for ins, outs, func in inj_obj.floating_in_out_func_pairs:
@@ -241,6 +287,57 @@ class MatrixBuildAlgorithm(object):
             self.field_space.keys_add(pks)
         return
 
+    def element_injections_update(self, element):
+        """
+        Regenerates the couplings of element (after a change of its parameters) and swaps them in for
+        the current ones. The new couplings must have the same structure as the originals, since the
+        port and sparsity analysis are kept. Returns the set of edges and sources that were replaced.
+        """
+        injlist_prev = self.element_injections.get(element, None)
+        if injlist_prev is None:
+            raise RuntimeError("Element {0} has no couplings to update".format(element))
+        recorder = MatrixInjectionRecorder(self)
+        element.system_setup_coupling(recorder)
+        injlist = recorder.injections
+
+        if len(injlist) != len(injlist_prev) or not all(
+            injection_structure_equal(inj_prev, inj) for inj_prev, inj in zip(injlist_prev, injlist)
+        ):
+            raise RuntimeError((
+                "The couplings of {0} changed structure, the system must be regenerated"
+            ).format(element))
+
+        csgb = self.coherent_subgraph_bunch
+        replaced = set()
+        inj_replace = dict()
+        for inj_prev, inj in zip(injlist_prev, injlist):
+            inj_replace[id(inj_prev)] = inj
+            for pkpk, func in inj.edges_pkpk_dict.items():
+                idx = injlist_index(self.coupling_matrix_injlist[pkpk], inj_prev)
+                self.coupling_matrix_injlist[pkpk][idx] = inj
+                self.coupling_matrix_inj_funclist[pkpk][idx] = func
+                replaced.add(pkpk)
+            for pks, func in inj.sources_pk_dict.items():
+                idx = injlist_index(self.source_vector_injlist[pks], inj_prev)
+                self.source_vector_injlist[pks][idx] = inj
+                self.source_vector_inj_funclist[pks][idx] = func
+                replaced.add(pks)
+
+        def swapped(injlist):
+            return [inj_replace.get(id(inj), inj) for inj in injlist]
+        self.all_injections                    = swapped(self.all_injections)
+        self.floating_in_out_func_pair_injlist = tuple(swapped(self.floating_in_out_func_pair_injlist))
+        self.floating_req_set_injlist          = tuple(swapped(self.floating_req_set_injlist))
+        self.newton_injlist                    = tuple(swapped(self.newton_injlist))
+        self.element_injections[element]       = injlist
+
+        for graph in [csgb.compiled_full, csgb.compiled_perturb]:
+            for pkpk in replaced:
+                funclist = self.coupling_matrix_inj_funclist.get(pkpk, None)
+                if funclist is not None:
+                    graph.edge_funcs_update(pkpk, funclist)
+        return replaced
+
     def nonlinear_triplet_insert(
             self,
             pkfrom1,
@@ -257,36 +354,18 @@ class MatrixBuildAlgorithm(object):
         self.injection_insert(inj)
         return
 
-    def _coherent_sparsity_graph(self):
-        #TODO: Comment this complicated, beautiful mess
-
-        subgraph_set = set()
-        inputs_set = set()
-        outputs_set = set()
-        #haven't had their edges swept
-        subgraph_set_pending = set()
-        subgraph_set_pending2 = set()
-
-        #holds nodes used for in-out-func couplings which will be purged after graph simplification
-        virtual_nodes = set()
-
-        #if a node hits order 0, then it should be in the subgraph set
-        node_sourcing_order = dict()
-        #if an edge hits order 0, then it should be in seq/req and should influence the sparsity graph
-        edge_sourcing_order = dict()
-        seq = defaultdict(set)
-        req = defaultdict(set)
-        self.bonds_trivial = defaultdict(dict)
+    def _bonds_trivial_generate(self):
+        """
+        The unit couplings of the bonds, including those through the post and pre ports, as a dict of
+        pkfrom to a dict of pkto to the bond value
+        """
+        bonds_trivial = defaultdict(dict)
 
         def bond_trivial(pkfrom, pkto, val):
-            edge_sourcing_order[pkfrom, pkto] = []
-            seq[pkfrom].add(pkto)
-            req[pkto].add(pkfrom)
             #pkfrom = (pfrom, kkey)
             #pkto = (pto, kkey)
-            self.bonds_trivial[pkfrom][pkto] = val
+            bonds_trivial[pkfrom][pkto] = val
 
-        #Setup all of the bond linkages first
         for pfrom, pto_dict in self.system.bond_pairs.items():
             pfrom_orig = pfrom
             for pto, val in pto_dict.items():
@@ -306,6 +385,41 @@ class MatrixBuildAlgorithm(object):
                     pto = pto_pre
                 for kkey in self.port_set_get(pfrom_orig):
                     bond_trivial((pfrom, kkey), (pto, kkey), val)
+        return bonds_trivial
+
+    def _edge_req_pkset(self, inj, pkpk):
+        NZreqset = inj.edges_req_pkset_dict[pkpk]
+        if self.newton:
+            newton_set = inj.edges_newton_pkset_dict.get(pkpk, None)
+            if newton_set is not None:
+                NZreqset = NZreqset | newton_set
+        return NZreqset
+
+    def _coherent_sparsity_graph(self):
+        #TODO: Comment this complicated, beautiful mess
+
+        subgraph_set = set()
+        inputs_set = set()
+        outputs_set = set()
+        #haven't had their edges swept
+        subgraph_set_pending = set()
+        subgraph_set_pending2 = set()
+
+        #holds nodes used for in-out-func couplings which will be purged after graph simplification
+        virtual_nodes = set()
+
+        #if a node hits order 0, then it should be in the subgraph set
+        node_sourcing_order = dict()
+        #if an edge hits order 0, then it should be in seq/req and should influence the sparsity graph
+        edge_sourcing_order = dict()
+        seq = defaultdict(set)
+        req = defaultdict(set)
+        #Setup all of the bond linkages first
+        for pkfrom, pkto_dict in self.bonds_trivial.items():
+            for pkto in pkto_dict:
+                edge_sourcing_order[pkfrom, pkto] = []
+                seq[pkfrom].add(pkto)
+                req[pkto].add(pkfrom)
 
         #now all of the forced NZ requirements:
         for inj in self.floating_req_set_injlist:
@@ -357,7 +471,7 @@ class MatrixBuildAlgorithm(object):
                 order = len(NZreqset)
                 if order == 0:
                     any_order0 = True
-                    NZreqset = inj.edges_req_pkset_dict[pkfrom, pkto]
+                    NZreqset = self._edge_req_pkset(inj, (pkfrom, pkto))
                     for onode in NZreqset:
                         outputs_set.add(onode)
                 order_list.append(order)
@@ -413,7 +527,7 @@ class MatrixBuildAlgorithm(object):
                                 if epkto not in subgraph_set:
                                     subgraph_set_pending2.add(epkto)
                             #now fill out the outputs list for the nodes that source this edge
-                            NZreqset = inj.edges_req_pkset_dict[sedge_pkpk]
+                            NZreqset = self._edge_req_pkset(inj, sedge_pkpk)
                             for onode in NZreqset:
                                 outputs_set.add(onode)
                     del edge_invlist[node_pk]
@@ -473,4 +587,62 @@ class MatrixBuildAlgorithm(object):
         )
 
 
+class MatrixInjectionRecorder(MatrixBuildAlgorithm):
+    """
+    Stands in for the MatrixBuildAlgorithm during the system_setup_coupling of a single element, collecting
+    its injections without registering them.
+    """
+
+    def __init__(self, matrix_algorithm):
+        self.system     = matrix_algorithm.system
+        self.port_cplgs = matrix_algorithm.port_cplgs
+        self.injections = []
+
+    def injection_insert(self, inj_obj):
+        self.injections.append(inj_obj)
+        return
+
+
+def injlist_index(injlist, inj):
+    for idx, inj_other in enumerate(injlist):
+        if inj_other is inj:
+            return idx
+    raise RuntimeError("Injection missing from the coupling lists")
+
+
+def injection_structure_equal(inj1, inj2):
+    """
+    Whether two injections couple the same nodes with the same requirements, so that one may replace the
+    other without redoing the sparsity analysis.
+    """
+    if type(inj1) is not type(inj2):
+        return False
+    if inj1.edges_NZ_pkset_dict != inj2.edges_NZ_pkset_dict:
+        return False
+    if inj1.sources_NZ_pkset_dict != inj2.sources_NZ_pkset_dict:
+        return False
+    if inj1.edges_req_pkset_dict != inj2.edges_req_pkset_dict:
+        return False
+    if inj1.edges_newton_pkset_dict != inj2.edges_newton_pkset_dict:
+        return False
+    if inj1.sources_req_pkset_dict != inj2.sources_req_pkset_dict:
+        return False
+    if inj1.floating_req_set != inj2.floating_req_set:
+        return False
+    if (inj1.floating_in_out_func_pairs is None) != (inj2.floating_in_out_func_pairs is None):
+        return False
+    if inj1.floating_in_out_func_pairs is not None:
+        if len(inj1.floating_in_out_func_pairs) != len(inj2.floating_in_out_func_pairs):
+            return False
+        for (ins1, outs1, func1), (ins2, outs2, func2) in zip(
+            inj1.floating_in_out_func_pairs,
+            inj2.floating_in_out_func_pairs,
+        ):
+            if set(ins1) != set(ins2) or set(outs1) != set(outs2):
+                return False
+    if set(inj1.AC_ins_pk) != set(inj2.AC_ins_pk) or set(inj1.AC_outs_pk) != set(inj2.AC_outs_pk):
+        return False
+    return True
+
+
 
@@ -5,6 +5,34 @@ from __future__ import division, print_function, unicode_literals
 #from builtins import object
 
 
+def product_newton_terms(pkto, cplg, pksrc_list, svals, N_source):
+    """
+    Newton corrections of cplg * prod(svals) injected at pkto, which the iteration holds fixed. Adds the
+    derivative edge from each pksrc, and N_source times the full product to the source.
+    """
+    edges = dict()
+    for idx, pksrc in enumerate(pksrc_list):
+        val = cplg
+        for jdx, sval in enumerate(svals):
+            if jdx != idx:
+                val = val * sval
+        pkpk = (pksrc, pkto)
+        prev = edges.get(pkpk, None)
+        edges[pkpk] = val if prev is None else prev + val
+    val = N_source * cplg
+    for sval in svals:
+        val = val * sval
+    return edges, {pkto : val}
+
+
+def square_newton_terms(pkfrom, pkto, edge, sol_vector):
+    """
+    Newton corrections of a triplet with identical sources, the iteration holds edge * x, and the
+    Jacobian is 2 * edge
+    """
+    return {(pkfrom, pkto) : edge}, {pkto : -edge * sol_vector.get(pkfrom, 0)}
+
+
 class FactorCouplingBase(object):
     __slots__ = ()
 
@@ -18,6 +46,9 @@ class FactorCouplingBase(object):
     def edges_req_pkset_dict(self):
         return self.edges_NZ_pkset_dict
 
+    #for the Newton mode, the nodes that newton_terms also reads from the solution vector, by edge
+    edges_newton_pkset_dict = {}
+
     #this is a dictionary from pksrc into a func(sol_vector, sB) that returns the new edge coupling
     sources_pk_dict = {}
     sources_NZ_pkset_dict = {}
@@ -40,6 +71,11 @@ class FactorCouplingBase(object):
     AC_ins_pk  = ()
     AC_outs_pk = ()
 
+    #for the Newton mode of the solver. A func(sol_vector, sB) returning the corrections (edge_map, source_map)
+    #that complete the linearization of the edge and source funcs into their Jacobian at sol_vector.
+    #None if the funcs are already linear in the solution vector
+    newton_terms = None
+
 
 class ConstantEdgeCoupling(FactorCouplingBase):
     __slots__ = (
@@ -97,6 +133,7 @@ class MultiplicativeEdgeCoupling(FactorCouplingBase):
         'pksrc_list',
         'edges_pkpk_dict',
         'edges_NZ_pkset_dict',
+        'edges_newton_pkset_dict',
     )
 
     def __init__(self, pkfrom, pkto, cplg, pksrc_list):
@@ -111,6 +148,10 @@ class MultiplicativeEdgeCoupling(FactorCouplingBase):
         self.edges_NZ_pkset_dict = {
             (self.pkfrom, self.pkto) : frozenset(pksrc_list),
         }
+        #the derivatives of newton_terms along the factors also need pkfrom
+        self.edges_newton_pkset_dict = {
+            (self.pkfrom, self.pkto) : frozenset([pkfrom]),
+        }
 
     def edge_func(self, sol_vector, sB):
         val = self.cplg
@@ -119,6 +160,16 @@ class MultiplicativeEdgeCoupling(FactorCouplingBase):
             val = val * sval
         return val
 
+    def newton_terms(self, sol_vector, sB):
+        #the product runs over pkfrom along with the factors. The edge itself already holds the
+        #derivative along pkfrom with the factors fixed, so it is taken out of the full derivative
+        pkfactors = (self.pkfrom,) + tuple(self.pksrc_list)
+        svals = [sol_vector.get(pksrc, 0) for pksrc in pkfactors]
+        edges, sources = product_newton_terms(self.pkto, self.cplg, pkfactors, svals, -len(self.pksrc_list))
+        pkpk = (self.pkfrom, self.pkto)
+        edges[pkpk] = edges[pkpk] - self.edge_func(sol_vector, sB)
+        return edges, sources
+
 
 class MultiplicativeSourceCoupling(FactorCouplingBase):
     __slots__ = (
@@ -148,6 +199,10 @@ class MultiplicativeSourceCoupling(FactorCouplingBase):
             val = val * sval
         return val
 
+    def newton_terms(self, sol_vector, sB):
+        svals = [sol_vector.get(pksrc, 0) for pksrc in self.pksrc_list]
+        return product_newton_terms(self.pksrc, self.cplg, self.pksrc_list, svals, -len(svals))
+
 
 class TripletCoupling(FactorCouplingBase):
     __slots__ = (
@@ -204,6 +259,12 @@ class TripletCoupling(FactorCouplingBase):
         val = self.cplg * sol_vector.get(self.pkfrom2, 0)
         return val
 
+    def newton_terms(self, sol_vector, sB):
+        if self.pkfrom1 != self.pkfrom2:
+            #the edges and source already form the Jacobian
+            return None
+        return square_newton_terms(self.pkfrom1, self.pkto, self.edge1_func(sol_vector, sB), sol_vector)
+
     def edge2_func(self, sol_vector, sB):
         val = self.cplg * sol_vector.get(self.pkfrom1, 0)
         return val
@@ -290,6 +351,12 @@ class TripletNormCoupling(FactorCouplingBase):
         val = self.cplg * sol_vector.get(self.pkfrom2, 0) / self.pknorm_func(sol_vector.get(self.pknorm, 1e12))
         return val
 
+    def newton_terms(self, sol_vector, sB):
+        #the dependence on the norm is left to the iteration
+        if self.pkfrom1 != self.pkfrom2:
+            return None
+        return square_newton_terms(self.pkfrom1, self.pkto, self.edge1_func(sol_vector, sB), sol_vector)
+
     def edge2_func(self, sol_vector, sB):
         val = self.cplg * sol_vector.get(self.pkfrom1, 0) / self.pknorm_func(sol_vector.get(self.pknorm, 1e12))
         return val
@@ -380,6 +447,12 @@ class TripletNormsCoupling(FactorCouplingBase):
         val = self.cplg * sol_vector.get(self.pkfrom2, 0) / self.pknorms_func(*sols)
         return val
 
+    def newton_terms(self, sol_vector, sB):
+        #the dependence on the norms is left to the iteration
+        if self.pkfrom1 != self.pkfrom2:
+            return None
+        return square_newton_terms(self.pkfrom1, self.pkto, self.edge1_func(sol_vector, sB), sol_vector)
+
     def edge2_func(self, sol_vector, sB):
         sols = [sol_vector.get(pknorm, 1e12) for pknorm in self.pknorms]
         val = self.cplg * sol_vector.get(self.pkfrom1, 0) / self.pknorms_func(*sols)
@@ -5,6 +5,7 @@ from __future__ import division, print_function, unicode_literals
 from ..utilities.future_from_2 import object
 
 from collections import defaultdict
+from timeit import default_timer
 import declarative
 
 from ..base import (
@@ -12,6 +13,7 @@ from ..base import (
 )
 
 from ..base import ports
+from . import topology_cache
 
 
 class PortUpdatesAlgorithm(object):
@@ -46,9 +48,50 @@ class PortUpdatesAlgorithm(object):
                 #print((owner, port))
                 self.port_cplgs_update.setdefault((owner, port), set())
 
-        self._setup_port_needs()
+        self.port_groups = self._port_groups_generate()
+        #(group, key) pairs already dispersed over their group, repeated requests for them are no-ops
+        self.group_keys = set()
+
+        self.setup_stats = declarative.Bunch(
+            N_iterations        = 0,
+            N_requests          = 0,
+            N_requests_new      = 0,
+            time_by_class       = defaultdict(float),
+            iterations_by_class = defaultdict(int),
+            cache               = None,
+        )
+        self.topology_cache = None
+        cache_path = getattr(system, 'topology_cache_path', None)
+        if cache_path is None:
+            self._setup_port_needs()
+        else:
+            self._setup_port_needs_cached(cache_path)
+
+    def _port_groups_generate(self):
+        """
+        Maps every bonded port to the tuple of ports connected to it through bonds (in either
+        direction), including itself. Keys requested at a port are completed over its whole group.
+        """
+        port_groups = dict()
+        for port in list(self.system.bond_pairs.keys()) + list(self.bond_pairsR.keys()):
+            if port in port_groups:
+                continue
+            group = set()
+            to_extend = [port]
+            while to_extend:
+                pnext = to_extend.pop()
+                if pnext in group:
+                    continue
+                group.add(pnext)
+                to_extend.extend(self.system.bond_pairs.get(pnext, ()))
+                to_extend.extend(self.bond_pairsR.get(pnext, ()))
+            group = tuple(group)
+            for pgroup in group:
+                port_groups[pgroup] = group
+        return port_groups
 
     def _setup_port_needs(self):
+        stats = self.setup_stats
         for el in self.system.elements:
             try:
                 sspi = el.system_setup_ports_initial
@@ -65,10 +108,62 @@ class PortUpdatesAlgorithm(object):
             except AttributeError:
                 pass
             else:
+                time_start = default_timer()
                 self._current_element = el
                 ssp(self)
                 self.resolve_port_updates()
+                clsname = el.__class__.__name__
+                stats.time_by_class[clsname] += default_timer() - time_start
+                stats.iterations_by_class[clsname] += 1
+                stats.N_iterations += 1
+
+        N_keys = [len(kset) for kset in self.port_cplgs.values()]
+        stats.N_ports = len(N_keys)
+        stats.keys_per_port_mean = sum(N_keys) / max(len(N_keys), 1)
+        stats.keys_per_port_max  = max(N_keys) if N_keys else 0
+        stats.time_by_class = dict(stats.time_by_class)
+        stats.iterations_by_class = dict(stats.iterations_by_class)
+        return
+
+    def _setup_port_needs_cached(self, cache_path):
+        """
+        _setup_port_needs through the on-disk cache of topology_cache. The cache is kept in topology_cache
+        for the later stages, None if the system can't be cached.
+        """
+        shash = topology_cache.structure_hash(self.system)
+        cache = topology_cache.TopologyCache(self.system, cache_path, shash)
+        try:
+            loaded = cache.load() and topology_cache.port_needs_load(self, cache)
+        except topology_cache.TopologyCacheMiss:
+            loaded = False
+        if loaded:
+            self.setup_stats.cache = 'hit'
+            self.topology_cache = cache
+            return
+        self.setup_stats.cache = 'miss'
+        self._setup_port_needs()
+        #the file is written fresh, dropping the stages of the previous one
+        cache = topology_cache.TopologyCache(self.system, cache_path, shash)
+        try:
+            topology_cache.port_needs_save(self, cache)
+        except topology_cache.TopologyCacheMiss:
+            self.setup_stats.cache = 'uncacheable'
+        else:
+            self.topology_cache = cache
+        return
 
+    def setup_stats_print(self):
+        stats = self.setup_stats
+        print("Port setup: {0} element updates, {1} key requests ({2} new)".format(
+            stats.N_iterations, stats.N_requests, stats.N_requests_new,
+        ))
+        print("Keys per port: {0:.1f} mean, {1} max over {2} ports".format(
+            stats.keys_per_port_mean, stats.keys_per_port_max, stats.N_ports,
+        ))
+        for clsname, time_s in sorted(stats.time_by_class.items(), key = lambda item: -item[1]):
+            print("    {0: <30} {1: >6} updates {2:.3f}s".format(
+                clsname, stats.iterations_by_class[clsname], time_s,
+            ))
         return
 
     def resolve_port_updates(self):
@@ -96,6 +191,14 @@ class PortUpdatesAlgorithm(object):
     def port_coupling_needed(self, pto, kto):
         self.coherent_sources_needed(pto, kto)
 
+    def port_couplings_needed(self, pto, kto_iter):
+        """
+        port_coupling_needed for each key of kto_iter
+        """
+        for kto in kto_iter:
+            self.coherent_sources_needed(pto, kto)
+        return
+
     def prev_solution_needed(self, pto, kto):
         self.coherent_sources_needed(pto, kto)
 
@@ -138,26 +241,22 @@ class PortUpdatesAlgorithm(object):
         #print('needed port: ', pto, kto)
         #assert(isinstance(pto, DictKey))
         assert(isinstance(kto, DictKey))
-        self._coherent_sources_needed(pto, kto)
-        #TODO: make this dispersal occur during resolve_port_updates
+        self.setup_stats.N_requests += 1
+        group = self.port_groups.get(pto, None)
+        if group is None:
+            #unbonded port
+            self._coherent_sources_needed(pto, kto)
+            return
 
-        to_extend = set([pto])
-        already_extended = set()
+        #TODO: make this dispersal occur during resolve_port_updates
+        #once dispersed, the key is present or pending at every port of the group
+        if (group, kto) in self.group_keys:
+            return
+        self.group_keys.add((group, kto))
+        self.setup_stats.N_requests_new += 1
 
         #performs a transitive completion keys at every port that is logically connected
-        while to_extend:
-            pto_next = to_extend.pop()
-            if pto_next in already_extended:
-                continue
-            already_extended.add(pto_next)
-
-            ptolink_dict = self.system.bond_pairs.get(pto_next, declarative.NOARG)
-            if ptolink_dict is not declarative.NOARG:
-                to_extend.update(ptolink_dict.keys())
-            ptolink_set = self.bond_pairsR.get(pto_next, declarative.NOARG)
-            if ptolink_set is not declarative.NOARG:
-                to_extend.update(ptolink_set)
-
+        for pto_next in group:
             self._coherent_sources_needed(pto_next, kto)
         return
 
@@ -23,6 +23,8 @@ from ..math.key_matrix import (
 )
 
 from ..matrix.solvers_registry import solvers_all
+from .compiled_graph import solution_pack
+from . import topology_cache
 
 
 def setdict_copy(orig):
@@ -34,6 +36,8 @@ def setdict_copy(orig):
 
 class SystemSolver(object):
     field_space_proto = KVSpace('ports', dtype=np.complex128)
+    #the special sets span the whole graph, so they are solved on their own
+    coupling_sets_private = frozenset(['all', 'perturbative'])
     #TODO, ps_In loath how the iterative state is stored for this object, clean it up...
 
     #TODO make this take ctree
@@ -76,20 +80,20 @@ class SystemSolver(object):
             self.check_zero = check_zero_safe
             #self.check_zero = dmath.zero_check_heuristic
 
-        #each index stores a dict, indexed by the output set
-        self.driven_solution_bunches = [
-            dict(
-                perturbative = declarative.Bunch(
-                    solution    = dict(),
-                    source      = dict(),
-                    delta_v     = float('inf'),
-                    AC_solution = None,
-                    AC_seq      = None,
-                    AC_req      = None,
-                )
-            )
-        ]
-        self.coupling_solution_bunches = defaultdict(dict)
+        #solvers able to keep their structural work between solves of the same graph
+        prepare = self.solver.get('prepare', None)
+        if prepare is not None:
+            self.solver_prepared = prepare()
+        else:
+            self.solver_prepared = None
+
+        #the orderings of the prepared structures are kept in the topology cache
+        self.topology_cache = ports_algorithm.topology_cache
+        if self.solver_prepared is None:
+            self.topology_cache = None
+
+        self._solution_bunches_init()
+        self.coupling_shared = getattr(self.system, 'coupling_solution_shared', True)
 
         self.drive_pk_sets      = setdict_copy(ports_algorithm.drive_pk_sets)
         self.readout_pk_sets    = setdict_copy(ports_algorithm.readout_pk_sets)
@@ -117,6 +121,58 @@ class SystemSolver(object):
         self.warning_N   = self.system.warning_N
         self.max_epsilon = max_epsilon
 
+        self.nonlinear_solver = getattr(self.system, 'nonlinear_solver', 'fixed_point')
+        #number of previous orders mixed into each Anderson extrapolation, 0 to disable
+        self.anderson_depth = getattr(self.system, 'anderson_depth', 0)
+        if self.nonlinear_solver not in ('fixed_point', 'newton'):
+            raise RuntimeError("Unknown nonlinear_solver: {0}".format(self.nonlinear_solver))
+
+        self._setup_views()
+
+        if self.topology_cache is not None:
+            self.solver_prepared.seeds.update(topology_cache.orderings_load(self, self.topology_cache))
+        return
+
+    def _solution_bunches_init(self):
+        #each index stores a dict, indexed by the output set
+        self.driven_solution_bunches = [
+            dict(
+                perturbative = declarative.Bunch(
+                    solution    = dict(),
+                    source      = dict(),
+                    delta_v     = float('inf'),
+                    AC_solution = None,
+                    AC_seq      = None,
+                    AC_req      = None,
+                )
+            )
+        ]
+        self.coupling_solution_bunches = defaultdict(dict)
+        #solutions for the union of the drive and readout sets, by order
+        self.coupling_shared_bunches = dict()
+        #(N, shape, g, f) of the previous orders, for the Anderson extrapolation
+        self._anderson_history = []
+        return
+
+    def solution_reset(self):
+        """
+        Drops the solutions, keeping the graph analysis and the prepared solver structures, so that the
+        next request solves again with the current couplings.
+        """
+        self._solution_bunches_init()
+        #the views memoize their results, so they are generated again
+        self.views.clear()
+        self._setup_views()
+        return
+
+    def coupling_solution_reset(self):
+        """
+        Drops the coupling solutions, keeping the driven solutions (the operating point), the graph analysis
+        and the prepared solver structures. For changes of the couplings that leave the operating point be.
+        """
+        self.coupling_solution_bunches = defaultdict(dict)
+        self.coupling_shared_bunches = dict()
+        self.views.clear()
         self._setup_views()
         return
 
@@ -126,6 +182,20 @@ class SystemSolver(object):
             raise RuntimeError("Must provide a symbolic fiducial substitution function to ctree.hints.symbolic_fiducial_substitute")
         return subs(expr)
 
+    def symbolic_subs_map(self, expr_map):
+        """
+        symbolic_subs over the values of expr_map, returning a dict of the substituted values. Uses the
+        batched ctree.hints.symbolic_fiducial_substitute_batch when provided.
+        """
+        if not expr_map:
+            return dict()
+        subs_batch = self.system.ctree.hints.symbolic_fiducial_substitute_batch
+        if not subs_batch:
+            return dict((key, self.symbolic_subs(expr)) for key, expr in expr_map.items())
+        keys = list(expr_map.keys())
+        values = subs_batch([expr_map[key] for key in keys])
+        return dict(zip(keys, values))
+
     @declarative.mproperty
     def views(self):
         return declarative.DeepBunch(vpath = False)
@@ -189,8 +259,17 @@ class SystemSolver(object):
             else:
                 source_vector_sym[pkto] = val
 
-        for pkto, edge in source_vector_sym.items():
-            source_vector[pkto] = self.symbolic_subs(edge)
+        if self.nonlinear_solver == 'newton':
+            newton_edge_map, newton_source_map = self._newton_terms(solution_vector_prev, solution_bunch_prev)
+            for pkto, val in newton_source_map.items():
+                if dmath.check_symbolic_type(val) or pkto in source_vector_sym:
+                    val = val + source_vector_sym.get(pkto, 0) + source_vector.get(pkto, 0)
+                    source_vector_sym[pkto] = val
+                elif not np.all(val == 0):
+                    source_vector[pkto] = val + source_vector.get(pkto, 0)
+
+        for pkto, edge in self.symbolic_subs_map(source_vector_sym).items():
+            source_vector[pkto] = edge
 
         #TODO LOGIC on source vector should check for zeros and include that data in graph purge
         #TODO return source_vector_sym too
@@ -201,74 +280,54 @@ class SystemSolver(object):
 
     def _edge_matrix_generate(
         self,
-        seq,
-        req,
+        graph,
         solution_vector_prev,
         solution_bunch_prev,
     ):
+        """
+        Fills the edge values of the compiled coupling graph. Returns fresh seq and req containers
+        holding only the nonzero edges, the numeric and symbolic edge maps, and a hashable key of the
+        resulting sparsity structure.
+        """
         malgo                = self.matrix_algorithm
-        field_space          = self.matrix_algorithm.field_space
-        coupling_matrix      = KeyMatrix(field_space, field_space)
-        coupling_matrix_sym  = KeyMatrix(field_space, field_space)
+        edge_map             = dict()
+        edge_map_sym         = dict()
 
-        drop_list = []
+        keep = graph.keep_all()
         #generate only the edges needed
-        for pkfrom, seq_set in seq.items():
-            for pkto in seq_set:
-                try:
-                    factor_func_list = malgo.coupling_matrix_inj_funclist[pkfrom, pkto]
-                except KeyError:
-                    #if it's not in the injection funclist then it must be a bond
-                    #TODO: assert that bond are not stacked with the funclist
-                    pfrom, kfrom = pkfrom
-                    pto, kto     = pkto
-                    assert(kto == kfrom)
-                    #pkey = kto
-                    #assert(pkey in malgo.port_set_get(pto))
-                    #assert(pto in self.system.bond_pairs[pfrom])
-                    assert(pkto in malgo.bonds_trivial[pkfrom])
-                    coupling_matrix[pkfrom, pkto] = 1
+        for idx_edge, factor_func_list in enumerate(graph.edge_funcs):
+            pkpk = graph.edge_keys[idx_edge]
+            if factor_func_list is None:
+                #trivial bond
+                edge_map[pkpk] = 1
+                continue
+            if not factor_func_list:
+                #TODO prevent filling if zeros?
+                keep[idx_edge] = False
+                continue
+            factor_func = factor_func_list[0]
+            val = factor_func(
+                solution_vector_prev,
+                solution_bunch_prev
+            )
+            for factor_func in factor_func_list[1:]:
+                val = val + factor_func(
+                    solution_vector_prev,
+                    solution_bunch_prev
+                )
+            #TODO decide between check_zero and check_symbolic_type
+            if not dmath.check_symbolic_type(val):
+                if not np.all(val == 0):
+                    edge_map[pkpk] = val
                 else:
-                    assert(pkto not in malgo.bonds_trivial[pkfrom])
-                    #pfrom, kfrom = pkfrom
-                    #pto, kto     = pkto
-                    #assert(pto not in self.system.bond_pairs[pfrom])
-                    if not factor_func_list:
-                        #TODO prevent filling if zeros?
-                        continue
-                    factor_func = factor_func_list[0]
-                    val = factor_func(
-                        solution_vector_prev,
-                        solution_bunch_prev
-                    )
-                    for factor_func in factor_func_list[1:]:
-                        val = val + factor_func(
-                            solution_vector_prev,
-                            solution_bunch_prev
-                        )
-                        #print('multi-edge: ', pkto, factor_func)
-                    #TODO decide between check_zero and check_symbolic_type
-                    #if not self.check_zero(val):
-                    #    coupling_matrix[pkfrom, pkto] = val
-                    #else:
-                    #    drop_list.append((pkfrom, pkto))
-                    if not dmath.check_symbolic_type(val):
-                        if not np.all(val == 0):
-                            coupling_matrix[pkfrom, pkto] = val
-                        else:
-                            drop_list.append((pkfrom, pkto))
-                    else:
-                        coupling_matrix_sym[pkfrom, pkto] = val
-        #print("DROPPED: ", len(drop_list), " TO: ", len(seq))
-        #print("SPARSITY (linear): ",
-        #      len(coupling_matrix) / len(seq),
-        #      len(coupling_matrix),
-        #      sum((len(s) for s in seq.values())))
-        for k1, k2 in drop_list:
-            seq[k1].remove(k2)
-            req[k2].remove(k1)
+                    keep[idx_edge] = False
+            else:
+                edge_map_sym[pkpk] = val
+
+        seq, req = graph.seqreq_generate(keep)
 
         N_sub_drop = 0
+        floating_edges = []
         #now generate the floating edge couplings
         #must happen after the other edge generation since the linkages are otherwise
         #missing (to be filled in here) from req and seq
@@ -282,38 +341,127 @@ class SystemSolver(object):
                     assert(pkf in ins)
                     assert(pkt in outs)
                     #TODO check between check_symbolic_type and check_zero
-                    #if not self.check_zero(edge):
-                    #    coupling_matrix[pkf, pkt] = edge
-                    #    seq[pkf].add(pkt)
-                    #    req[pkt].add(pkf)
-                    #else:
-                    #    N_sub_drop += 1
                     if not dmath.check_symbolic_type(edge):
                         if not np.all(edge == 0):
-                            coupling_matrix[pkf, pkt] = edge
+                            edge_map[pkf, pkt] = edge
                             seq[pkf].add(pkt)
                             req[pkt].add(pkf)
+                            floating_edges.append((pkf, pkt))
                         else:
                             N_sub_drop += 1
                     else:
-                        coupling_matrix_sym[pkfrom, pkto] = edge
+                        edge_map_sym[pkf, pkt] = edge
                         seq[pkf].add(pkt)
                         req[pkt].add(pkf)
 
-        #print("DROPPED", N_sub_drop, " MORE")
-
-        #print("DONE DROPPED: ", len(drop_list), " TO: ", len(seq))
-        #print("DONE SPARSITY (linear): ",
-        #      len(coupling_matrix) / len(seq),
-        #      len(coupling_matrix),
-        #      sum((len(s) for s in seq.values())))
-
-        for pktf, edge in coupling_matrix_sym.items():
-            coupling_matrix[pktf] = self.symbolic_subs(edge)
-            #print("SYM: ", pktf, edge)
+        if self.nonlinear_solver == 'newton':
+            newton_edge_map, newton_source_map = self._newton_terms(solution_vector_prev, solution_bunch_prev)
+            for (pkf, pkt), edge in newton_edge_map.items():
+                if dmath.check_symbolic_type(edge) or (pkf, pkt) in edge_map_sym:
+                    edge_map_sym[pkf, pkt] = edge + edge_map_sym.get((pkf, pkt), 0) + edge_map.pop((pkf, pkt), 0)
+                elif not np.all(edge == 0):
+                    edge_map[pkf, pkt] = edge + edge_map.get((pkf, pkt), 0)
+                else:
+                    continue
+                if pkt not in seq[pkf]:
+                    seq[pkf].add(pkt)
+                    req[pkt].add(pkf)
+                    floating_edges.append((pkf, pkt))
+
+        edge_map.update(self.symbolic_subs_map(edge_map_sym))
+
+        structure_key = (
+            graph,
+            keep.tobytes(),
+            frozenset(floating_edges),
+            frozenset(edge_map_sym.keys()),
+        )
+        return seq, req, edge_map, edge_map_sym, structure_key
+
+    def _newton_terms(self, solution_vector_prev, solution_bunch_prev):
+        """
+        The corrections (edge_map, source_map) turning the linearization of the nonlinear injections into
+        their Jacobian at solution_vector_prev. Memoized in solution_bunch_prev, as the edges and sources
+        of an order are generated separately.
+        """
+        terms = solution_bunch_prev.get('newton_terms', None)
+        if terms is not None:
+            return terms
+        newton_edge_map = dict()
+        newton_source_map = dict()
+        for inj in self.matrix_algorithm.newton_injlist:
+            terms = inj.newton_terms(solution_vector_prev, solution_bunch_prev)
+            if terms is None:
+                continue
+            edges, sources = terms
+            for pkpk, edge in edges.items():
+                prev = newton_edge_map.get(pkpk, None)
+                newton_edge_map[pkpk] = edge if prev is None else prev + edge
+            for pks, val in sources.items():
+                prev = newton_source_map.get(pks, None)
+                newton_source_map[pks] = val if prev is None else prev + val
+        terms = (newton_edge_map, newton_source_map)
+        solution_bunch_prev['newton_terms'] = terms
+        return terms
+
+    def _anderson_mix(self, N, packed_in, packed_out):
+        """
+        Anderson extrapolation of the next iterate from the inputs and outputs of the last orders, as a
+        KeyVector. The mixing coefficients are real, so that the fields of conjugate keys stay conjugate.
+        Returns None to keep the plain iterate, restarting the history when the extrapolation is ill
+        conditioned or the residual grows.
+        """
+        history = self._anderson_history
+        shape = np.broadcast(np.empty(packed_in.shape), np.empty(packed_out.shape)).shape
+        if history and (history[-1][0] != N - 1 or history[-1][1] != shape):
+            del history[:]
+        present = packed_in.present | packed_out.present
+        x = np.ascontiguousarray(packed_in.broadcast(shape)).view(np.float64).reshape(-1)
+        g = np.ascontiguousarray(packed_out.broadcast(shape)).view(np.float64).reshape(-1)
+        f = g - x
+        history.append((N, shape, g, f))
+        del history[:-(self.anderson_depth + 1)]
+        if len(history) < 2:
+            return None
+
+        f_norm = np.linalg.norm(f)
+        if f_norm > 2 * np.linalg.norm(history[-2][3]):
+            #diverging, restart from the plain iterate
+            del history[:-1]
+            return None
+        dF = np.column_stack([history[idx + 1][3] - history[idx][3] for idx in range(len(history) - 1)])
+        dG = np.column_stack([history[idx + 1][2] - history[idx][2] for idx in range(len(history) - 1)])
+        gamma = np.linalg.lstsq(dF, f, rcond = 1e-10)[0]
+        if not np.all(np.isfinite(gamma)) or np.max(abs(gamma)) > 1e3:
+            del history[:-1]
+            return None
+        x_next = (g - dG.dot(gamma)).view(np.complex128).reshape(len(present), -1)
 
-        #TODO return coupling_matrix_sym too
-        return coupling_matrix, coupling_matrix_sym
+        field_space = self.matrix_algorithm.field_space
+        solution = KeyVector(field_space)
+        for idx in np.nonzero(present)[0]:
+            solution[field_space.idx_map(idx)] = x_next[idx].reshape(shape)
+        return solution
+
+    def solve_history(self):
+        """
+        The convergence of the perturbative orders solved so far, delta_v holds the largest relative change
+        of the solution at each order
+        """
+        delta_v = []
+        accelerated = []
+        for bdict in self.driven_solution_bunches[1:]:
+            sbunch = bdict.get('perturbative', None)
+            if sbunch is None:
+                break
+            delta_v.append(sbunch.delta_v)
+            accelerated.append(sbunch.accelerated)
+        return declarative.Bunch(
+            nonlinear_solver = self.nonlinear_solver,
+            N_iterations     = len(delta_v),
+            delta_v          = np.asarray(delta_v),
+            accelerated      = np.asarray(accelerated, dtype = bool),
+        )
 
     def _perturbation_iterate(self, N):
         #print("PERTURB: ", N)
@@ -333,15 +481,12 @@ class SystemSolver(object):
         csgb = malgo.coherent_subgraph_bunch
         #TODO, fix the perturb version
         if (not self.matrix_algorithm.AC_out_all) and (not self.matrix_algorithm.AC_in_all):
-            seq = setdict_copy(csgb.seq_perturb)
-            req = setdict_copy(csgb.req_perturb)
+            graph = csgb.compiled_perturb
         else:
-            seq = setdict_copy(csgb.seq_full)
-            req = setdict_copy(csgb.req_full)
+            graph = csgb.compiled_full
 
-        coupling_matrix, coupling_matrix_sym = self._edge_matrix_generate(
-            seq = seq,
-            req = req,
+        seq, req, edge_map, edge_map_sym, structure_key = self._edge_matrix_generate(
+            graph                = graph,
             solution_vector_prev = solution_vector_prev,
             solution_bunch_prev  = solution_bunch_prev,
         )
@@ -356,20 +501,28 @@ class SystemSolver(object):
         kwargs = dict()
         if source_vector_sym:
             kwargs['inputs_map_sym'] = source_vector_sym
-        if coupling_matrix_sym:
-            kwargs['edge_map_sym'] = dict(coupling_matrix_sym)
+        if edge_map_sym:
+            kwargs['edge_map_sym'] = dict(edge_map_sym)
+
+        if self.solver_prepared is not None:
+            #the structure repeats between the perturbative orders, so the purge and
+            #symbolic analysis are reused by the prepared solver
+            inverse_solve_inplace = self.solver_prepared.inverse_solve_inplace
+            kwargs['structure_key'] = structure_key + (frozenset(source_vector.keys()),)
+        else:
+            inverse_solve_inplace = self.solver.inverse_solve_inplace
 
         #TODO purging should no longer be necessary
         #print("PERTURBER RUNNING: ")
         #print("COUPLING_SIZE: ", len(coupling_matrix))
         #TODO TODO TODO Pre-purge the seq/req list to prevent unnecessary edge-matrix generation
         #this is somewhat done already since there are purged versions
-        solution_bunch = self.solver.inverse_solve_inplace(
+        solution_bunch = inverse_solve_inplace(
             seq            = seq,
             req            = req,
             outputs_set    = outputs_set.union(self.matrix_algorithm.AC_out_all),
             inputs_map     = source_vector,
-            edge_map       = dict(coupling_matrix.items()),
+            edge_map       = edge_map,
             inputs_set     = self.matrix_algorithm.AC_in_all,
             purge_in       = True,
             purge_out      = True,
@@ -382,18 +535,35 @@ class SystemSolver(object):
         for node, val in solution_dict.items():
             solution_vector_kv[node] = val
 
+        solution_packed = solution_pack(field_space, solution_vector_kv)
         delta_v, k_worst = self.delta_v_compute(
             solution_vector_prev,
             solution_vector_kv,
+            solution_packed_prev = solution_bunch_prev.get('solution_packed', None),
+            solution_packed      = solution_packed,
         )
+        accelerated = False
+        if self.anderson_depth and solution_packed is not None and delta_v >= self.max_epsilon:
+            solution_packed_prev = solution_bunch_prev.get('solution_packed', None)
+            if solution_packed_prev is None:
+                solution_packed_prev = solution_pack(field_space, solution_vector_prev)
+            if solution_packed_prev is not None:
+                solution_mixed = self._anderson_mix(N, solution_packed_prev, solution_packed)
+                if solution_mixed is not None:
+                    solution_vector_kv = solution_mixed
+                    solution_packed = solution_pack(field_space, solution_vector_kv)
+                    accelerated = True
+
         solution_bunch = declarative.Bunch(
-            source      = source_vector,
-            solution    = solution_vector_kv,
-            delta_v     = delta_v,
-            k_worst     = k_worst,
-            AC_solution = solution_bunch.edge_map,
-            AC_seq      = solution_bunch.seq,
-            AC_req      = solution_bunch.req,
+            source          = source_vector,
+            solution        = solution_vector_kv,
+            solution_packed = solution_packed,
+            delta_v         = delta_v,
+            k_worst         = k_worst,
+            accelerated     = accelerated,
+            AC_solution     = solution_bunch.edge_map,
+            AC_seq          = solution_bunch.seq,
+            AC_req          = solution_bunch.req,
         )
         if self.system.ctree.debug.solver.get('delta_V_max', False):
             print(
@@ -406,6 +576,54 @@ class SystemSolver(object):
         return solution_bunch
 
     def delta_v_compute(
+            self,
+            solution_vector_prev,
+            solution_vector,
+            solution_packed_prev = None,
+            solution_packed      = None,
+    ):
+        """
+        Largest relative change of the solution between orders, and the worst node with its magnitude.
+        Uses the packed solution arrays when available.
+        """
+        if solution_packed is None:
+            return self._delta_v_compute_keyed(solution_vector_prev, solution_vector)
+        if solution_packed_prev is None:
+            solution_packed_prev = solution_pack(
+                self.matrix_algorithm.field_space,
+                solution_vector_prev,
+            )
+            if solution_packed_prev is None:
+                return self._delta_v_compute_keyed(solution_vector_prev, solution_vector)
+
+        shape = np.broadcast(
+            np.empty(solution_packed.shape),
+            np.empty(solution_packed_prev.shape),
+        ).shape
+        present = np.nonzero(solution_packed.present)[0]
+        v      = solution_packed.broadcast(shape)[present]
+        v_prev = solution_packed_prev.broadcast(shape)[present]
+
+        av_maxel = np.maximum(abs(v), abs(v_prev))
+        avdiff   = abs(v - v_prev)
+        #TODO make the scaling for minimum elements aware of the scale of
+        #rounding error
+        v_nz = av_maxel > 1e-16
+        rel = np.zeros_like(avdiff)
+        np.divide(avdiff, av_maxel, out = rel, where = v_nz)
+        node_max = np.max(rel, axis = 1, initial = 0)
+        node_valid = np.any(v_nz, axis = 1)
+        if not np.any(node_valid):
+            return 0, None
+        node_max[~node_valid] = -1
+        idx_worst = np.argmax(node_max)
+        k_worst = (
+            solution_packed.field_space.idx_map(present[idx_worst]),
+            abs(v[idx_worst]).reshape(shape),
+        )
+        return node_max[idx_worst], k_worst
+
+    def _delta_v_compute_keyed(
             self,
             solution_vector_prev,
             solution_vector
@@ -472,13 +690,9 @@ class SystemSolver(object):
 
         csgb = malgo.coherent_subgraph_bunch
         #use the full edge list
-        seq = setdict_copy(csgb.seq_full)
-        req = setdict_copy(csgb.req_full)
-
         #TODO TODO TODO Pre-purge the seq/req list to prevent unnecessary edge-matrix generation
-        coupling_matrix, coupling_matrix_sym = self._edge_matrix_generate(
-            seq                  = seq,
-            req                  = req,
+        seq, req, edge_map, edge_map_sym, structure_key = self._edge_matrix_generate(
+            graph                = csgb.compiled_full,
             solution_vector_prev = solution_vector_prev,
             solution_bunch_prev  = solution_bunch_prev,
         )
@@ -491,8 +705,8 @@ class SystemSolver(object):
         kwargs = dict()
         if source_vector_sym:
             kwargs['inputs_map_sym'] = source_vector_sym
-        if coupling_matrix_sym:
-            kwargs['edge_map_sym'] = dict(coupling_matrix_sym)
+        if edge_map_sym:
+            kwargs['edge_map_sym'] = dict(edge_map_sym)
 
         #TODO purging should no longer be necessary
         #print("PROPAGAGOR RUNNING: ", readout_set)
@@ -501,7 +715,7 @@ class SystemSolver(object):
             req            = req,
             outputs_set    = outputs_set,
             inputs_map     = source_vector,
-            edge_map       = dict(coupling_matrix.items()),
+            edge_map       = edge_map,
             purge_in       = True,
             purge_out      = True,
             scattering     = True,
@@ -550,7 +764,63 @@ class SystemSolver(object):
         #print("INSET", drive_set, inputs_set)
         #print("OUTSET", readout_set, outputs_set)
 
-        #otherwise the solution must be generated, this proceeds much like the _perturbation_iterate,
+        solution_bunch = None
+        if (
+            self.coupling_shared
+            and drive_set not in self.coupling_sets_private
+            and readout_set not in self.coupling_sets_private
+        ):
+            shared_bunch = self._coupling_shared_get(N)
+            if inputs_set <= shared_bunch.inputs_set and outputs_set <= shared_bunch.outputs_set:
+                solution_bunch = self._coupling_solution_slice(shared_bunch, inputs_set, outputs_set)
+        if solution_bunch is None:
+            solution_bunch = self._coupling_solution_generate(N, inputs_set, outputs_set)
+        bdict[collection_key] = solution_bunch
+        return solution_bunch
+
+    def _coupling_shared_get(self, N):
+        """
+        Solves once per order for the union of the drive and readout sets (other than the special
+        ones spanning the whole graph). The transfer functions between any subsets are then slices of
+        this solution.
+        """
+        shared_bunch = self.coupling_shared_bunches.get(N, None)
+        if shared_bunch is not None:
+            return shared_bunch
+        #drive sets are only included when readouts use the same set name (such as the noise sources
+        #with noise readouts), so that the union isn't burdened by drives that no readout requests
+        inputs_set = set()
+        for set_name, pk_set in self.drive_pk_sets.items():
+            if set_name not in self.coupling_sets_private and self.readout_pk_sets.get(set_name, None):
+                inputs_set.update(pk_set)
+        outputs_set = set()
+        for set_name, pk_set in self.readout_pk_sets.items():
+            if set_name not in self.coupling_sets_private:
+                outputs_set.update(pk_set)
+        shared_bunch = self._coupling_solution_generate(N, inputs_set, outputs_set)
+        self.coupling_shared_bunches[N] = shared_bunch
+        return shared_bunch
+
+    def _coupling_solution_slice(self, shared_bunch, inputs_set, outputs_set):
+        coupling_matrix_inv = dict()
+        seq = defaultdict(set)
+        req = defaultdict(set)
+        for (pkfrom, pkto), edge in shared_bunch.coupling_matrix_inv.items():
+            if pkfrom in inputs_set and pkto in outputs_set:
+                coupling_matrix_inv[pkfrom, pkto] = edge
+                seq[pkfrom].add(pkto)
+                req[pkto].add(pkfrom)
+        return declarative.Bunch(
+            inputs_set          = inputs_set,
+            outputs_set         = outputs_set,
+            seq                 = seq,
+            req                 = req,
+            coupling_matrix_inv = coupling_matrix_inv,
+            coupling_matrix     = shared_bunch.coupling_matrix,
+        )
+
+    def _coupling_solution_generate(self, N, inputs_set, outputs_set):
+        #the solution must be generated, this proceeds much like the _perturbation_iterate,
         #but that one is special-cased for speed
         solution_bunch_prev = self.driven_solution_get(
             readout_set = 'perturbative',
@@ -562,36 +832,50 @@ class SystemSolver(object):
 
         csgb = malgo.coherent_subgraph_bunch
         #use the full edge list
-        seq = setdict_copy(csgb.seq_full)
-        req = setdict_copy(csgb.req_full)
-
         #TODO TODO TODO Pre-purge the seq/req list to prevent unnecessary edge-matrix generation
-        coupling_matrix, coupling_matrix_sym = self._edge_matrix_generate(
-            seq                  = seq,
-            req                  = req,
+        seq, req, edge_map, edge_map_sym, structure_key = self._edge_matrix_generate(
+            graph                = csgb.compiled_full,
             solution_vector_prev = solution_vector_prev,
             solution_bunch_prev  = solution_bunch_prev,
         )
 
         kwargs = dict()
-        if coupling_matrix_sym:
-            kwargs['edge_map_sym'] = dict(coupling_matrix_sym)
+        if edge_map_sym:
+            kwargs['edge_map_sym'] = dict(edge_map_sym)
+
+        #the solver consumes the edge map, so keep a copy for the coupling matrix views
+        coupling_matrix = KeyMatrix(
+            malgo.field_space,
+            malgo.field_space,
+            _premap = dict(edge_map),
+        )
+
+        if self.solver_prepared is not None:
+            #the readouts repeat their solve for every update of the couplings (element_update, sweep
+            #chunks, fits), so the structural work is kept with the sets solved for
+            inverse_solve_inplace = self.solver_prepared.inverse_solve_inplace
+            kwargs['structure_key'] = structure_key + (frozenset(inputs_set), frozenset(outputs_set))
+        else:
+            inverse_solve_inplace = self.solver.inverse_solve_inplace
 
         #TODO purging should no longer be necessary
         #print("SOLVER RUNNING: ", drive_set, readout_set)
-        inverse_bunch = self.solver.inverse_solve_inplace(
+        inverse_bunch = inverse_solve_inplace(
             seq           = seq,
             req           = req,
             inputs_set    = inputs_set,
             outputs_set   = outputs_set,
-            edge_map      = dict(coupling_matrix.items()),
+            edge_map      = edge_map,
             purge_in      = True,
             purge_out     = True,
             scattering    = True,
             **kwargs
         )
 
-        solution_bunch = declarative.Bunch(
+        if self.topology_cache is not None:
+            topology_cache.orderings_save(self, self.topology_cache)
+
+        return declarative.Bunch(
             inputs_set          = inputs_set,
             outputs_set         = outputs_set,
             seq                 = inverse_bunch.seq,
@@ -599,8 +883,6 @@ class SystemSolver(object):
             coupling_matrix_inv = inverse_bunch.edge_map,
             coupling_matrix     = coupling_matrix,
         )
-        bdict[collection_key] = solution_bunch
-        return solution_bunch
 
     def solve(self, order = None):
         if self.system.exact_order is not None:
@@ -633,6 +915,9 @@ class SystemSolver(object):
             if len(self.driven_solution_bunches) == to_order:
                 #append one last dictionary for this set of solutions to use the previous
                 self.driven_solution_bunches.append(dict())
+
+        if self.topology_cache is not None:
+            topology_cache.orderings_save(self, self.topology_cache)
         return
 
     def solution_vector_print(
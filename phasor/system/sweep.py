@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked AC frequency sweeps.
+
+Every edge of the coupling graph holds its value over the full F_AC grid, so the memory of a solve grows as
+n_edges x n_freq. The sweep solves over chunks of the frequency grid and streams the requested readout
+quantities into preallocated arrays (AC_sweep) or yields them chunk by chunk (AC_sweep_chunks). Peak memory is
+then bounded by the chunk size. The system is built and its DC operating point solved once, each chunk only
+evaluates the AC couplings again (see BGSystem.F_AC_update) and solves for them.
+
+The chunks are independent, so AC_sweep_parallel distributes them over a process pool.
+"""
+from __future__ import division, print_function, unicode_literals
+from ..utilities.future_from_2 import str, range
+
+import numpy as np
+import declarative
+
+
+def readout_path(readout):
+    """
+    The attribute path of a readout from its system, given the readout or its dotted name.
+    """
+    if isinstance(readout, str):
+        return tuple(readout.split('.'))
+    return tuple(readout.fully_resolved_name_tuple)
+
+
+def element_lookup(system, path):
+    obj = system
+    for name in path:
+        obj = getattr(obj, name)
+    return obj
+
+
+def AC_sweep_chunks(
+    system,
+    F_Hz,
+    readouts,
+    quantities = ('AC_sensitivity',),
+    chunk_size = 1000,
+):
+    """
+    Generator over the chunks of the frequency grid F_Hz. Yields (F_slice, results) where results maps
+    each readout's dotted name to a Bunch of the requested quantities over the chunk. The system is only
+    used as a template, regenerated once over the first chunk, so it is never solved over the full grid.
+    """
+    F_Hz = np.asarray(F_Hz)
+    slices = chunk_slices(len(F_Hz), chunk_size)
+    if not slices:
+        return
+    sweep = sweep_setup(system, F_Hz[slices[0]], readouts, quantities)
+    for F_slice in slices:
+        results = dict()
+        for name, rdict in sweep_chunk(sweep, F_Hz[F_slice]).items():
+            results[name] = declarative.Bunch(rdict)
+        yield F_slice, results
+    return
+
+
+def chunk_slices(N_F, chunk_size):
+    return [
+        slice(idx_start, min(idx_start + chunk_size, N_F))
+        for idx_start in range(0, N_F, chunk_size)
+    ]
+
+
+def sweep_setup(system, F_Hz, readouts, quantities):
+    """
+    Regenerates system over the frequencies F_Hz and solves its DC operating point, returning the Bunch of
+    the state used by sweep_chunk.
+    """
+    sys_sweep = system.regenerate(F_AC = F_Hz)
+    paths = [readout_path(r) for r in readouts]
+    sys_sweep.solution
+    return declarative.Bunch(
+        system     = sys_sweep,
+        F_Hz       = F_Hz,
+        readouts   = [('.'.join(path), element_lookup(sys_sweep, path)) for path in paths],
+        quantities = tuple(quantities),
+    )
+
+
+def sweep_chunk(sweep, F_Hz):
+    """
+    Solves the system of sweep over the frequencies F_Hz, returning a dict of the readout quantities by
+    the readout names, each a dict of arrays by quantity.
+    """
+    if not np.array_equal(F_Hz, sweep.F_Hz):
+        sweep.system.F_AC_update(F_Hz)
+        sweep.F_Hz = F_Hz
+    results = dict()
+    for name, readout in sweep.readouts:
+        #plain dicts and arrays so that the results pickle back from worker processes
+        rdict = dict()
+        for quantity in sweep.quantities:
+            rdict[quantity] = np.asarray(getattr(readout, quantity))
+        results[name] = rdict
+    return results
+
+
+def AC_sweep(
+    system,
+    F_Hz,
+    readouts,
+    quantities = ('AC_sensitivity',),
+    chunk_size = 1000,
+    out        = None,
+):
+    """
+    Runs AC_sweep_chunks, streaming the results into out (or newly allocated arrays). out maps each
+    readout's dotted name to a Bunch of arrays for the quantities, the last axis being frequency. Values
+    that don't depend on frequency are broadcast along it.
+    """
+    F_Hz = np.asarray(F_Hz)
+    chunks = AC_sweep_chunks(
+        system     = system,
+        F_Hz       = F_Hz,
+        readouts   = readouts,
+        quantities = quantities,
+        chunk_size = chunk_size,
+    )
+    return chunks_accumulate(chunks, N_F = len(F_Hz), out = out)
+
+
+def chunks_accumulate(chunks, N_F, out = None):
+    """
+    Fills the arrays of out (created as needed) from an ordered iterator of (F_slice, results).
+    """
+    if out is None:
+        out = declarative.Bunch()
+
+    for F_slice, results in chunks:
+        N_chunk = F_slice.stop - F_slice.start
+        for name, rbunch in results.items():
+            obunch = out.setdefault(name, declarative.Bunch())
+            for quantity, val in rbunch.items():
+                val = np.asarray(val)
+                if val.ndim == 0 or val.shape[-1] != N_chunk:
+                    val = val[..., np.newaxis]
+                arr = obunch.get(quantity, None)
+                if arr is None:
+                    arr = np.empty(val.shape[:-1] + (N_F,), dtype = val.dtype)
+                    obunch[quantity] = arr
+                arr[..., F_slice] = val
+    return out
+
+
+#state of a sweep worker process. Set once by the pool initializer
+_worker_state = None
+
+
+def _worker_init(sweep):
+    global _worker_state
+    _worker_state = sweep
+    return
+
+
+def _worker_chunk(task):
+    F_slice, F_chunk = task
+    return F_slice, sweep_chunk(_worker_state, F_chunk)
+
+
+def AC_sweep_parallel(
+    system,
+    F_Hz,
+    readouts,
+    quantities = ('AC_sensitivity',),
+    chunk_size = 100,
+    N_workers  = None,
+    out        = None,
+):
+    """
+    AC_sweep with the chunks distributed over a process pool. The system is built and its DC operating
+    point solved once, in this process, and the built system (with its compiled coupling graph and
+    prepared solver structures) is handed to each worker once, through the pool initializer (inherited by
+    fork, not pickled). Each task then only evaluates the AC couplings over its frequency chunk and solves,
+    sending back the readout arrays. The results are accumulated in frequency order.
+
+    N_workers defaults to the CPU count. Falls back to the serial AC_sweep when there is a single worker
+    or when processes cannot be forked.
+    """
+    import multiprocessing
+    F_Hz = np.asarray(F_Hz)
+    if N_workers is None:
+        N_workers = multiprocessing.cpu_count()
+
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except AttributeError:
+        #python 2 always forks on posix
+        ctx = multiprocessing
+    except ValueError:
+        ctx = None
+
+    N_chunks = (len(F_Hz) + chunk_size - 1) // chunk_size
+    N_workers = min(N_workers, N_chunks)
+    if ctx is None or N_workers <= 1:
+        return AC_sweep(
+            system     = system,
+            F_Hz       = F_Hz,
+            readouts   = readouts,
+            quantities = quantities,
+            chunk_size = chunk_size,
+            out        = out,
+        )
+
+    slices = chunk_slices(len(F_Hz), chunk_size)
+    sweep = sweep_setup(system, F_Hz[slices[0]], readouts, quantities)
+    tasks = [(F_slice, F_Hz[F_slice]) for F_slice in slices]
+
+    pool = ctx.Pool(
+        N_workers,
+        initializer = _worker_init,
+        initargs    = (sweep,),
+    )
+    try:
+        out = chunks_accumulate(pool.imap(_worker_chunk, tasks), N_F = len(F_Hz), out = out)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return out
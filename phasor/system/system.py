@@ -11,6 +11,7 @@ from __future__ import division, print_function, unicode_literals
 from phasor.utilities.print import print
 from collections import defaultdict
 from declarative import bunch
+from declarative.properties.memoized import MemoizedDescriptor
 
 import numpy as np
 import warnings
@@ -34,6 +35,7 @@ from . import ports_algorithm
 from . import solver_algorithm
 
 from ..base import Element, RootElement
+from ..base.simple_units import SimpleUnitfulGroup
 from ..base.ports import PostBondKey
 from ..base import ports
 from ..base import visitors as VISIT
@@ -70,6 +72,8 @@ class BGSystem(RootElement):
     max_N = 100
     warning_N = 20
     solver_Q_conditioning = True
+    #share one solve per order between the coupling solutions of the readouts
+    coupling_solution_shared = True
 
     _frozen = False
 
@@ -92,6 +96,33 @@ class BGSystem(RootElement):
     def symbolic(self, val = False):
         return val
 
+    @declarative.dproperty
+    def nonlinear_solver(self, val = 'fixed_point'):
+        """
+        Iteration for the nonlinear operating point. 'fixed_point' holds the nonlinear factors at the
+        previous order, 'newton' linearizes the injections into their Jacobian, converging quadratically.
+        """
+        val = self.ctree.setdefault('nonlinear_solver', val)
+        return val
+
+    @declarative.dproperty
+    def anderson_depth(self, val = 0):
+        """
+        Number of previous orders used by the Anderson extrapolation of the perturbative iteration,
+        0 for the plain iteration
+        """
+        val = self.ctree.setdefault('anderson_depth', val)
+        return val
+
+    @declarative.dproperty
+    def topology_cache_path(self, val = None):
+        """
+        Directory of the on-disk cache of the port, sparsity and ordering analysis (see topology_cache), None
+        to disable it
+        """
+        val = self.ctree.setdefault('topology_cache_path', val)
+        return val
+
     @declarative.dproperty
     def include_johnson_noise(self, val = True):
         val = self.ctree.setdefault('include_johnson_noise', val)
@@ -349,6 +380,129 @@ class BGSystem(RootElement):
             ports_algorithm  = self.port_algo,
             matrix_algorithm = self.matrix_algorithm,
         )
+        #attributes memoized past this point may hold solution results, see _solution_results_reset
+        self._setup_memoized = dict(
+            (el, frozenset(el.__dict__.keys())) for el in self.elements
+        )
+        return
+
+    def element_update(self, element, **kwargs):
+        """
+        Sets parameters of element, re-injects its couplings and solves the system again. This is a full
+        re-solve with the new couplings, not a low-rank update of the previous solution. It only skips the
+        rebuild of regenerate: the port and sparsity analysis are kept, only the couplings of element are
+        generated again, and both the driven solves and the coupling solves of the readouts reuse the
+        prepared structures of the solver.
+
+        The keyword arguments are set through the attribute setters, so the attributes must be declared to
+        accept replacement (as Mirror.T_hr). Unitful attributes (such as L_m) take values in their own
+        units, set on their val. Other attributes of element memoized from the replaced ones are not
+        recomputed. The update is local to this system, regenerate still builds from the original arguments.
+        Raises RuntimeError if the new couplings change the structure of the graph, in which case the system
+        must be regenerated.
+        """
+        self.solution
+
+        def attribute_set(name, val):
+            current = getattr(element, name)
+            if isinstance(current, SimpleUnitfulGroup):
+                current.val = val
+            else:
+                setattr(element, name, val)
+
+        values_prev = dict()
+        try:
+            for name, val in kwargs.items():
+                current = getattr(element, name)
+                if isinstance(current, SimpleUnitfulGroup):
+                    val_prev = current.val
+                else:
+                    val_prev = current
+                attribute_set(name, val)
+                values_prev[name] = val_prev
+            replaced = self.matrix_algorithm.element_injections_update(element)
+        except Exception:
+            for name, val_prev in values_prev.items():
+                attribute_set(name, val_prev)
+            raise
+        self._solution_results_reset()
+        self.solver.solution_reset()
+        self.solver.solve()
+        return replaced
+
+    def F_AC_update(self, F_Hz):
+        """
+        Replaces the frequencies of F_AC in place, for the chunks of sweep.AC_sweep_chunks. Only the elements
+        with couplings at the AC keys are re-injected, and only the coupling solutions are dropped, so the
+        port and sparsity analysis, the compiled coupling graph and the DC operating point are all kept. The
+        coupling solves of the new chunk reuse the structures that the solver prepared for the previous one.
+        If the driven solution doesn't vanish at the AC keys (as with AC drives), it is solved again as well.
+        """
+        self.solution
+        if self._F_AC_elements is None:
+            self._F_AC_elements, self._F_AC_driven = self._F_AC_dependence()
+        self.F_AC.F_Hz.val = F_Hz
+        for element in self._F_AC_elements:
+            self.matrix_algorithm.element_injections_update(element)
+        self._solution_results_reset()
+        if self._F_AC_driven:
+            self.solver.solution_reset()
+        else:
+            self.solver.coupling_solution_reset()
+        return
+
+    #set by F_AC_update on its first call
+    _F_AC_elements = None
+    _F_AC_driven   = None
+
+    def _F_AC_dependence(self):
+        """
+        The elements with couplings at the AC keys, and whether the driven solution holds AC keys.
+        """
+        F_AC = self.F_AC
+
+        def pk_AC(pk):
+            fkey = pk[1].get(ClassicalFreqKey, None)
+            return fkey is not None and fkey.F_dict.get(F_AC, 0) != 0
+
+        elements = []
+        for element, injlist in self.matrix_algorithm.element_injections.items():
+            for inj in injlist:
+                pks = list(inj.sources_pk_dict.keys())
+                for pkfrom, pkto in inj.edges_pkpk_dict.keys():
+                    pks.append(pkfrom)
+                    pks.append(pkto)
+                if inj.floating_in_out_func_pairs is not None:
+                    for ins, outs, func in inj.floating_in_out_func_pairs:
+                        pks.extend(ins)
+                        pks.extend(outs)
+                if any(pk_AC(pk) for pk in pks):
+                    elements.append(element)
+                    break
+
+        driven = False
+        for bdict in self.solver.driven_solution_bunches:
+            for sbunch in bdict.values():
+                for pk, val in sbunch.solution.items():
+                    if pk_AC(pk) and np.any(val != 0):
+                        driven = True
+        return elements, driven
+
+    def _solution_results_reset(self):
+        """
+        Drops the attributes that the elements memoized after the setup (such as the readout results), since
+        they may hold results of the previous solution. They are computed again on their next access.
+        """
+        for el in self.elements:
+            memoized = self._setup_memoized.get(el, None)
+            if memoized is None:
+                continue
+            el_vars = vars(el)
+            for name in list(el_vars.keys()):
+                if name in memoized or isinstance(el_vars[name], Element):
+                    continue
+                if isinstance(getattr(type(el), name, None), MemoizedDescriptor):
+                    del el_vars[name]
         return
 
     def bond_completion_raw_pair(self, pe_1, pe_2, raw_port1, raw_port2):
@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the structural analysis of a system.
+
+The fixpoint of PortUpdatesAlgorithm (the keys of every port, along with the drive and readout sets), the
+sparsity graphs of MatrixBuildAlgorithm and the elimination orderings found by the solver depend only on
+the structure of the model: the element classes, their structural options, which parameters are zero and
+the bonds. The cache stores them in a .npz file named by a hash of that structure, so that systems rebuilt
+in later processes skip that analysis. The file is filled in stages as the system is built, each stage
+rewriting it whole. The keys are stored as JSON strings, holding the element paths of their frequencies,
+and are mapped back to the objects of the new system on loading. The graph nodes and the orderings refer
+to a table of nodes, indexing the keys.
+
+Keys holding values other than strings, integers, booleans and FrequencyKeys are not cached.
+"""
+from __future__ import division, print_function, unicode_literals
+from ..utilities.future_from_2 import str
+
+import os
+import json
+import hashlib
+import tempfile
+import numbers
+import numpy as np
+from collections import defaultdict
+import declarative
+
+from ..base import (
+    DictKey,
+    FrequencyKey,
+)
+
+#bumped whenever the file layout or key encoding changes
+CACHE_VERSION = 2
+
+#the structure entries of SolverPrepared kept in the cache
+ORDERING_ENTRIES = ('elimination_tape', 'ND_order')
+
+#the forms of the graph nodes, the plain (port, key) pairs and the wrapped ones of the DAG solvers
+NODE_WRAPS = (None, 'INPUT', 'OUTPUT')
+
+
+class TopologyCacheMiss(Exception):
+    pass
+
+
+def nonzero_is(val):
+    try:
+        return bool(np.any(val != 0))
+    except Exception:
+        #symbolic values are taken as nonzero
+        return True
+
+
+def element_structure(element):
+    """
+    The structural options of an element: the booleans, integers and strings it holds. Other numbers and
+    arrays are taken as parameters, of which only being zero can affect the ports and couplings.
+    """
+    items = []
+    for name, val in element.__dict__.items():
+        if isinstance(val, (bool, int, str)):
+            items.append((name, repr(val)))
+        elif isinstance(val, (numbers.Number, np.ndarray)):
+            items.append((name, 'nonzero' if nonzero_is(val) else 'zero'))
+    items.sort()
+    return items
+
+
+def file_replace(fname_src, fname_dst):
+    try:
+        replace = os.replace
+    except AttributeError:
+        #python 2, where rename only overwrites on posix
+        try:
+            os.rename(fname_src, fname_dst)
+        except OSError:
+            if not os.path.exists(fname_dst):
+                raise
+            os.remove(fname_dst)
+            os.rename(fname_src, fname_dst)
+        return
+    replace(fname_src, fname_dst)
+    return
+
+
+def structure_hash(system):
+    """
+    Hash of the element classes, their structural options, the bonds and the system options used by the
+    port analysis
+    """
+    lines = [repr(('version', CACHE_VERSION))]
+    for option in ['exact_order', 'max_N', 'freq_order_max_default', 'include_johnson_noise', 'symbolic', 'nonlinear_solver']:
+        lines.append(repr((option, getattr(system, option))))
+    for element in system.elements:
+        lines.append(repr((
+            'element',
+            element.name_system,
+            type(element).__module__,
+            type(element).__name__,
+            element_structure(element),
+        )))
+    for port, bonded in system.bond_pairs.items():
+        lines.append(repr(('bond', str(port), sorted(str(pother) for pother in bonded))))
+    for port, owners in system.port_owners_virtual.items():
+        lines.append(repr(('virtual', str(port), sorted(owner.name_system for owner in owners))))
+    lines.sort()
+    digest = hashlib.sha1()
+    for line in lines:
+        digest.update(line.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class KeyCodec(object):
+    """
+    Encodes DictKeys as JSON strings and back, with the frequencies given by their path from the system
+    """
+    def __init__(self, system):
+        self.system = system
+        self.F_paths = dict()
+        self.F_objects = dict()
+
+    def frequency_path(self, F):
+        path = self.F_paths.get(F, None)
+        if path is None:
+            path = tuple(F.fully_resolved_name_tuple)
+            if self.frequency_lookup(path) is not F:
+                raise TopologyCacheMiss("Frequency not reachable from the system: {0}".format(F))
+            self.F_paths[F] = path
+        return path
+
+    def frequency_lookup(self, path):
+        F = self.F_objects.get(path, None)
+        if F is None:
+            F = self.system
+            try:
+                for name in path:
+                    F = getattr(F, name)
+            except AttributeError:
+                raise TopologyCacheMiss("Frequency missing: {0}".format(path))
+            self.F_objects[path] = F
+        return F
+
+    def encode(self, key):
+        if not isinstance(key, DictKey):
+            raise TopologyCacheMiss("Can't cache key {0}".format(key))
+        items = []
+        for k, v in key.items():
+            if isinstance(v, FrequencyKey):
+                code = ['F', sorted([list(self.frequency_path(F)), n] for F, n in v.F_dict.items())]
+            elif isinstance(v, bool):
+                code = ['b', v]
+            elif isinstance(v, int):
+                code = ['i', v]
+            elif isinstance(v, str):
+                code = ['s', v]
+            else:
+                raise TopologyCacheMiss("Can't cache key value {0}".format(v))
+            items.append([k, code])
+        items.sort()
+        return json.dumps(items, ensure_ascii = False)
+
+    def decode(self, kstr):
+        kdict = dict()
+        for k, (ctype, val) in json.loads(kstr):
+            if ctype == 'F':
+                kdict[k] = FrequencyKey(dict(
+                    (self.frequency_lookup(tuple(path)), n) for path, n in val
+                ))
+            elif ctype == 'b':
+                kdict[k] = bool(val)
+            else:
+                kdict[k] = val
+        return DictKey(kdict)
+
+
+def cache_fname(path, shash):
+    return os.path.join(path, 'topology_{0}.npz'.format(shash))
+
+
+class TopologyCache(object):
+    """
+    The cache file of one structure hash, holding the arrays of every stage along with the key and node
+    tables they index. The stages found in the file on loading are listed in loaded.
+    """
+    def __init__(self, system, path, shash):
+        self.codec  = KeyCodec(system)
+        self.path   = path
+        self.fname  = cache_fname(path, shash)
+        self.arrays = dict()
+        self.loaded = set()
+
+        self.kstrs  = []
+        self.kobjs  = []
+        self.kcodes = dict()
+        self.nrows  = []
+        self.ncodes = dict()
+
+    def load(self):
+        """
+        Reads the file, returns False if it is missing or was written by another version
+        """
+        if not os.path.exists(self.fname):
+            return False
+        with np.load(self.fname) as data:
+            arrays = dict((name, data[name]) for name in data.files)
+        if int(arrays['version']) != CACHE_VERSION:
+            return False
+        self.kstrs = [str(kstr) for kstr in arrays['keys']]
+        self.kobjs = [self.codec.decode(kstr) for kstr in self.kstrs]
+        self.kcodes = dict((key, idx) for idx, key in enumerate(self.kobjs))
+        self.nrows = [tuple(row) for row in arrays['nodes'].tolist()]
+        self.ncodes = dict((row, idx) for idx, row in enumerate(self.nrows))
+        self.arrays = arrays
+        return True
+
+    def save(self):
+        """
+        Writes the file under a temporary name and moves it into place, so that concurrent jobs never
+        read a partial file
+        """
+        self.arrays['version'] = np.array(CACHE_VERSION)
+        self.arrays['keys']    = np.array(self.kstrs, dtype = np.str_)
+        self.arrays['nodes']   = np.array(self.nrows, dtype = np.int64).reshape(-1, 3)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, fname_tmp = tempfile.mkstemp(dir = self.path, suffix = '.npz')
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                np.savez(fobj, **self.arrays)
+            file_replace(fname_tmp, self.fname)
+        except:
+            os.remove(fname_tmp)
+            raise
+        return
+
+    def kidx(self, key):
+        idx = self.kcodes.get(key, None)
+        if idx is None:
+            kstr = self.codec.encode(key)
+            idx = len(self.kstrs)
+            self.kstrs.append(kstr)
+            self.kobjs.append(key)
+            self.kcodes[key] = idx
+        return idx
+
+    def key(self, idx):
+        return self.kobjs[idx]
+
+    def nidx(self, node):
+        wrap = 0
+        if isinstance(node, tuple) and len(node) == 2 and isinstance(node[0], str):
+            wrap = NODE_WRAPS.index(node[0])
+            node = node[1]
+        if not isinstance(node, tuple) or len(node) != 2:
+            raise TopologyCacheMiss("Can't cache node {0}".format(node))
+        port, key = node
+        row = (wrap, self.kidx(port), self.kidx(key))
+        idx = self.ncodes.get(row, None)
+        if idx is None:
+            idx = len(self.nrows)
+            self.nrows.append(row)
+            self.ncodes[row] = idx
+        return idx
+
+    def node(self, idx):
+        wrap, pidx, kidx = self.nrows[idx]
+        node = (self.kobjs[pidx], self.kobjs[kidx])
+        if wrap:
+            node = (NODE_WRAPS[wrap], node)
+        return node
+
+
+def port_needs_save(palgo, cache):
+    """
+    Writes the port analysis of palgo, the first stage of the cache
+    """
+    ports = []
+    cplgs = []
+    for port, kset in palgo.port_cplgs.items():
+        pidx = cache.kidx(port)
+        ports.append(pidx)
+        for key in kset:
+            cplgs.append((pidx, cache.kidx(key)))
+
+    set_names = []
+    set_types = []
+    pk_sets = []
+    for idx_type, pk_sets_dict in enumerate([palgo.drive_pk_sets, palgo.readout_pk_sets]):
+        for set_name, pk_set in pk_sets_dict.items():
+            if not isinstance(set_name, str):
+                raise TopologyCacheMiss("Can't cache set name {0}".format(set_name))
+            set_names.append(set_name)
+            set_types.append(idx_type)
+            for port, key in pk_set:
+                pk_sets.append((idx_type, len(set_names) - 1, cache.kidx(port), cache.kidx(key)))
+
+    cache.arrays.update(
+        ports     = np.array(ports, dtype = np.int64),
+        cplgs     = np.array(cplgs, dtype = np.int64).reshape(-1, 2),
+        set_names = np.array(set_names, dtype = np.str_),
+        set_types = np.array(set_types, dtype = np.int64),
+        pk_sets   = np.array(pk_sets, dtype = np.int64).reshape(-1, 4),
+    )
+    cache.save()
+    return
+
+
+def port_needs_load(palgo, cache):
+    """
+    Fills palgo from the cache, returns False on a miss
+    """
+    arrays = cache.arrays
+    if 'ports' not in arrays:
+        return False
+    if set(cache.key(pidx) for pidx in arrays['ports']) != set(palgo.port_cplgs.keys()):
+        return False
+    for pidx, kidx in arrays['cplgs']:
+        palgo.port_cplgs[cache.key(pidx)].add(cache.key(kidx))
+
+    set_names = [str(set_name) for set_name in arrays['set_names']]
+    pk_sets_dicts = [palgo.drive_pk_sets, palgo.readout_pk_sets]
+    for idx_type, set_name in zip(arrays['set_types'], set_names):
+        #includes the sets without members
+        pk_sets_dicts[idx_type][set_name]
+    for idx_type, idx_name, pidx, kidx in arrays['pk_sets']:
+        pk_sets_dicts[idx_type][set_names[idx_name]].add((cache.key(pidx), cache.key(kidx)))
+    cache.loaded.add('ports')
+    return True
+
+
+def nodes_save(cache, nodes):
+    return np.array([cache.nidx(node) for node in nodes], dtype = np.int64)
+
+
+def sparsity_graph_save(csgb, cache):
+    """
+    Writes the coherent sparsity graphs of MatrixBuildAlgorithm, the second stage of the cache
+    """
+    arrays = dict(
+        graph_order   = np.array(csgb.order),
+        graph_inputs  = nodes_save(cache, csgb.inputs_set),
+        graph_outputs = nodes_save(cache, csgb.outputs_set),
+        graph_active  = nodes_save(cache, csgb.active),
+    )
+    for gname in ['full', 'perturb']:
+        seq = csgb['seq_' + gname]
+        req = csgb['req_' + gname]
+        edges = []
+        for pkfrom, seq_set in seq.items():
+            nfrom = cache.nidx(pkfrom)
+            for pkto in seq_set:
+                edges.append((nfrom, cache.nidx(pkto)))
+        arrays['graph_{0}_seq'.format(gname)] = nodes_save(cache, seq.keys())
+        arrays['graph_{0}_req'.format(gname)] = nodes_save(cache, req.keys())
+        arrays['graph_{0}_edges'.format(gname)] = np.array(edges, dtype = np.int64).reshape(-1, 2)
+    cache.arrays.update(arrays)
+    cache.save()
+    return
+
+
+def sparsity_graph_load(cache):
+    """
+    The coherent sparsity graphs in the form of MatrixBuildAlgorithm._coherent_sparsity_graph, None on a miss
+    """
+    arrays = cache.arrays
+    if 'graph_order' not in arrays:
+        return None
+
+    def nodes_load(name):
+        return set(cache.node(idx) for idx in arrays[name])
+
+    csgb = declarative.Bunch(
+        inputs_set  = nodes_load('graph_inputs'),
+        outputs_set = nodes_load('graph_outputs'),
+        order       = int(arrays['graph_order']),
+        active      = nodes_load('graph_active'),
+    )
+    for gname in ['full', 'perturb']:
+        seq = defaultdict(set)
+        req = defaultdict(set)
+        #the keys are kept even for nodes without edges, as the solvers treat every key as a node
+        for idx in arrays['graph_{0}_seq'.format(gname)]:
+            seq[cache.node(idx)]
+        for idx in arrays['graph_{0}_req'.format(gname)]:
+            req[cache.node(idx)]
+        for nfrom, nto in arrays['graph_{0}_edges'.format(gname)]:
+            pkfrom = cache.node(nfrom)
+            pkto = cache.node(nto)
+            seq[pkfrom].add(pkto)
+            req[pkto].add(pkfrom)
+        csgb['seq_' + gname] = seq
+        csgb['req_' + gname] = req
+    cache.loaded.add('graph')
+    return csgb
+
+
+def solver_graph_name(solver, graph):
+    csgb = solver.matrix_algorithm.coherent_subgraph_bunch
+    if graph is csgb.compiled_full:
+        return 'full'
+    elif graph is csgb.compiled_perturb:
+        return 'perturb'
+    raise TopologyCacheMiss("Unknown graph")
+
+
+def structure_key_encode(solver, cache, structure_key):
+    """
+    JSON form of a structure_key of SystemSolver._perturbation_iterate or _coupling_solution_generate,
+    which end with the node sets solved for (the sources, or the inputs and outputs). The dropped edges
+    are given by their nodes since the edge slots of the compiled graphs are ordered by the field space
+    of each process.
+    """
+    graph, keep_bytes, floating_edges, sym_edges = structure_key[:4]
+    keep = np.frombuffer(keep_bytes, dtype = bool)
+
+    def pairs(pkpks):
+        return sorted([cache.nidx(pkfrom), cache.nidx(pkto)] for pkfrom, pkto in pkpks)
+    return json.dumps([
+        solver_graph_name(solver, graph),
+        pairs(graph.edge_keys[idx] for idx in np.nonzero(~keep)[0]),
+        pairs(floating_edges),
+        pairs(sym_edges),
+    ] + [
+        sorted(cache.nidx(pk) for pk in pk_set) for pk_set in structure_key[4:]
+    ])
+
+
+def structure_key_decode(solver, cache, kstr):
+    code = json.loads(kstr)
+    gname, dropped, floating_edges, sym_edges = code[:4]
+    csgb = solver.matrix_algorithm.coherent_subgraph_bunch
+    graph = csgb['compiled_' + gname]
+    keep = graph.keep_all()
+    for nfrom, nto in dropped:
+        idx = graph.edge_slots.get((cache.node(nfrom), cache.node(nto)), None)
+        if idx is None:
+            raise TopologyCacheMiss("Edge missing from the graph")
+        keep[idx] = False
+
+    def pairs(pairs):
+        return frozenset((cache.node(nfrom), cache.node(nto)) for nfrom, nto in pairs)
+    return (
+        graph,
+        keep.tobytes(),
+        pairs(floating_edges),
+        pairs(sym_edges),
+    ) + tuple(
+        frozenset(cache.node(idx) for idx in nidxs) for nidxs in code[4:]
+    )
+
+
+def ordering_encode(cache, name, entry):
+    if name == 'ND_order':
+        return [cache.nidx(node) for node in entry]
+    steps = []
+    for step in entry:
+        op = step[0]
+        if op == 'LU':
+            steps.append([op, cache.nidx(step[1]), float(step[2])])
+        elif op == 'householderROW':
+            steps.append([op, cache.nidx(step[1]), sorted(cache.nidx(node) for node in step[2])])
+        else:
+            steps.append([op, cache.nidx(step[1]), cache.nidx(step[2])])
+    return steps
+
+
+def ordering_decode(cache, name, code):
+    if name == 'ND_order':
+        return [cache.node(idx) for idx in code]
+    steps = []
+    for op, nidx, arg in code:
+        if op == 'LU':
+            steps.append((op, cache.node(nidx), arg))
+        elif op == 'householderROW':
+            steps.append((op, cache.node(nidx), frozenset(cache.node(idx) for idx in arg)))
+        else:
+            steps.append((op, cache.node(nidx), cache.node(arg)))
+    return steps
+
+
+def orderings_records(cache):
+    arrays = cache.arrays
+    if 'orderings_keys' not in arrays:
+        return dict()
+    return dict(zip(
+        (str(kstr) for kstr in arrays['orderings_keys']),
+        (str(ostr) for ostr in arrays['orderings']),
+    ))
+
+
+def orderings_save(solver, cache):
+    """
+    Writes the elimination orderings of the structures prepared by the solver, the last stage of the
+    cache. The file is only rewritten if there are new ones.
+    """
+    records_prev = orderings_records(cache)
+    records = dict(records_prev)
+    for structure_key, structure in solver.solver_prepared.structures.items():
+        try:
+            kstr = structure_key_encode(solver, cache, structure_key)
+            ostr = json.dumps(dict(
+                (name, ordering_encode(cache, name, structure[name]))
+                for name in ORDERING_ENTRIES if name in structure
+            ))
+        except TopologyCacheMiss:
+            continue
+        records[kstr] = ostr
+    if records == records_prev:
+        return
+    kstrs = sorted(records.keys())
+    cache.arrays['orderings_keys'] = np.array(kstrs, dtype = np.str_)
+    cache.arrays['orderings'] = np.array([records[kstr] for kstr in kstrs], dtype = np.str_)
+    cache.save()
+    return
+
+
+def orderings_load(solver, cache):
+    """
+    The structure entries of the cached orderings, by the structure_key of the solver
+    """
+    seeds = dict()
+    for kstr, ostr in orderings_records(cache).items():
+        try:
+            structure_key = structure_key_decode(solver, cache, kstr)
+        except TopologyCacheMiss:
+            continue
+        seeds[structure_key] = dict(
+            (name, ordering_decode(cache, name, code)) for name, code in json.loads(ostr).items()
+        )
+    if seeds:
+        cache.loaded.add('orderings')
+    return seeds
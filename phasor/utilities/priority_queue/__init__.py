@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
 
 from .heap_priority_queue import HeapPriorityQueue, Empty
+from .indexed_priority_queue import IndexedPriorityQueue
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+
+#python 2.7 compatibility
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+
+class IndexedPriorityQueue(object):
+    """
+    Binary heap of keys ordered by their cost, with an index from each key to its heap position. Each
+    key is held at most once, so its cost can be changed (:meth:`update`) or the key dropped
+    (:meth:`remove`) in O(log n) rather than leaving stale entries in the heap. Ties in cost are broken
+    by insertion order, so the keys themselves need not be orderable.
+
+    This implementation is **not** threadsafe
+
+    .. automethod:: __init__
+
+    .. automethod:: peek
+
+    .. automethod:: pop
+
+    .. automethod:: update
+
+    .. automethod:: remove
+
+    .. automethod:: cost
+
+    """
+    def __init__(self, iterable = ()):
+        """
+        :param iterable: iterable of initial (cost, key) items
+        """
+        self.heap = []
+        self.index = dict()
+        self._count = 0
+        for cost, key in iterable:
+            self.update(key, cost)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    #python 2.7 compatibility
+    __nonzero__ = __bool__
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def is_empty(self):
+        """
+        Returns True when empty
+        """
+        return not self.heap
+
+    def peek(self):
+        """
+        View the (cost, key) of the first item without discarding
+
+        :raises: :exc:`Queue.Empty` if no items contained
+        """
+        try:
+            cost, count, key = self.heap[0]
+        except IndexError:
+            raise Empty()
+        return cost, key
+
+    def pop(self):
+        """
+        return the (cost, key) of the first item
+
+        :raises: :exc:`Queue.Empty` if no items contained
+        """
+        if not self.heap:
+            raise Empty()
+        cost, count, key = self.heap[0]
+        self._remove_at(0)
+        return cost, key
+
+    def cost(self, key):
+        """
+        The current cost of key
+
+        :raises: :exc:`KeyError` if key is not contained
+        """
+        return self.heap[self.index[key]][0]
+
+    def update(self, key, cost):
+        """
+        Add key with cost, or change the cost of a key already contained
+        """
+        idx = self.index.get(key, None)
+        if idx is None:
+            self._count += 1
+            self.heap.append((cost, self._count, key))
+            idx = len(self.heap) - 1
+            self.index[key] = idx
+            self._sift_up(idx)
+            return
+        cost_prev, count, key = self.heap[idx]
+        self.heap[idx] = (cost, count, key)
+        if cost < cost_prev:
+            self._sift_up(idx)
+        else:
+            self._sift_down(idx)
+        return
+
+    def remove(self, key):
+        """
+        Drop key from the queue, if it is contained. Returns whether it was.
+        """
+        idx = self.index.get(key, None)
+        if idx is None:
+            return False
+        self._remove_at(idx)
+        return True
+
+    def _remove_at(self, idx):
+        heap = self.heap
+        del self.index[heap[idx][2]]
+        last = heap.pop()
+        if idx < len(heap):
+            heap[idx] = last
+            self.index[last[2]] = idx
+            self._sift_up(idx)
+            self._sift_down(self.index[last[2]])
+        return
+
+    def _less(self, idx1, idx2):
+        item1 = self.heap[idx1]
+        item2 = self.heap[idx2]
+        return (item1[0], item1[1]) < (item2[0], item2[1])
+
+    def _swap(self, idx1, idx2):
+        heap = self.heap
+        heap[idx1], heap[idx2] = heap[idx2], heap[idx1]
+        self.index[heap[idx1][2]] = idx1
+        self.index[heap[idx2][2]] = idx2
+
+    def _sift_up(self, idx):
+        while idx > 0:
+            idx_parent = (idx - 1) >> 1
+            if not self._less(idx, idx_parent):
+                break
+            self._swap(idx, idx_parent)
+            idx = idx_parent
+        return
+
+    def _sift_down(self, idx):
+        N = len(self.heap)
+        while True:
+            idx_child = 2 * idx + 1
+            if idx_child >= N:
+                break
+            if idx_child + 1 < N and self._less(idx_child + 1, idx_child):
+                idx_child += 1
+            if not self._less(idx_child, idx):
+                break
+            self._swap(idx, idx_child)
+            idx = idx_child
+        return
@@ -3,6 +3,8 @@
 """
 from __future__ import division, print_function, unicode_literals
 import pytest
+import numpy as np
+import numpy.testing as np_test
 
 from phasor.utilities.mpl.autoniceplot import (
     #AutoPlotSaver,
@@ -94,6 +96,24 @@ def test_regenerate_auto_ooa(plot):
     sys2.print_yaml()
     return
 
+def test_propagation_stack():
+    sys = test_layout(plot = False)
+    #unsorted and on both sides of the targets and lens
+    z_m = np.random.RandomState(0).uniform(-.1, .6, 50)
+    for tname in ['q1', 'q2']:
+        qs = sys.measurements.q_target_z(z_m, tname)
+        for idx, z in enumerate(z_m):
+            q = sys.measurements.q_target_z(z, tname)
+            np_test.assert_allclose(qs.Z[idx], q.Z)
+            np_test.assert_allclose(qs.ZR[idx], q.ZR)
+            np_test.assert_allclose(qs.gouy_phasor[idx], q.gouy_phasor)
+
+    mats = sys.matrix_target_to_z_stack(alm.utils.TargetRight, z_m, invert = True)
+    assert(mats.shape == z_m.shape + (2, 2))
+    for idx, z in enumerate(z_m):
+        np_test.assert_allclose(mats[idx], sys.matrix_target_to_z_single(alm.utils.TargetRight, z, invert = True))
+    return
+
 if __name__=='__main__':
     #print("LAYOUT")
     #test_layout(True)
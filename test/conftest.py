@@ -2,8 +2,14 @@
 """
 """
 from __future__ import division, print_function, unicode_literals
+import multiprocessing
+import numpy as np
 import pytest
 
+from phasor import system
+from phasor import optics
+from phasor import readouts
+
 
 def pytest_addoption(parser):
     parser.addoption(
@@ -23,3 +29,68 @@ def pytest_addoption(parser):
 def plot(request):
     return request.config.getvalue('plot')
     return request.config.option.plot
+
+
+def gensys_cavity(
+        T_itm = .01,
+        L_itm = 0,
+        F_AC  = (1., 10., 100.),
+        **kwargs
+):
+    """
+    Detuned cavity, whose radiation pressure takes more than one perturbative order to converge. The
+    remaining keyword arguments are given to the BGSystem (solver_name, topology_cache_path...).
+    """
+    sys = system.BGSystem(
+        F_AC = np.array(F_AC, dtype = float),
+        **kwargs
+    )
+    sys.own.laser = optics.Laser(
+        F = sys.F_carrier_1064,
+        power_W = 1.,
+    )
+    sys.own.itm = optics.Mirror(T_hr = T_itm, L_hr = L_itm)
+    sys.own.etm = optics.Mirror(T_hr = .01)
+    sys.own.s1 = optics.Space(L_m = 1, L_detune_m = -1e-10)
+    sys.own.etmPD = optics.MagicPD()
+    sys.own.transPD = optics.MagicPD()
+    sys.bond_sequence(
+        sys.laser.po_Fr,
+        sys.itm.po_Bk,
+        sys.s1.po_Fr,
+        sys.etmPD.po_Bk,
+        sys.etm.po_Fr,
+        sys.transPD.po_Fr,
+    )
+    sys.own.etm_DC = readouts.DCReadout(port = sys.etmPD.Wpd.o)
+    sys.own.trans_DC = readouts.DCReadout(port = sys.transPD.Wpd.o)
+    sys.own.ETM_Drive = readouts.ACReadout(
+        portD = sys.etm.Z.d.o,
+        portN = sys.transPD.Wpd.o,
+    )
+    sys.own.ETM_Refl = readouts.ACReadout(
+        portD = sys.etm.Z.d.o,
+        portN = sys.etmPD.Wpd.o,
+    )
+    return sys
+
+
+@pytest.fixture
+def cavity_sys():
+    return gensys_cavity
+
+
+@pytest.fixture
+def setup_count(monkeypatch):
+    """
+    Counts the system builds (BGSystem._setup_sequence), including those in forked worker processes
+    """
+    N_setup = multiprocessing.Value('i', 0)
+    setup_sequence = system.BGSystem._setup_sequence
+
+    def setup_counted(self):
+        with N_setup.get_lock():
+            N_setup.value += 1
+        return setup_sequence(self)
+    monkeypatch.setattr(system.BGSystem, '_setup_sequence', setup_counted)
+    return N_setup
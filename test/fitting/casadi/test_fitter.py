@@ -11,8 +11,13 @@ from phasor.utilities.mpl.autoniceplot import (
 )
 
 import os.path as path
+import numpy as np
+import numpy.testing as np_test
+import casadi
+import declarative
 
 import phasor.fitting.casadi as FIT
+from phasor.math.complex import Complex
 #from YALL.alm.beam import *
 from phasor.alm.measurements import RootSystem
 import phasor.alm.beam as CB
@@ -127,3 +132,41 @@ def test_fitter_jitter(plot):
 if __name__=='__main__':
     print("Fitter")
     test_fitter(True)
+
+
+def test_fiducial_substitute_batch():
+    x = casadi.MX.sym('x')
+    y = casadi.MX.sym('y')
+    #only the fiducial lists are needed from the root
+    root = declarative.Bunch(symbol_fiducial_lists = ([x, y], [2., 3.]))
+    vals = FIT.FitterRoot.symbol_fiducial_substitute_batch(root, [
+        x * y,
+        Complex(x, 2 * y),
+        Complex(1., x),
+        casadi.sin(x) * np.ones((3, 1)),
+    ])
+    np_test.assert_almost_equal(vals[0], 6)
+    np_test.assert_almost_equal(vals[1], 2 + 6j)
+    np_test.assert_almost_equal(vals[2], 1 + 2j)
+    np_test.assert_almost_equal(vals[3], np.sin(2) * np.ones(3))
+
+
+def test_function_compile():
+    x = casadi.MX.sym('x')
+    y = casadi.MX.sym('y')
+    F = np.linspace(1, 10, 5)
+    root = declarative.Bunch(
+        symbol_map         = declarative.Bunch(sym_list = [x, y]),
+        compiled_functions = dict(),
+        function_jit       = False,
+    )
+    xfer = Complex(x * F, y / F)
+    cbunch = FIT.FitterRoot.function_compile(root, 'xfer', xfer)
+    assert(FIT.FitterRoot.function_compile(root, 'xfer', xfer) is cbunch)
+    real, imag = cbunch.function.call([casadi.DM([2., 3.])])
+    np_test.assert_almost_equal(np.asarray(real).squeeze(), 2 * F)
+    np_test.assert_almost_equal(np.asarray(imag).squeeze(), 3 / F)
+    jac = FIT.FitterRoot.function_jacobian(root, 'xfer')
+    jreal, jimag = jac.call([casadi.DM([2., 3.])])
+    np_test.assert_almost_equal(np.asarray(casadi.densify(jreal)), np.stack([F, 0 * F], axis = 1))
+    np_test.assert_almost_equal(np.asarray(casadi.densify(jimag)), np.stack([0 * F, 1 / F], axis = 1))
@@ -92,3 +92,63 @@ def test_sparse_SVDinv():
     pprint(em0_ll)
     return
 
+
+
+def test_nested_dissection_grid():
+    import scipy.sparse as scisparse
+    import scipy.sparse.linalg as scisparselin
+    from phasor.matrix import metis_reorder
+    #2D grid laplacian, where nested dissection should beat the natural ordering
+    n = 20
+    lap1 = scisparse.diags([1, 1], [-1, 1], shape = (n, n))
+    adj = (scisparse.kron(lap1, scisparse.eye(n)) + scisparse.kron(scisparse.eye(n), lap1))
+    adj = (adj > 0).astype(np.int8).tocsr()
+    order = metis_reorder.nested_dissection(adj)
+    assert(sorted(order) == list(range(n * n)))
+
+    A = (adj + 5 * scisparse.eye(n * n)).tocsc()
+
+    def fill(perm):
+        A_p = A[perm][:, perm].tocsc()
+        lu = scisparselin.splu(A_p, permc_spec = 'NATURAL', diag_pivot_thresh = 0)
+        return lu.L.nnz + lu.U.nnz
+    assert(fill(order) < fill(np.arange(n * n)))
+
+
+def test_nested_dissection_structure(monkeypatch):
+    from phasor.matrix import metis_reorder
+    from phasor.matrix.matrix_generic import SolverPrepared
+    rstate = np.random.RandomState(5)
+    arr = rstate.rand(12, 12)
+    arr[arr < .7] = 0
+    np.fill_diagonal(arr, 2)
+
+    prepared = SolverPrepared(DAG_algorithm.inverse_solve_inplace)
+    N_orders = []
+    nested_dissection = metis_reorder.nested_dissection
+
+    def nested_dissection_count(adj):
+        N_orders.append(adj.shape[0])
+        return nested_dissection(adj)
+
+    monkeypatch.setattr(metis_reorder, 'nested_dissection', nested_dissection_count)
+    for idx in range(3):
+        seq = dict()
+        req = dict()
+        edge_map = dict()
+        for idx_c, idx_r in zip(*np.nonzero(arr)):
+            edge_map[idx_c, idx_r] = arr[idx_c, idx_r] * (1 + idx)
+            seq.setdefault(idx_c, set()).add(idx_r)
+            req.setdefault(idx_r, set()).add(idx_c)
+        prepared.inverse_solve_inplace(
+            structure_key     = 'arr',
+            seq               = seq,
+            req               = req,
+            edge_map          = edge_map,
+            inputs_set        = set(range(12)),
+            outputs_set       = set(range(12)),
+            nested_dissection = True,
+        )
+    #the ordering is computed once and then read from the prepared structure
+    assert(len(N_orders) == 1)
+    assert(prepared.structures['arr']['ND_order'])
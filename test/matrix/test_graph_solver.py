@@ -19,9 +19,13 @@ import pickle
 
 from phasor.matrix import graph_algorithm
 from phasor.matrix import DAG_algorithm
+from phasor.matrix import SCC_algorithm
 from phasor.matrix import scisparse_algorithm
+from phasor.matrix import klu_algorithm
 from phasor.matrix import SRE_matrix_algorithms
+from phasor.matrix.matrix_generic import SolverPrepared
 from phasor.utilities.print import pprint
+from phasor.utilities.priority_queue import IndexedPriorityQueue
 
 #from phasor.utilities.np import logspaced
 
@@ -217,6 +221,393 @@ def test_graph_solver_r10():
     arr = np.random.rand(10, 10)
     check_arr(arr, )
 
+def check_arr_batched(arr, structure = None, **kwargs):
+    N_freq = arr.shape[-1]
+    seq = collections.defaultdict(set)
+    req = collections.defaultdict(set)
+    edge_map = dict()
+    for idx_c in range(arr.shape[0]):
+        for idx_r in range(arr.shape[1]):
+            v = arr[idx_c, idx_r]
+            if np.any(v != 0):
+                edge_map[idx_c, idx_r] = v
+                seq[idx_c].add(idx_r)
+                req[idx_r].add(idx_c)
+    sbunch = scisparse_algorithm.inverse_solve_inplace(
+        seq         = seq,
+        req         = req,
+        inputs_set  = set(range(arr.shape[0])),
+        outputs_set = set(range(arr.shape[1])),
+        edge_map    = edge_map,
+        structure   = structure,
+        **kwargs
+    )
+    for idx_f in range(N_freq):
+        arr_inv = np.linalg.inv(arr[:, :, idx_f])
+        arr_inv2 = np.zeros_like(arr_inv)
+        for (idx_c, idx_r), v in sbunch.edge_map.items():
+            arr_inv2[idx_c, idx_r] = v[idx_f]
+        np_test.assert_almost_equal(arr_inv, arr_inv2)
+
+
+def test_graph_solver_batched():
+    #frequency-dependent edges, solved batched and pointwise
+    N_freq = 5
+    arr = np.random.rand(6, 6, N_freq) + 1j * np.random.rand(6, 6, N_freq)
+    arr[1, 3] = 0
+    arr[4, 0] = 0
+    for batched in [True, False]:
+        check_arr_batched(arr, batched = batched)
+    #falls back to SuperLU without scikits.umfpack
+    check_arr_batched(arr, matrix_solver = scisparse_algorithm._solve_batched_umfpack)
+
+
+def test_graph_solver_umfpack():
+    pytest.importorskip('scikits.umfpack')
+    N_freq = 5
+    arr = np.random.rand(6, 6, N_freq) + 1j * np.random.rand(6, 6, N_freq)
+    arr[1, 3] = 0
+    arr[4, 0] = 0
+    structure = dict()
+    for idx in range(2):
+        check_arr_batched(
+            arr * (1 + idx),
+            structure     = structure,
+            matrix_solver = scisparse_algorithm._solve_batched_umfpack,
+        )
+    #the symbolic factorization is shared by every point of both solves
+    assert(structure['umfpack_N_symbolic'] == 1)
+
+
+def test_graph_solver_klu():
+    check_arr(np.array([[.1, 1, 1], [1, 1, -1], [-1, 1, 1]]), solver = klu_algorithm)
+    #block triangular, with a small pivot forcing the dense fallback in the cavity block
+    arr = np.array([
+        [1, 1, 0, 0, 0],
+        [0, 1e-4, 1, 0, .3],
+        [0, 1, 1, 0, 0],
+        [0, 0, 0, 2, 1],
+        [0, 0, 0, 0, 1],
+    ])
+    check_arr(arr, solver = klu_algorithm)
+    check_arr(np.random.rand(10, 10), solver = klu_algorithm)
+
+def test_graph_solver_tape():
+    rstate = np.random.RandomState(1)
+    arr = rstate.rand(8, 8)
+    arr[arr < .4] = 0
+    np.fill_diagonal(arr, 1 + rstate.rand(8))
+    structure = dict()
+    check_arr(arr, solver = DAG_algorithm, structure = structure, elimination_tape = True)
+    N_steps = len(structure['elimination_tape'])
+    assert(structure['elimination_tape_replayed'] == 0)
+
+    #same structure at another parameter point replays the whole tape
+    arr2 = arr * (1 + .1 * rstate.rand(8, 8))
+    check_arr(arr2, solver = DAG_algorithm, structure = structure, elimination_tape = True)
+    assert(structure['elimination_tape_replayed'] == N_steps)
+
+    #tiny diagonals fail the growth check and the solve falls back to a fresh plan
+    arr3 = np.where(arr != 0, 10 * rstate.rand(8, 8), 0)
+    np.fill_diagonal(arr3, 1e-6)
+    check_arr(arr3, solver = DAG_algorithm, structure = structure, elimination_tape = True)
+    assert(structure['elimination_tape_replayed'] < N_steps)
+
+def test_graph_solver_tape_readout(cavity_sys):
+    sys = cavity_sys(solver_name = 'loop_LUQ_tape')
+    AC = sys.ETM_Drive.AC_sensitivity
+    prepared = sys.solution.solver_prepared
+    #the coupling solve of the readout is the most recently used structure
+    structure = next(reversed(prepared.structures.values()))
+    N_steps = len(structure['elimination_tape'])
+    assert(N_steps > 0)
+    assert(structure['elimination_tape_replayed'] == 0)
+
+    #the readout solve at the updated couplings replays the whole tape
+    sys.element_update(sys.itm, T_hr = .02)
+    sys.ETM_Drive.AC_sensitivity
+    assert(next(reversed(prepared.structures.values())) is structure)
+    assert(structure['elimination_tape_replayed'] == N_steps)
+    sys_ref = cavity_sys(T_itm = .02)
+    np_test.assert_almost_equal(sys.ETM_Drive.AC_sensitivity / sys_ref.ETM_Drive.AC_sensitivity, 1)
+
+def test_graph_solver_edge_buffer():
+    check_arr(np.array([[.1, 1, 1], [1, 1, -1], [-1, 1, 1]]), solver = DAG_algorithm, edge_buffer = True)
+    rstate = np.random.RandomState(3)
+    N_freq = 7
+    arr = rstate.rand(8, 8, N_freq) + 1j * rstate.rand(8, 8, N_freq)
+    arr[rstate.rand(8, 8) < .5] = 0
+    for idx in range(8):
+        arr[idx, idx] = 2 + rstate.rand(N_freq)
+    seq = collections.defaultdict(set)
+    req = collections.defaultdict(set)
+    edge_map = dict()
+    for idx_c in range(arr.shape[0]):
+        for idx_r in range(arr.shape[1]):
+            v = arr[idx_c, idx_r]
+            if np.any(v != 0):
+                edge_map[idx_c, idx_r] = v
+                seq[idx_c].add(idx_r)
+                req[idx_r].add(idx_c)
+    sbunch = DAG_algorithm.inverse_solve_inplace(
+        seq         = seq,
+        req         = req,
+        inputs_set  = set(range(arr.shape[0])),
+        outputs_set = set(range(arr.shape[1])),
+        edge_map    = edge_map,
+        edge_buffer = True,
+    )
+    for idx_f in range(N_freq):
+        arr_inv = np.linalg.inv(arr[:, :, idx_f])
+        arr_inv2 = np.zeros_like(arr_inv)
+        for (idx_c, idx_r), v in sbunch.edge_map.items():
+            arr_inv2[idx_c, idx_r] = v[idx_f]
+        np_test.assert_almost_equal(arr_inv, arr_inv2)
+
+
+
+def test_solvers_registry_edge_buffer(monkeypatch):
+    from phasor.matrix.solvers_registry import solvers_all
+    from phasor.matrix.edge_buffer import EdgeBuffer
+    N_buffered = []
+    to_dict = EdgeBuffer.to_dict
+
+    def to_dict_counted(self):
+        N_buffered.append(self)
+        return to_dict(self)
+    monkeypatch.setattr(EdgeBuffer, 'to_dict', to_dict_counted)
+
+    rstate = np.random.RandomState(4)
+    N_freq = 5
+    arr = rstate.rand(10, 10, N_freq) + 1j * rstate.rand(10, 10, N_freq)
+    arr[rstate.rand(10, 10) < .6] = 0
+    for idx in range(10):
+        arr[idx, idx] = 2 + rstate.rand(N_freq)
+
+    inverses = dict()
+    for solver_name in ['loop_LUQ', 'loop_LUQ_buffered']:
+        seq = collections.defaultdict(set)
+        req = collections.defaultdict(set)
+        edge_map = dict()
+        for idx_c in range(arr.shape[0]):
+            for idx_r in range(arr.shape[1]):
+                v = arr[idx_c, idx_r]
+                if np.any(v != 0):
+                    edge_map[idx_c, idx_r] = v
+                    seq[idx_c].add(idx_r)
+                    req[idx_r].add(idx_c)
+        solver = solvers_all[solver_name]()
+        sbunch = solver.inverse_solve_inplace(
+            seq         = seq,
+            req         = req,
+            inputs_set  = set(range(arr.shape[0])),
+            outputs_set = set(range(arr.shape[1])),
+            edge_map    = edge_map,
+        )
+        inverses[solver_name] = sbunch.edge_map
+    #only the registry entry with the buffer goes through it
+    assert(len(N_buffered) == 1)
+
+    inv = inverses['loop_LUQ']
+    inv_buf = inverses['loop_LUQ_buffered']
+    assert(set(inv.keys()) == set(inv_buf.keys()))
+    for key, val in inv.items():
+        np_test.assert_almost_equal(inv_buf[key], val)
+
+def scattering_graph(arr):
+    seq = collections.defaultdict(set)
+    req = collections.defaultdict(set)
+    edge_map = dict()
+    for idx_c in range(arr.shape[0]):
+        for idx_r in range(arr.shape[1]):
+            v = arr[idx_c, idx_r]
+            if v != 0:
+                edge_map[idx_c, idx_r] = v
+                seq[idx_c].add(idx_r)
+                req[idx_r].add(idx_c)
+    return seq, req, edge_map
+
+
+def test_graph_solver_SCC():
+    rstate = np.random.RandomState(4)
+    #three cavities in a chain, with one-way links between them
+    arr = np.zeros((9, 9))
+    for idx in range(0, 9, 3):
+        arr[idx:idx+3, idx:idx+3] = .3 * rstate.rand(3, 3)
+    arr[1, 4] = .5
+    arr[5, 7] = .5
+    arr[2, 8] = .2
+    structure = dict()
+
+    def check(arr):
+        sources = dict((idx, 1 + idx) for idx in range(0, 9, 3))
+        kw = dict(
+            inputs_set  = set(range(9)),
+            outputs_set = set(range(9)),
+            scattering  = True,
+        )
+        seq, req, edge_map = scattering_graph(arr)
+        sbunch = SCC_algorithm.inverse_solve_inplace(
+            seq, req,
+            edge_map   = edge_map,
+            inputs_map = dict(sources),
+            structure  = structure,
+            **kw
+        )
+        seq, req, edge_map = scattering_graph(arr)
+        sbunch2 = DAG_algorithm.inverse_solve_inplace(
+            seq, req,
+            edge_map   = edge_map,
+            inputs_map = dict(sources),
+            **kw
+        )
+        assert(set(sbunch.edge_map.keys()) == set(sbunch2.edge_map.keys()))
+        for key, val in sbunch2.edge_map.items():
+            np_test.assert_almost_equal(sbunch.edge_map[key], val)
+        for key, val in sbunch2.outputs_map.items():
+            np_test.assert_almost_equal(sbunch.outputs_map[key], val)
+
+    check(arr)
+    assert(len(structure['SCC'].blocks) == 3)
+    assert(structure['SCC_N_solved'] == 3)
+
+    #changing the last cavity re-solves only that block
+    arr2 = arr.copy()
+    arr2[6:9, 6:9] *= 1.1
+    check(arr2)
+    assert(structure['SCC_N_solved'] == 1)
+    assert(structure['SCC_N_propagated'] == 1)
+
+    #changing the first propagates down the whole chain
+    arr3 = arr2.copy()
+    arr3[0, 1] *= 1.1
+    check(arr3)
+    assert(structure['SCC_N_solved'] == 1)
+    assert(structure['SCC_N_propagated'] == 3)
+
+
+def test_graph_solver_SCC_readout(cavity_sys):
+    sys = cavity_sys(solver_name = 'loop_LUQ_SCC')
+    sys.ETM_Drive.AC_sensitivity
+    prepared = sys.solution.solver_prepared
+    #the coupling solve of the readout is the most recently used structure
+    structure = next(reversed(prepared.structures.values()))
+    N_active = len(structure['SCC'].active)
+    assert(structure['SCC_N_solved'] == N_active)
+
+    N_prepared = prepared.N_prepared
+    sys.element_update(sys.itm, T_hr = .02)
+    sys.ETM_Drive.AC_sensitivity
+    #the readout solve keeps its blocks, re-solving only those holding the changed couplings
+    assert(next(reversed(prepared.structures.values())) is structure)
+    assert(prepared.N_prepared == N_prepared)
+    assert(0 < structure['SCC_N_solved'] < N_active)
+    sys_ref = cavity_sys(T_itm = .02)
+    np_test.assert_almost_equal(sys.ETM_Drive.AC_sensitivity / sys_ref.ETM_Drive.AC_sensitivity, 1)
+
+
+def test_solver_prepared_LRU():
+    arr = np.array([[.1, .5, 0], [.2, 0, .3], [0, .4, .1]])
+    prepared = SolverPrepared(DAG_algorithm.inverse_solve_inplace)
+
+    def solve(key):
+        seq, req, edge_map = scattering_graph(arr)
+        prepared.inverse_solve_inplace(
+            seq           = seq,
+            req           = req,
+            structure_key = key,
+            edge_map      = edge_map,
+            inputs_set    = set(range(3)),
+            outputs_set   = set(range(3)),
+            scattering    = True,
+        )
+        return prepared.structures[key]
+
+    N_max = prepared.N_structures_max
+    structures = [solve(key) for key in range(N_max)]
+    assert(prepared.N_prepared == N_max)
+    #one more structure evicts only the least recently used
+    solve(N_max)
+    assert(prepared.N_evicted == 1)
+    assert(0 not in prepared.structures)
+    for key in range(1, N_max):
+        assert(solve(key) is structures[key])
+    assert(prepared.N_reused == N_max - 1)
+    assert(prepared.N_prepared == N_max + 1)
+    #the recently used ones stay, the oldest is now N_max
+    solve(0)
+    assert(N_max not in prepared.structures)
+    assert(solve(1) is structures[1])
+
+
+def test_solver_prepared_purge(monkeypatch):
+    from phasor.matrix import matrix_generic
+    N_purged = []
+    purge_reqless_inplace = matrix_generic.purge_reqless_inplace
+
+    def purge_counted(**kwargs):
+        N_purged.append(1)
+        return purge_reqless_inplace(**kwargs)
+    monkeypatch.setattr(matrix_generic, 'purge_reqless_inplace', purge_counted)
+
+    #node 3 only feeds the others, so it is purged without being driven
+    arr = np.array([[.1, .5, 0, 0], [.2, 0, .3, 0], [0, .4, .1, 0], [.3, 0, 0, .2]])
+    prepared = SolverPrepared(DAG_algorithm.inverse_solve_inplace)
+
+    def solve(arr):
+        seq, req, edge_map = scattering_graph(arr)
+        return prepared.inverse_solve_inplace(
+            seq           = seq,
+            req           = req,
+            structure_key = 'graph',
+            edge_map      = edge_map,
+            inputs_set    = set(range(3)),
+            outputs_set   = set(range(3)),
+            scattering    = True,
+        )
+    solve(arr)
+    assert(len(N_purged) == 1)
+    purge_set, seq_beta_purge, req_alpha_purge = prepared.structures['graph']['purge']
+    assert(3 in purge_set)
+
+    #the same structure at other values replays the recorded purge
+    sbunch2 = solve(2 * arr)
+    assert(len(N_purged) == 1)
+    assert(prepared.N_reused == 1)
+    seq, req, edge_map = scattering_graph(2 * arr)
+    sbunch_ref = DAG_algorithm.inverse_solve_inplace(
+        seq,
+        req,
+        edge_map    = edge_map,
+        inputs_set  = set(range(3)),
+        outputs_set = set(range(3)),
+        scattering  = True,
+    )
+    assert(set(sbunch2.edge_map.keys()) == set(sbunch_ref.edge_map.keys()))
+    for key, val in sbunch_ref.edge_map.items():
+        np_test.assert_almost_equal(sbunch2.edge_map[key], val)
+
+
+def test_indexed_priority_queue():
+    rstate = np.random.RandomState(2)
+    costs = dict((('n', idx), rstate.rand()) for idx in range(50))
+    pqueue = IndexedPriorityQueue((c, k) for k, c in costs.items())
+    #change half of the costs and drop a few of the keys
+    for idx in range(0, 50, 2):
+        costs['n', idx] = rstate.rand()
+        pqueue.update(('n', idx), costs['n', idx])
+    for idx in range(0, 50, 7):
+        assert(pqueue.remove(('n', idx)))
+        del costs['n', idx]
+    assert(not pqueue.remove(('n', 0)))
+    assert(len(pqueue) == len(costs))
+    popped = []
+    while pqueue:
+        cost, key = pqueue.pop()
+        assert(cost == costs[key])
+        popped.append(cost)
+    assert(popped == sorted(costs.values()))
+
 
 ## Should tag as "slow"
 #def test_graph_solver_r100():
@@ -5,6 +5,7 @@
 from __future__ import division, print_function, unicode_literals
 import pytest
 import declarative
+import numpy.testing as np_test
 
 
 import phasor.optics as optics
@@ -157,5 +158,33 @@ def test_mirror():
     #F.save('trans_xfer')
     #print("etm_Force[N]", sys.DC_readout('etm_ForceZ'))
 
+@pytest.mark.parametrize('solver_name', [None, 'loop_LUQ_SCC'])
+def test_mirror_update(cavity_sys, setup_count, solver_name):
+    sys = cavity_sys(solver_name = solver_name)
+    sys.ETM_Drive.AC_sensitivity
+    solver = sys.solution
+    N_prepared = solver.solver_prepared.N_prepared
+    sys.element_update(sys.itm, T_hr = .02, L_hr = 1e-4)
+    N_reused = solver.solver_prepared.N_reused
+    sys.ETM_Drive.AC_sensitivity
+    #the system is not built again, and the driven and readout solves keep their prepared structures
+    assert(setup_count.value == 1)
+    assert(sys.solution is solver)
+    assert(solver.solver_prepared.N_prepared == N_prepared)
+    assert(solver.solver_prepared.N_reused == N_reused + 1)
+    assert(sys.itm.T_hr == .02)
+
+    sys_ref = cavity_sys(T_itm = .02, L_itm = 1e-4)
+    np_test.assert_almost_equal(sys.trans_DC.DC_readout, sys_ref.trans_DC.DC_readout)
+    np_test.assert_almost_equal(sys.ETM_Drive.AC_sensitivity / sys_ref.ETM_Drive.AC_sensitivity, 1)
+
+    #dropping the transmission removes couplings, which needs a new system
+    DC = sys.trans_DC.DC_readout
+    with pytest.raises(RuntimeError):
+        sys.element_update(sys.itm, T_hr = 0)
+    assert(sys.itm.T_hr == .02)
+    np_test.assert_almost_equal(sys.trans_DC.DC_readout, DC)
+
+
 if __name__ == '__main__':
     test_mirror()
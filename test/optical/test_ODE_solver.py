@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+
+import numpy.testing as np_test
+import numpy as np
+import declarative
+
+from phasor import system
+from phasor.optics import ODE_solver
+from phasor.optics.models import KTP_test_stand
+
+
+def KTP_system(power_W, **kwargs):
+    db = declarative.DeepBunch()
+    db.test.PSLR.power.val = power_W
+    for name, val in kwargs.items():
+        db.test.ktp[name] = val
+    sys = system.BGSystem(
+        ctree = db,
+    )
+    sys.own.test = KTP_test_stand.KTPTestStand()
+    return sys
+
+
+def KTP_readouts(power_W, **kwargs):
+    sys = KTP_system(power_W, **kwargs)
+    return [
+        sys.test.DC_R.DC_readout,
+        sys.test.DC_G.DC_readout,
+        sys.test.AC_G.AC_sensitivity,
+        sys.test.AC_RGI.AC_sensitivity,
+    ]
+
+
+def test_ODE_vectorized(monkeypatch):
+    #the array integration must match the integration over dictionaries
+    for power_W in [1, np.linspace(.1, 1, 5)]:
+        vals_vec = KTP_readouts(power_W)
+        monkeypatch.setattr(ODE_solver.ExpMatCoupling, 'vectorized', False)
+        vals_dict = KTP_readouts(power_W)
+        monkeypatch.undo()
+        for val_vec, val_dict in zip(vals_vec, vals_dict):
+            np_test.assert_allclose(val_vec, val_dict, rtol = 1e-10)
+
+    #split into chunks of points
+    monkeypatch.setattr(ODE_solver.ExpMatCoupling, 'numeric_chunk_points', 2)
+    vals_chunked = KTP_readouts(np.linspace(.1, 1, 5))
+    for val_chunked, val_dict in zip(vals_chunked, vals_dict):
+        np_test.assert_allclose(val_chunked, val_dict, rtol = 1e-10)
+
+
+def KTP_adaptive(power_W, **kwargs):
+    sys = KTP_system(power_W, **kwargs)
+    vals = [
+        sys.test.DC_G.DC_readout,
+        sys.test.AC_G.AC_sensitivity,
+    ]
+    return vals, sys.test.ktp.ode_stats()
+
+
+def test_ODE_adaptive():
+    #low pump takes few steps
+    vals, stats = KTP_adaptive(1e-3, ode_adaptive = True)
+    assert(stats.N_solutions > 0)
+    assert(stats.N_steps_last <= 4)
+
+    vals_ref, stats_ref = KTP_adaptive(1, N_ode = 400)
+    assert(stats_ref.N_steps_last == 400)
+    vals, stats = KTP_adaptive(1, ode_adaptive = True)
+    vals_fixed, stats_fixed = KTP_adaptive(1, N_ode = 10)
+    for val, val_ref, val_fixed in zip(vals, vals_ref, vals_fixed):
+        np_test.assert_allclose(val, val_ref, rtol = 2e-4)
+        #more accurate than the default fixed steps
+        assert(abs(val / val_ref - 1) < abs(val_fixed / val_ref - 1) / 10)
+    assert(10 < stats.N_steps_last < 400)
@@ -132,8 +132,12 @@ def test_mich():
     print("ACnoise", AC_noise)
     print("ACnoise_rel", (AC_noise / N_expect)**2)
 
+    psd_sum = 0
     for source, psd in sys.asym_drive.AC_PSD_by_source.items():
         print(source, psd)
+        psd_sum = psd_sum + psd
+    #the per-source PSDs partition the total
+    np_test.assert_almost_equal(psd_sum / sys.asym_drive.AC_PSD, 1)
 
     np_test.assert_almost_equal(N_expect / AC_noise, 1, 3)
 
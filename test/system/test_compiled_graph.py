@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+import numpy as np
+import numpy.testing as np_test
+
+from phasor.system import matrix_algorithm
+from phasor.system.compiled_graph import CompiledCouplingGraph
+
+
+def nonempty(setdict):
+    return dict((k, set(v)) for k, v in setdict.items() if v)
+
+
+def test_compiled_graph_roundtrip(cavity_sys):
+    sys = cavity_sys()
+    sys.etm_DC.DC_readout
+    csgb = sys.matrix_algorithm.coherent_subgraph_bunch
+    for graph, seq, req in [
+        (csgb.compiled_full, csgb.seq_full, csgb.req_full),
+        (csgb.compiled_perturb, csgb.seq_perturb, csgb.req_perturb),
+    ]:
+        seq2, req2 = graph.seqreq_generate()
+        assert(nonempty(seq2) == nonempty(seq))
+        assert(nonempty(req2) == nonempty(req))
+        assert(graph.N_edges == sum(len(s) for s in seq.values()))
+
+        #dropping edges must keep the containers balanced
+        keep = graph.keep_all()
+        keep[::2] = False
+        seq3, req3 = graph.seqreq_generate(keep)
+        N = 0
+        for node, sset in seq3.items():
+            for snode in sset:
+                assert(node in req3[snode])
+                N += 1
+        assert(N == np.count_nonzero(keep))
+
+
+def test_compiled_graph_once(monkeypatch, cavity_sys):
+    N_compiled = []
+    N_generated = []
+    seqreq_generate = CompiledCouplingGraph.seqreq_generate
+
+    class CompiledCounted(CompiledCouplingGraph):
+        def __init__(self, **kwargs):
+            N_compiled.append(self)
+            super(CompiledCounted, self).__init__(**kwargs)
+
+        def seqreq_generate(self, keep = None):
+            N_generated.append(self)
+            return seqreq_generate(self, keep)
+    monkeypatch.setattr(matrix_algorithm, 'CompiledCouplingGraph', CompiledCounted)
+
+    sys = cavity_sys()
+    sys.etm_DC.DC_readout
+    sys.ETM_Drive.AC_sensitivity
+    #the full and perturbative graphs are compiled once, every solve only draws its containers
+    assert(len(N_compiled) == 2)
+    assert(len(sys.solution.driven_solution_bunches) > 2)
+    assert(len(N_generated) >= len(sys.solution.driven_solution_bunches) - 1)
+    assert(set(N_generated) <= set(N_compiled))
+
+
+def test_compiled_graph_solve(cavity_sys):
+    sys = cavity_sys()
+    #checks that the solve through the compiled graph is consistent between readout sets
+    sol_all = sys.solution.driven_solution_get('all')
+    sol_pert = sys.solution.driven_solution_get('perturbative')
+    for node, val in sol_pert.solution.items():
+        np_test.assert_almost_equal(sol_all.solution.get(node, 0), val)
+    assert(np.all(np.isfinite(sys.ETM_Drive.AC_sensitivity)))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+import pickle
+
+from phasor import system
+from phasor.base import DictKey, FrequencyKey
+
+
+def test_keys_interned():
+    sys = system.BGSystem()
+    F1 = sys.F_carrier_1064
+    k1 = DictKey(a = 1, b = FrequencyKey({F1 : 1}))
+    k2 = DictKey({'b' : FrequencyKey({F1 : 1})}, a = 1)
+    assert(k1 is k2)
+    assert(hash(k1) == k1.id)
+    assert(k1 != DictKey(a = 1))
+    assert((DictKey(a = 1) | DictKey(b = FrequencyKey({F1 : 1}))) is k1)
+    assert(k1.purge_keys('b', 'c') is DictKey(a = 1))
+    assert(k1.replace_keys({'a' : 2}) is DictKey(a = 2, b = k1['b']))
+
+    fk = FrequencyKey({F1 : 1})
+    assert(fk + fk is FrequencyKey({F1 : 2}))
+    assert((fk - fk).DC_is())
+    assert(fk - fk is FrequencyKey({}))
+    assert(-fk is 2 * fk - 3 * fk)
+    #the dictionary handed over is copied, not held
+    F_dict = {F1 : 1}
+    fk2 = FrequencyKey(F_dict)
+    F_dict[F1] = 3
+    assert(fk2 is fk)
+
+    kpickle = pickle.loads(pickle.dumps(DictKey(a = 1, c = 'x')))
+    assert(kpickle is DictKey(a = 1, c = 'x'))
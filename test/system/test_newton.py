@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+import numpy as np
+import numpy.testing as np_test
+import declarative
+
+from phasor import system
+from phasor import signals
+from phasor import readouts
+from phasor.signals import ports
+
+
+class QuadraticFeedback(signals.SignalElementBase):
+    """
+    Drives its output with source - gain * input**2
+    """
+    @declarative.dproperty
+    def source(self, val = 1):
+        return val
+
+    @declarative.dproperty
+    def gain(self, val = 1):
+        return val
+
+    @declarative.dproperty
+    def ps_In(self):
+        return ports.SignalInPort()
+
+    @declarative.dproperty
+    def ps_Out(self):
+        return ports.SignalOutPort()
+
+    @declarative.mproperty
+    def kDC(self):
+        return ports.DictKey({ports.ClassicalFreqKey: ports.FrequencyKey({})})
+
+    def system_setup_ports_initial(self, ports_algorithm):
+        ports_algorithm.coherent_sources_needed(self.ps_Out.o, self.kDC)
+        ports_algorithm.port_coupling_needed(self.ps_In.i, self.kDC)
+
+    def system_setup_coupling(self, matrix_algorithm):
+        matrix_algorithm.coherent_sources_insert(self.ps_Out.o, self.kDC, self.source)
+        matrix_algorithm.port_coupling_insert(
+            self.ps_In.i, self.kDC,
+            self.ps_Out.o, self.kDC,
+            -self.gain, (self.ps_In.i, self.kDC),
+        )
+
+
+class CubicFeedback(QuadraticFeedback):
+    """
+    Drives its output with source - gain * input * inputB * inputC, through an edge from the input with
+    the other two inputs as its factors
+    """
+    @declarative.dproperty
+    def ps_InB(self):
+        return ports.SignalInPort()
+
+    @declarative.dproperty
+    def ps_InC(self):
+        return ports.SignalInPort()
+
+    def system_setup_ports_initial(self, ports_algorithm):
+        super(CubicFeedback, self).system_setup_ports_initial(ports_algorithm)
+        ports_algorithm.port_coupling_needed(self.ps_InB.i, self.kDC)
+        ports_algorithm.port_coupling_needed(self.ps_InC.i, self.kDC)
+
+    def system_setup_coupling(self, matrix_algorithm):
+        matrix_algorithm.coherent_sources_insert(self.ps_Out.o, self.kDC, self.source)
+        matrix_algorithm.port_coupling_insert(
+            self.ps_In.i, self.kDC,
+            self.ps_Out.o, self.kDC,
+            -self.gain, (self.ps_InB.i, self.kDC), (self.ps_InC.i, self.kDC),
+        )
+
+
+def gensys(nonlinear_solver, anderson_depth = 0):
+    sys = system.BGSystem(
+        nonlinear_solver = nonlinear_solver,
+        anderson_depth   = anderson_depth,
+    )
+    sys.own.quad = QuadraticFeedback(source = 1, gain = 20)
+    sys.own.buf = signals.Gain(gain = 1)
+    sys.bond_sequence(sys.quad.ps_Out, sys.buf.ps_In)
+    sys.bond_sequence(sys.buf.ps_Out, sys.quad.ps_In)
+    sys.own.DC = readouts.DCReadout(port = sys.quad.ps_In.i)
+    return sys
+
+
+def test_newton_quadratic():
+    g = 20
+    x = (-1 + np.sqrt(1 + 4 * g)) / (2 * g)
+    sys_fp = gensys('fixed_point')
+    sys_nr = gensys('newton')
+    np_test.assert_allclose(sys_fp.DC.DC_readout, x, rtol = 1e-3)
+    np_test.assert_allclose(sys_nr.DC.DC_readout, x, rtol = 1e-6)
+    hist_fp = sys_fp.solution.solve_history()
+    hist_nr = sys_nr.solution.solve_history()
+    assert(hist_nr.nonlinear_solver == 'newton')
+    assert(hist_nr.N_iterations == len(hist_nr.delta_v))
+    assert(hist_nr.N_iterations < hist_fp.N_iterations)
+
+
+def gensys_cubic(nonlinear_solver, g = 20):
+    sys = system.BGSystem(nonlinear_solver = nonlinear_solver)
+    sys.own.cub = CubicFeedback(source = 1, gain = g)
+    sys.own.buf = signals.Gain(gain = 1)
+    sys.own.bufB = signals.Gain(gain = 1)
+    sys.own.bufC = signals.Gain(gain = 1)
+    for buf, ps_In in [(sys.buf, sys.cub.ps_In), (sys.bufB, sys.cub.ps_InB), (sys.bufC, sys.cub.ps_InC)]:
+        sys.bond(sys.cub.ps_Out, buf.ps_In)
+        sys.bond(buf.ps_Out, ps_In)
+    sys.own.DC = readouts.DCReadout(port = sys.cub.ps_InB.i)
+    return sys
+
+
+def test_newton_product():
+    g = 20
+    #the real root of g * x**3 + x - 1
+    roots = np.roots([g, 0, 1, -1])
+    x = roots[np.argmin(abs(roots.imag))].real
+    sys = gensys_cubic('newton', g = g)
+    #the fixed point iteration diverges here (|3 g x**2| > 1), Newton converges with the derivatives along
+    #the factors of the edge
+    np_test.assert_allclose(sys.DC.DC_readout, x, rtol = 1e-6)
+    hist = sys.solution.solve_history()
+    assert(hist.N_iterations < 20)
+
+    #only the Newton mode solves for the input of the edge, to take the derivatives along its factors
+    pkfrom = (sys.cub.ps_In.i, sys.cub.kDC)
+    assert(pkfrom in sys.matrix_algorithm.coherent_subgraph_bunch.outputs_set)
+    #at a gain where the fixed point iteration converges
+    sys_fp = gensys_cubic('fixed_point', g = .1)
+    sys_fp.DC.DC_readout
+    assert(pkfrom not in sys_fp.matrix_algorithm.coherent_subgraph_bunch.outputs_set)
+
+
+def test_anderson_quadratic():
+    g = 20
+    x = (-1 + np.sqrt(1 + 4 * g)) / (2 * g)
+    sys_fp = gensys('fixed_point')
+    sys_aa = gensys('fixed_point', anderson_depth = 3)
+    np_test.assert_allclose(sys_aa.DC.DC_readout, x, rtol = 1e-4)
+    hist_fp = sys_fp.solution.solve_history()
+    hist_aa = sys_aa.solution.solve_history()
+    assert(np.any(hist_aa.accelerated))
+    assert(not np.any(hist_fp.accelerated))
+    assert(hist_aa.N_iterations < hist_fp.N_iterations)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+import numpy as np
+
+from phasor import system
+from phasor import optics
+from phasor import readouts
+from phasor.system import ports_algorithm
+
+
+def michelson_sys():
+    """
+    Michelson with a beamsplitter, so that the ports of the arms form groups of several bonds
+    """
+    sys = system.BGSystem(
+        F_AC = np.array([10.]),
+    )
+    sys.own.laser = optics.Laser(
+        F = sys.F_carrier_1064,
+        power_W = 1.,
+    )
+    sys.own.bs = optics.Mirror(T_hr = .5, AOI_deg = 45)
+    sys.own.mX = optics.Mirror(T_hr = 0)
+    sys.own.mY = optics.Mirror(T_hr = 0)
+    sys.own.sX = optics.Space(L_m = 1)
+    sys.own.sY = optics.Space(L_m = 1.1)
+    sys.own.asPD = optics.MagicPD()
+    sys.bond_sequence(sys.laser.po_Fr, sys.bs.po_FrA)
+    sys.bond_sequence(sys.bs.po_FrB, sys.sX.po_Fr, sys.mX.po_Fr)
+    sys.bond_sequence(sys.bs.po_BkA, sys.sY.po_Fr, sys.mY.po_Fr)
+    sys.bond_sequence(sys.bs.po_BkB, sys.asPD.po_Fr)
+    sys.own.AS_DC = readouts.DCReadout(port = sys.asPD.Wpd.o)
+    sys.own.mX_Drive = readouts.ACReadout(
+        portD = sys.mX.Z.d.o,
+        portN = sys.asPD.Wpd.o,
+    )
+    return sys
+
+
+def test_port_groups(monkeypatch):
+    N_dispersed = []
+    coherent_sources_needed = ports_algorithm.PortUpdatesAlgorithm._coherent_sources_needed
+
+    def needed_counted(self, pto, kto):
+        if pto in self.port_groups:
+            N_dispersed.append((pto, kto))
+        return coherent_sources_needed(self, pto, kto)
+    monkeypatch.setattr(ports_algorithm.PortUpdatesAlgorithm, '_coherent_sources_needed', needed_counted)
+
+    sys = michelson_sys()
+    sys.AS_DC.DC_readout
+    palgo = sys.port_algo
+    stats = palgo.setup_stats
+    #each key is dispersed over a group of bonded ports once, repeated requests stop at the group
+    assert(stats.N_requests_new == len(palgo.group_keys))
+    assert(stats.N_requests_new < stats.N_requests)
+    assert(len(N_dispersed) == sum(len(group) for group, kto in palgo.group_keys))
+    assert(len(set(N_dispersed)) == len(N_dispersed))
+
+    assert(stats.N_iterations == sum(stats.iterations_by_class.values()))
+    assert(stats.keys_per_port_max >= stats.keys_per_port_mean > 0)
+    #the keys of bonded ports are completed over their whole group
+    for port, group in palgo.port_groups.items():
+        assert(port in group)
+        for pother in group:
+            assert(palgo.port_cplgs[pother] == palgo.port_cplgs[port])
+    assert(np.all(np.isfinite(sys.mX_Drive.AC_sensitivity)))
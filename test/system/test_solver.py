@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+import numpy.testing as np_test
+import pytest
+
+from phasor.system import solver_algorithm
+
+
+def test_prepared_solver_reuse(cavity_sys):
+    sys = cavity_sys()
+    sol = sys.solution.driven_solution_get('perturbative')
+    prepared = sys.solution.solver_prepared
+    N_orders = len(sys.solution.driven_solution_bunches) - 1
+    #the perturbative orders share one structure, which keeps its purge
+    assert(N_orders > 1)
+    assert(prepared.N_prepared == 1)
+    assert(prepared.N_reused == N_orders - 1)
+    structure, = prepared.structures.values()
+    assert('purge' in structure)
+
+    sys2 = cavity_sys()
+    sys2.solution.solver_prepared = None
+    sol2 = sys2.solution.driven_solution_get('perturbative')
+    #the keys hold the ports of each system, so compare through their printed form
+    vals = dict((str(node), val) for node, val in sol.solution.items())
+    vals2 = dict((str(node), val) for node, val in sol2.solution.items())
+    assert(set(vals.keys()) == set(vals2.keys()))
+    for node, val in vals2.items():
+        np_test.assert_almost_equal(vals[node], val)
+
+
+def test_delta_v_packed(monkeypatch, cavity_sys):
+    def keyed_fail(self, *args):
+        raise AssertionError("delta_v taken over the KeyVectors")
+    delta_v_keyed = solver_algorithm.SystemSolver._delta_v_compute_keyed
+    monkeypatch.setattr(solver_algorithm.SystemSolver, '_delta_v_compute_keyed', keyed_fail)
+    #every order is checked on the packed arrays
+    sys = cavity_sys()
+    solver = sys.solution
+    monkeypatch.setattr(solver_algorithm.SystemSolver, '_delta_v_compute_keyed', delta_v_keyed)
+
+    bunches = solver.driven_solution_bunches
+    for N in range(1, len(bunches) - 1):
+        sbunch = bunches[N]['perturbative']
+        assert(sbunch.solution_packed is not None)
+        sbunch_prev = bunches[N - 1]['perturbative']
+        delta_v, k_worst = solver._delta_v_compute_keyed(sbunch_prev.solution, sbunch.solution)
+        np_test.assert_almost_equal(sbunch.delta_v, delta_v)
+        #the packed array holds the same values as the KeyVector
+        for node, val in sbunch.solution.items():
+            idx = solver.matrix_algorithm.field_space.key_map(node)
+            np_test.assert_almost_equal(sbunch.solution_packed.value(idx), val)
+
+
+@pytest.mark.parametrize('shared', [True, False])
+def test_coupling_solution_shared(monkeypatch, cavity_sys, shared):
+    N_generated = []
+    generate = solver_algorithm.SystemSolver._coupling_solution_generate
+
+    def generate_counted(self, N, inputs_set, outputs_set):
+        N_generated.append(N)
+        return generate(self, N, inputs_set, outputs_set)
+    monkeypatch.setattr(solver_algorithm.SystemSolver, '_coupling_solution_generate', generate_counted)
+
+    sys = cavity_sys(coupling_solution_shared = shared)
+    sets = [('AC', 'AC'), ('AC_sensitivities', 'AC_sensitivities'), ('AC', 'DC')]
+    cbunches = [sys.solution.coupling_solution_get(drive_set, readout_set) for drive_set, readout_set in sets]
+    if shared:
+        #every request was answered by a slice of one solve for the union of the sets
+        assert(len(N_generated) == 1)
+        assert(len(sys.solution.coupling_shared_bunches) == 1)
+    else:
+        assert(len(N_generated) == len(sets))
+        assert(not sys.solution.coupling_shared_bunches)
+    for cbunch in cbunches:
+        for pkfrom, pkto in cbunch.coupling_matrix_inv.keys():
+            assert(pkfrom in cbunch.inputs_set)
+            assert(pkto in cbunch.outputs_set)
+
+    sys_ref = cavity_sys(coupling_solution_shared = not shared)
+    np_test.assert_almost_equal(sys.ETM_Drive.AC_sensitivity / sys_ref.ETM_Drive.AC_sensitivity, 1)
+    np_test.assert_almost_equal(sys.ETM_Refl.AC_sensitivity / sys_ref.ETM_Refl.AC_sensitivity, 1)
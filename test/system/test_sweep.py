@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+import multiprocessing
+import numpy as np
+import numpy.testing as np_test
+
+from phasor import system
+from phasor.system import sweep
+
+
+def test_AC_sweep_chunked(cavity_sys, setup_count):
+    F_Hz = np.logspace(0, 3, 7)
+    sys_full = cavity_sys(F_AC = F_Hz)
+    sys = cavity_sys()
+
+    N_setup = setup_count.value
+    out = system.AC_sweep(
+        sys,
+        F_Hz       = F_Hz,
+        readouts   = [sys.ETM_Drive],
+        quantities = ['AC_PSD', 'AC_sensitivity'],
+        chunk_size = 3,
+    )
+    #the three chunks share one build of the system
+    assert(setup_count.value == N_setup + 1)
+    np_test.assert_almost_equal(out.ETM_Drive.AC_PSD / sys_full.ETM_Drive.AC_PSD, 1)
+    np_test.assert_almost_equal(out.ETM_Drive.AC_sensitivity / sys_full.ETM_Drive.AC_sensitivity, 1)
+
+    N = 0
+    for F_slice, results in system.AC_sweep_chunks(
+        sys,
+        F_Hz       = F_Hz,
+        readouts   = ['ETM_Drive'],
+        quantities = ['AC_PSD'],
+        chunk_size = 4,
+    ):
+        assert(len(results['ETM_Drive'].AC_PSD) == F_slice.stop - F_slice.start)
+        N += 1
+    assert(N == 2)
+
+
+def test_sweep_chunk_reuse(cavity_sys):
+    F_Hz = np.logspace(0, 3, 6)
+    state = sweep.sweep_setup(cavity_sys(), F_Hz[:3], ['ETM_Drive'], ['AC_sensitivity'])
+    sys = state.system
+    sweep.sweep_chunk(state, F_Hz[:3])
+    solver = sys.solution
+    DC_bunch = solver.driven_solution_bunches[1]['perturbative']
+    N_prepared = solver.solver_prepared.N_prepared
+    N_reused = solver.solver_prepared.N_reused
+
+    results = sweep.sweep_chunk(state, F_Hz[3:])
+    #the operating point is kept between the chunks, and the coupling solve of the chunk reuses the
+    #structure prepared by the previous one
+    assert(sys.solution is solver)
+    assert(solver.driven_solution_bunches[1]['perturbative'] is DC_bunch)
+    assert(solver.solver_prepared.N_prepared == N_prepared)
+    assert(solver.solver_prepared.N_reused == N_reused + 1)
+    #only the elements with couplings at the AC keys were injected again
+    assert(sys.s1 in sys._F_AC_elements)
+    assert(sys.laser not in sys._F_AC_elements)
+    assert(not sys._F_AC_driven)
+
+    sys_ref = cavity_sys(F_AC = F_Hz[3:])
+    np_test.assert_almost_equal(results['ETM_Drive']['AC_sensitivity'] / sys_ref.ETM_Drive.AC_sensitivity, 1)
+
+
+def test_AC_sweep_parallel(monkeypatch, cavity_sys, setup_count):
+    F_Hz = np.logspace(0, 3, 7)
+    sys = cavity_sys()
+    out = system.AC_sweep(
+        sys,
+        F_Hz       = F_Hz,
+        readouts   = [sys.ETM_Drive],
+        quantities = ['AC_sensitivity'],
+        chunk_size = 7,
+    )
+
+    #counted in the forked workers as well
+    N_init = multiprocessing.Value('i', 0)
+    worker_init = sweep._worker_init
+
+    def init_counted(state):
+        with N_init.get_lock():
+            N_init.value += 1
+        return worker_init(state)
+    monkeypatch.setattr(sweep, '_worker_init', init_counted)
+    N_setup = setup_count.value
+
+    out_par = system.AC_sweep_parallel(
+        sys,
+        F_Hz       = F_Hz,
+        readouts   = [sys.ETM_Drive],
+        quantities = ['AC_sensitivity'],
+        chunk_size = 2,
+        N_workers  = 2,
+    )
+    np_test.assert_almost_equal(out_par.ETM_Drive.AC_sensitivity / out.ETM_Drive.AC_sensitivity, 1)
+    #one build for the four chunks, handed once to each of the workers
+    assert(setup_count.value == N_setup + 1)
+    assert(N_init.value == 2)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from __future__ import division, print_function, unicode_literals
+import numpy.testing as np_test
+
+from phasor import optics
+
+
+def setdict_str(setdict):
+    return dict((str(k), set(map(str, v))) for k, v in setdict.items())
+
+
+def test_topology_cache(tmpdir, cavity_sys):
+    sys = cavity_sys(solver_name = 'loop_LUQ_tape', topology_cache_path = str(tmpdir))
+    DC = sys.trans_DC.DC_readout
+    AC = sys.ETM_Drive.AC_sensitivity
+    assert(sys.port_algo.setup_stats.cache == 'miss')
+    assert(len(tmpdir.listdir()) == 1)
+    assert(not sys.port_algo.topology_cache.loaded)
+
+    sys2 = cavity_sys(solver_name = 'loop_LUQ_tape', topology_cache_path = str(tmpdir))
+    np_test.assert_almost_equal(sys2.trans_DC.DC_readout, DC)
+    np_test.assert_almost_equal(sys2.ETM_Drive.AC_sensitivity / AC, 1)
+    palgo = sys2.port_algo
+    assert(palgo.setup_stats.cache == 'hit')
+    assert(palgo.setup_stats.N_iterations == 0)
+    assert(palgo.topology_cache.loaded == set(['ports', 'graph', 'orderings']))
+    #the keys and graphs decode to the objects of the new system
+    sys_ref = cavity_sys()
+    sys_ref.trans_DC.DC_readout
+    palgo_ref = sys_ref.port_algo
+    for port, kset in palgo_ref.port_cplgs.items():
+        assert(set(map(str, palgo.port_cplgs[port])) == set(map(str, kset)))
+    csgb = sys2.matrix_algorithm.coherent_subgraph_bunch
+    csgb_ref = sys_ref.matrix_algorithm.coherent_subgraph_bunch
+    assert(setdict_str(csgb.seq_full) == setdict_str(csgb_ref.seq_full))
+    assert(setdict_str(csgb.req_perturb) == setdict_str(csgb_ref.req_perturb))
+    assert(set(map(str, csgb.inputs_set)) == set(map(str, csgb_ref.inputs_set)))
+    assert(set(map(str, csgb.outputs_set)) == set(map(str, csgb_ref.outputs_set)))
+
+    #every structure, of the driven and of the coupling solves, starts from the loaded tape, which is
+    #replayed whole
+    prepared = sys2.solution.solver_prepared
+    assert(prepared.N_seeded == prepared.N_prepared > 1)
+    for structure in prepared.structures.values():
+        assert(structure['elimination_tape_replayed'] == len(structure['elimination_tape']) > 0)
+
+    #parameter changes hit, structural changes miss
+    sys3 = cavity_sys(T_itm = .02, topology_cache_path = str(tmpdir))
+    sys3.trans_DC.DC_readout
+    assert(sys3.port_algo.setup_stats.cache == 'hit')
+    sys4 = cavity_sys(topology_cache_path = str(tmpdir))
+    sys4.own.extra = optics.Mirror(T_hr = .5)
+    sys4.trans_DC.DC_readout
+    assert(sys4.port_algo.setup_stats.cache == 'miss')
+    #as do parameters changing to zero
+    sys5 = cavity_sys(T_itm = 0., topology_cache_path = str(tmpdir))
+    sys5.trans_DC.DC_readout
+    assert(sys5.port_algo.setup_stats.cache == 'miss')